@@ -0,0 +1,98 @@
+import httpx
+
+
+class AsyncMoodleClientException(Exception):
+    pass
+
+
+# Non-blocking counterpart to moodlecli's MoodleClient covering the web service
+# functions used by course builds. Connections are pooled by the shared
+# httpx.AsyncClient passed in.
+class AsyncMoodleClient:
+    def __init__(self, http_client: httpx.AsyncClient, url, token):
+        self.http_client = http_client
+        self.url = url
+        self.service_endpoint = f"{url}/webservice/rest/server.php"
+        self.token = token
+
+    async def _make_request(self, wsfunction, params=None):
+        data = {
+            "wstoken": self.token,
+            "moodlewsrestformat": "json",
+            "wsfunction": wsfunction,
+        }
+        if params:
+            data.update(params)
+
+        response = await self.http_client.post(self.service_endpoint, data=data)
+        response.raise_for_status()
+        response_data = response.json()
+
+        if isinstance(response_data, dict) and "exception" in response_data:
+            raise AsyncMoodleClientException(
+                f"{wsfunction} failed: {response_data.get('message')}"
+            )
+        return response_data
+
+    async def get_role_by_shortname(self, shortname):
+        return await self._make_request(
+            "local_raisecli_get_role_by_shortname",
+            {"shortname": shortname},
+        )
+
+    async def get_user_by_email(self, email):
+        users = await self._make_request(
+            "core_user_get_users_by_field",
+            {"field": "email", "values[0]": email},
+        )
+        if not users:
+            return None
+        return users[0]
+
+    async def get_course_by_shortname(self, course_shortname):
+        return await self._make_request(
+            "core_course_get_courses_by_field",
+            {"field": "shortname", "value": course_shortname},
+        )
+
+    async def copy_course(
+        self, base_course_id, course_name, course_shortname, course_category_id
+    ):
+        return await self._make_request(
+            "core_course_duplicate_course",
+            {
+                "courseid": base_course_id,
+                "fullname": course_name,
+                "shortname": course_shortname,
+                "categoryid": course_category_id,
+            },
+        )
+
+    async def update_course(self, course_id, **fields):
+        params = {"courses[0][id]": course_id}
+        params.update(
+            {f"courses[0][{name}]": value for name, value in fields.items()}
+        )
+        return await self._make_request("core_course_update_courses", params)
+
+    async def enrol_user(self, course_id, user_id, role_id):
+        return await self._make_request(
+            "enrol_manual_enrol_users",
+            {
+                "enrolments[0][courseid]": course_id,
+                "enrolments[0][userid]": user_id,
+                "enrolments[0][roleid]": role_id,
+            },
+        )
+
+    async def get_self_enrolment_methods(self, course_id, role_id):
+        return await self._make_request(
+            "local_raisecli_get_self_enrolment_methods",
+            {"courseid": course_id, "roleid": role_id},
+        )
+
+    async def set_self_enrolment_method_key(self, enrolment_id, enrolment_key):
+        return await self._make_request(
+            "local_raisecli_set_self_enrolment_method_key",
+            {"enrolid": enrolment_id, "enrolkey": enrolment_key},
+        )
@@ -0,0 +1,23 @@
+import threading
+
+
+class BackgroundThread:
+    # Runs run on a daemon thread between start and stop. run should return
+    # once stopped is set, which it can wait on between rounds of work.
+    def __init__(self):
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        raise NotImplementedError
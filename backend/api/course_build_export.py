@@ -0,0 +1,112 @@
+import json
+import queue
+import threading
+
+from sqlalchemy import String, cast, func
+
+from rope.api import database
+from rope.db.schema import CourseBuild
+
+COURSE_BUILD_EXPORT_YIELD_PER = 1000
+# Chunks COPY may get ahead of the client by before it has to wait
+COURSE_BUILD_EXPORT_QUEUE_SIZE = 16
+COURSE_BUILD_EXPORT_PUT_TIMEOUT_SECS = 1
+
+
+class CopyCancelled(Exception):
+    pass
+
+
+def get_course_build_export_query(academic_year, instructor_email, **filters):
+    # Statuses are exported by value, the way the JSON endpoints return them
+    return database.filter_course_builds(
+        database.select_course_builds(
+            func.lower(cast(CourseBuild.status, String)).label("status")
+        ),
+        academic_year,
+        instructor_email,
+        **filters,
+    )
+
+
+def stream_course_builds_ndjson(get_sessionmaker, query):
+    # yield_per streams rows from a server side cursor
+    with get_sessionmaker()() as session:
+        rows = session.execute(
+            query.execution_options(yield_per=COURSE_BUILD_EXPORT_YIELD_PER)
+        ).mappings()
+        for partition in rows.partitions():
+            yield "".join(json.dumps(dict(row)) + "\n" for row in partition)
+
+
+class QueueWriter:
+    # File-like target for COPY that hands each chunk to the response through
+    # a bounded queue and gives up once the client has gone away
+    def __init__(self, chunks, cancelled):
+        self.chunks = chunks
+        self.cancelled = cancelled
+
+    def put(self, item):
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(item, timeout=COURSE_BUILD_EXPORT_PUT_TIMEOUT_SECS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def write(self, data):
+        if not self.put(data):
+            raise CopyCancelled()
+
+
+def render_copy_query(connection, cursor, query):
+    # COPY can't take bind parameters so psycopg2 renders them client side.
+    # Values are processed the way an execute would, e.g. statuses to enum
+    # names, and quoted by the driver for the server the session is on.
+    dialect = connection.dialect
+    compiled = query.compile(dialect=dialect)
+    params = {}
+    for name, value in compiled.params.items():
+        processor = (
+            compiled.binds[name].type.dialect_impl(dialect).bind_processor(dialect)
+        )
+        params[name] = value if processor is None else processor(value)
+    return cursor.mogrify(str(compiled), params).decode()
+
+
+def copy_course_builds_csv(get_sessionmaker, query, writer):
+    try:
+        with get_sessionmaker()() as session:
+            connection = session.connection()
+            cursor = connection.connection.cursor()
+            sql = render_copy_query(connection, cursor, query)
+            cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH CSV HEADER", writer)
+    except CopyCancelled:
+        return
+    except Exception as e:
+        writer.put(e)
+        return
+    writer.put(None)
+
+
+def stream_course_builds_csv(get_sessionmaker, query):
+    chunks = queue.Queue(maxsize=COURSE_BUILD_EXPORT_QUEUE_SIZE)
+    cancelled = threading.Event()
+    thread = threading.Thread(
+        target=copy_course_builds_csv,
+        args=(get_sessionmaker, query, QueueWriter(chunks, cancelled)),
+        daemon=True,
+    )
+    thread.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        cancelled.set()
+        thread.join()
@@ -0,0 +1,123 @@
+import json
+import logging
+import select
+import time
+
+from sqlalchemy import delete, select as sql_select
+
+from rope.api import utils
+from rope.api.background import BackgroundThread
+from rope.db.schema import CourseBuildOutbox
+
+# The most messages send_message_batch accepts
+COURSE_BUILD_OUTBOX_BATCH_SIZE = 10
+# Channel notified by the course_build_outbox_inserted trigger whenever rows
+# are added to the outbox
+COURSE_BUILD_OUTBOX_CHANNEL = "course_build_outbox_inserted"
+# Upper bound on how long rows whose send failed wait before they are tried
+# again without a notification
+COURSE_BUILD_OUTBOX_POLL_SECS = 30
+COURSE_BUILD_OUTBOX_LISTEN_POLL_SECS = 5
+COURSE_BUILD_OUTBOX_RECONNECT_SECS = 5
+
+
+class CourseBuildOutboxRelay(BackgroundThread):
+    # Publishes the course builds written to course_build_outbox to SQS in
+    # batches and deletes the rows that were sent. SKIP LOCKED lets every API
+    # replica run a relay without sending the same rows twice. Relays sleep
+    # on a LISTEN connection until rows are inserted so idle replicas don't
+    # keep querying the outbox.
+    def __init__(
+        self,
+        get_sessionmaker,
+        get_engine,
+        sqs_client,
+        sqs_queue_name,
+        poll_secs=COURSE_BUILD_OUTBOX_POLL_SECS,
+    ):
+        super().__init__()
+        self.get_sessionmaker = get_sessionmaker
+        self.get_engine = get_engine
+        self.sqs_client = sqs_client
+        self.sqs_queue_name = sqs_queue_name
+        self.poll_secs = poll_secs
+        self.queue_url = None
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.listen()
+            except Exception as e:
+                logging.error(f"Lost the {COURSE_BUILD_OUTBOX_CHANNEL} listener: {e}")
+            self.stopped.wait(COURSE_BUILD_OUTBOX_RECONNECT_SECS)
+
+    def listen(self):
+        with self.get_engine().connect() as connection:
+            connection.execution_options(isolation_level="AUTOCOMMIT")
+            connection.exec_driver_sql(f"LISTEN {COURSE_BUILD_OUTBOX_CHANNEL}")
+            dbapi_connection = connection.connection.dbapi_connection
+            # Rows inserted before listening started are drained right away
+            notified = True
+            next_poll = 0
+            while not self.stopped.is_set():
+                if notified or time.monotonic() >= next_poll:
+                    self.drain()
+                    next_poll = time.monotonic() + self.poll_secs
+                readable, _, _ = select.select(
+                    [dbapi_connection], [], [], COURSE_BUILD_OUTBOX_LISTEN_POLL_SECS
+                )
+                if readable:
+                    dbapi_connection.poll()
+                notified = len(dbapi_connection.notifies) > 0
+                dbapi_connection.notifies.clear()
+
+    def drain(self):
+        # Keep relaying while there is a backlog
+        while not self.stopped.is_set():
+            try:
+                published = self.relay()
+            except Exception as e:
+                logging.error(f"Failed relaying the course build outbox: {e}")
+                return
+            if published < COURSE_BUILD_OUTBOX_BATCH_SIZE:
+                return
+
+    def get_queue_url(self):
+        if self.queue_url is None:
+            self.queue_url = utils.get_sqs_queue_url(
+                self.sqs_client, self.sqs_queue_name
+            )
+        return self.queue_url
+
+    def relay(self):
+        with self.get_sessionmaker()() as session:
+            outbox = session.execute(
+                sql_select(CourseBuildOutbox.id, CourseBuildOutbox.course_build_id)
+                .order_by(CourseBuildOutbox.id)
+                .limit(COURSE_BUILD_OUTBOX_BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if len(outbox) == 0:
+                session.commit()
+                return 0
+
+            res = self.sqs_client.send_message_batch(
+                QueueUrl=self.get_queue_url(),
+                Entries=[
+                    {
+                        "Id": str(outbox_id),
+                        "MessageBody": json.dumps({"course_build_id": course_build_id}),
+                    }
+                    for outbox_id, course_build_id in outbox
+                ],
+            )
+            for failure in res.get("Failed", []):
+                logging.error(f"Failed publishing course build: {failure}")
+            # Failed entries stay in the outbox for the next batch
+            sent_ids = [int(success["Id"]) for success in res.get("Successful", [])]
+            if sent_ids:
+                session.execute(
+                    delete(CourseBuildOutbox).where(CourseBuildOutbox.id.in_(sent_ids))
+                )
+            session.commit()
+            return len(sent_ids)
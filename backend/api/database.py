@@ -1,13 +1,24 @@
-from sqlalchemy import create_engine, func
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.exc import NoResultFound, MultipleResultsFound
-from rope.db.schema import UserAccount, SchoolDistrict, MoodleSetting, CourseBuild
+from rope.db.schema import (
+    UserAccount,
+    SchoolDistrict,
+    MoodleSetting,
+    CourseBuild,
+    CourseBuildOutbox,
+)
 from rope.api.settings import PG_USER, PG_PASSWORD, PG_SERVER, PG_DB
+from rope.api.moodle_settings_cache import MoodleSettingsCache
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{PG_USER}:{PG_PASSWORD}@{PG_SERVER}/{PG_DB}"
 
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Started by the API and processor so the snapshot is invalidated when any
+# process changes a setting
+moodle_settings_cache = MoodleSettingsCache(lambda: engine)
 
 
 def get_db():
@@ -18,6 +29,11 @@ def get_db():
         db.close()
 
 
+# For responses that outlive the request's session and open their own
+def get_sessionmaker():
+    return SessionLocal
+
+
 def get_user_by_email(db: Session, email: str):
     user = db.query(UserAccount).filter(UserAccount.email == email).all()
     if not user:
@@ -105,6 +121,10 @@ def get_moodle_settings(db: Session):
     return moodle_settings
 
 
+def get_moodle_settings_snapshot(db: Session):
+    return moodle_settings_cache.get(db)
+
+
 def get_moodle_setting_by_name(db: Session, setting_name):
     moodle_setting = (
         db.query(MoodleSetting).filter(MoodleSetting.name == setting_name).first()
@@ -122,6 +142,7 @@ def create_moodle_settings(db: Session, moodle_setting):
     )
     db.add(new_moodle_setting)
     db.commit()
+    moodle_settings_cache.invalidate()
     db.refresh(new_moodle_setting)
     return new_moodle_setting
 
@@ -136,6 +157,7 @@ def update_moodle_settings(db: Session, moodle_setting):
     moodle_settings_db.name = lower_case_moodle_setting_name
     moodle_settings_db.value = moodle_setting.value
     db.commit()
+    moodle_settings_cache.invalidate()
     db.refresh(moodle_settings_db)
     return moodle_settings_db
 
@@ -154,39 +176,137 @@ def create_course_build(
     course_shortname,
     status,
     creator,
+    enqueue=False,
 ):
-    new_course_build = CourseBuild(
-        instructor_firstname=instructor_firstname,
-        instructor_lastname=instructor_lastname,
-        instructor_email=instructor_email,
-        course_name=course_name,
-        course_shortname=course_shortname,
-        course_category_id=course_category_id,
-        school_district_id=school_district_id,
-        academic_year=academic_year,
-        academic_year_short=academic_year_short,
-        base_course_id=base_course_id,
-        status=status,
-        creator_id=creator,
+    # Returns None instead of raising when another build already has the
+    # shortname so the caller can retry with the next one
+    new_course_build = db.scalar(
+        insert(CourseBuild)
+        .values(
+            instructor_firstname=instructor_firstname,
+            instructor_lastname=instructor_lastname,
+            instructor_email=instructor_email,
+            course_name=course_name,
+            course_shortname=course_shortname,
+            course_category_id=course_category_id,
+            school_district_id=school_district_id,
+            academic_year=academic_year,
+            academic_year_short=academic_year_short,
+            base_course_id=base_course_id,
+            status=status,
+            creator_id=creator,
+        )
+        .on_conflict_do_nothing(index_elements=[CourseBuild.course_shortname])
+        .returning(CourseBuild)
     )
-    db.add(new_course_build)
+    # The outbox row commits with the build so it is published to SQS by the
+    # relay even if the API goes away right after
+    if new_course_build is not None and enqueue:
+        db.add(CourseBuildOutbox(course_build_id=new_course_build.id))
     db.commit()
-    db.refresh(new_course_build)
     return new_course_build
 
 
-def get_course_builds(db: Session, academic_year, instructor_email):
-    course_builds = db.query(CourseBuild)
+def select_course_builds(status_column=CourseBuild.status):
+    # Joins the district and creator and selects only the listed columns so
+    # builds are read in a single query
+    return (
+        select(
+            CourseBuild.id,
+            CourseBuild.instructor_firstname,
+            CourseBuild.instructor_lastname,
+            CourseBuild.instructor_email,
+            SchoolDistrict.name.label("school_district_name"),
+            CourseBuild.academic_year,
+            CourseBuild.academic_year_short,
+            CourseBuild.course_name,
+            CourseBuild.course_shortname,
+            UserAccount.email.label("creator_email"),
+            status_column,
+            CourseBuild.course_id,
+            CourseBuild.course_enrollment_url,
+            CourseBuild.course_enrollment_key,
+        )
+        .join(CourseBuild.school_district)
+        .join(CourseBuild.creator)
+        .order_by(CourseBuild.id)
+    )
+
 
+def filter_course_builds(
+    course_builds,
+    academic_year,
+    instructor_email,
+    status=None,
+    school_district_name=None,
+    created_after=None,
+    created_before=None,
+):
     if academic_year:
-        course_builds = course_builds.filter(CourseBuild.academic_year == academic_year)
+        course_builds = course_builds.where(CourseBuild.academic_year == academic_year)
 
     if instructor_email:
-        course_builds = course_builds.filter(
+        course_builds = course_builds.where(
             func.lower(CourseBuild.instructor_email) == func.lower(instructor_email)
         )
 
-    return course_builds.all()
+    if status:
+        course_builds = course_builds.where(CourseBuild.status == status)
+
+    if school_district_name:
+        course_builds = course_builds.where(
+            SchoolDistrict.name == school_district_name
+        )
+
+    if created_after:
+        course_builds = course_builds.where(CourseBuild.created_at >= created_after)
+
+    if created_before:
+        course_builds = course_builds.where(CourseBuild.created_at < created_before)
+
+    return course_builds
+
+
+def get_course_builds(
+    db: Session,
+    academic_year,
+    instructor_email,
+    status=None,
+    school_district_name=None,
+    created_after=None,
+    created_before=None,
+    after_id=None,
+    limit=None,
+):
+    course_builds = filter_course_builds(
+        select_course_builds(),
+        academic_year,
+        instructor_email,
+        status=status,
+        school_district_name=school_district_name,
+        created_after=created_after,
+        created_before=created_before,
+    )
+
+    # Pages are keyed on the id of the last build of the previous page
+    if after_id is not None:
+        course_builds = course_builds.where(CourseBuild.id > after_id)
+
+    if limit is not None:
+        course_builds = course_builds.limit(limit)
+
+    return db.execute(course_builds).mappings().all()
+
+
+def get_course_shortnames_by_prefix(db: Session, course_shortname_prefix):
+    course_shortnames = db.scalars(
+        select(CourseBuild.course_shortname).where(
+            CourseBuild.course_shortname.startswith(
+                course_shortname_prefix, autoescape=True
+            )
+        )
+    )
+    return set(course_shortnames)
 
 
 def get_course_by_shortname(db: Session, course_shortname):
@@ -1,11 +1,36 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from starlette.middleware.sessions import SessionMiddleware
 
 from .routers import admin, moodle, session, user
-from rope.api import settings
+from rope.api import database, settings, utils
+from rope.api.course_build_outbox import CourseBuildOutboxRelay
+from rope.api.moodle_circuit_breaker import MoodleCircuitOpenError
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    database.moodle_settings_cache.start()
+    # Course builds are published to SQS in the background so submissions
+    # only wait on the database
+    outbox_relay = None
+    if settings.SQS_QUEUE:
+        outbox_relay = CourseBuildOutboxRelay(
+            lambda: database.SessionLocal,
+            lambda: database.engine,
+            utils.get_sqs_client(),
+            settings.SQS_QUEUE,
+        )
+        outbox_relay.start()
+    yield
+    if outbox_relay is not None:
+        outbox_relay.stop()
+    database.moodle_settings_cache.stop()
 
 
-app = FastAPI(title="ROPE API", root_path="/api")
+app = FastAPI(title="ROPE API", root_path="/api", lifespan=lifespan)
 
 app.add_middleware(
     SessionMiddleware,
@@ -20,3 +45,11 @@ app.include_router(user.router)
 app.include_router(session.router)
 app.include_router(admin.router)
 app.include_router(moodle.router)
+
+
+@app.exception_handler(MoodleCircuitOpenError)
+def moodle_circuit_open_handler(request: Request, exc: MoodleCircuitOpenError):
+    # Fail fast while Moodle is down instead of waiting on it
+    return JSONResponse(
+        status_code=503, content={"detail": "Moodle is currently unavailable"}
+    )
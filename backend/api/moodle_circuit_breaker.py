@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+
+from rope.api import settings
+from rope.api.moodle_http import AsyncMoodleTransport, MoodleAdapter
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+# Duplicating a course is slow even when Moodle is healthy
+MOODLE_FUNCTION_SLOW_CALL_SECS = {
+    "core_course_duplicate_course": 300,
+}
+
+
+class MoodleCircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Opens after failure_threshold consecutive failed or slow Moodle calls so
+    # later calls fail fast instead of waiting on a Moodle that is down. Once
+    # reset_timeout_secs have passed a single probe call is let through and
+    # its outcome closes or reopens the circuit.
+    def __init__(
+        self,
+        failure_threshold,
+        slow_call_secs,
+        reset_timeout_secs,
+        function_slow_call_secs=MOODLE_FUNCTION_SLOW_CALL_SECS,
+    ):
+        self.failure_threshold = failure_threshold
+        self.slow_call_secs = slow_call_secs
+        self.reset_timeout_secs = reset_timeout_secs
+        self.function_slow_call_secs = function_slow_call_secs
+        self.lock = threading.Lock()
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.probing = False
+
+    def get_open_secs(self):
+        # How much longer calls will fail fast before a probe is allowed
+        with self.lock:
+            if self.state != CIRCUIT_OPEN:
+                return 0
+            return max(0, self.opened_at + self.reset_timeout_secs - time.monotonic())
+
+    def is_open(self):
+        return self.get_open_secs() > 0
+
+    def before_call(self):
+        with self.lock:
+            if self.state == CIRCUIT_OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout_secs:
+                    raise MoodleCircuitOpenError("Moodle circuit breaker is open")
+                self.state = CIRCUIT_HALF_OPEN
+                self.probing = False
+            if self.state == CIRCUIT_HALF_OPEN:
+                if self.probing:
+                    raise MoodleCircuitOpenError("Moodle circuit breaker is open")
+                self.probing = True
+            return time.monotonic()
+
+    def record(self, wsfunction, start_time, failed):
+        latency_secs = time.monotonic() - start_time
+        slow_call_secs = self.function_slow_call_secs.get(
+            wsfunction, self.slow_call_secs
+        )
+        with self.lock:
+            if not failed and latency_secs <= slow_call_secs:
+                if self.state == CIRCUIT_HALF_OPEN:
+                    logging.info("Closing Moodle circuit breaker")
+                self.state = CIRCUIT_CLOSED
+                self.failures = 0
+                return
+            self.failures += 1
+            if (
+                self.state == CIRCUIT_HALF_OPEN
+                or self.failures >= self.failure_threshold
+            ):
+                if self.state != CIRCUIT_OPEN:
+                    logging.warning(
+                        f"Opening Moodle circuit breaker after {self.failures} "
+                        "failed or slow calls"
+                    )
+                self.state = CIRCUIT_OPEN
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+def get_moodle_circuit_breaker():
+    failure_threshold = int(settings.MOODLE_CIRCUIT_FAILURE_THRESHOLD)
+    if failure_threshold <= 0:
+        return None
+    return CircuitBreaker(
+        failure_threshold,
+        float(settings.MOODLE_CIRCUIT_SLOW_CALL_SECS),
+        float(settings.MOODLE_CIRCUIT_RESET_SECS),
+    )
+
+
+class CircuitBreakerAdapter(MoodleAdapter):
+    def __init__(self, circuit_breaker, adapter=None):
+        super().__init__(adapter)
+        self.circuit_breaker = circuit_breaker
+
+    def before_call(self, wsfunction):
+        return self.circuit_breaker.before_call()
+
+    def after_call(self, wsfunction, started, failed):
+        self.circuit_breaker.record(wsfunction, started, failed)
+
+
+class AsyncCircuitBreakerTransport(AsyncMoodleTransport):
+    def __init__(self, circuit_breaker, transport):
+        super().__init__(transport)
+        self.circuit_breaker = circuit_breaker
+
+    async def before_call(self, wsfunction):
+        return self.circuit_breaker.before_call()
+
+    async def after_call(self, wsfunction, started, failed):
+        self.circuit_breaker.record(wsfunction, started, failed)
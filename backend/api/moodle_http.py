@@ -0,0 +1,73 @@
+from urllib.parse import parse_qs
+
+import httpx
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+# Helpers for the requests adapters and httpx transports that sit in front of
+# Moodle web service calls
+
+
+def get_wsfunction(body):
+    if isinstance(body, bytes):
+        body = body.decode("utf-8")
+    values = parse_qs(body or "").get("wsfunction")
+    return values[0] if values else None
+
+
+def is_failed_response(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+class MoodleAdapter(BaseAdapter):
+    # Mounted on the requests sessions used to call Moodle in front of the
+    # adapter that sends the request. Subclasses run before_call ahead of
+    # each call and get its outcome in after_call.
+    def __init__(self, adapter=None):
+        super().__init__()
+        self.adapter = adapter or HTTPAdapter()
+
+    def before_call(self, wsfunction):
+        return None
+
+    def after_call(self, wsfunction, started, failed):
+        pass
+
+    def send(self, request, **kwargs):
+        wsfunction = get_wsfunction(request.body)
+        started = self.before_call(wsfunction)
+        failed = True
+        try:
+            response = self.adapter.send(request, **kwargs)
+            failed = is_failed_response(response.status_code)
+            return response
+        finally:
+            self.after_call(wsfunction, started, failed)
+
+    def close(self):
+        self.adapter.close()
+
+
+class AsyncMoodleTransport(httpx.AsyncBaseTransport):
+    # The same for the httpx client of the asyncio engine
+    def __init__(self, transport):
+        self.transport = transport
+
+    async def before_call(self, wsfunction):
+        return None
+
+    async def after_call(self, wsfunction, started, failed):
+        pass
+
+    async def handle_async_request(self, request):
+        wsfunction = get_wsfunction(await request.aread())
+        started = await self.before_call(wsfunction)
+        failed = True
+        try:
+            response = await self.transport.handle_async_request(request)
+            failed = is_failed_response(response.status_code)
+            return response
+        finally:
+            await self.after_call(wsfunction, started, failed)
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+
+from rope.api import settings
+from rope.api.moodle_http import AsyncMoodleTransport, MoodleAdapter
+from rope.db.schema import MoodleRateLimitBucket
+
+# Every Moodle call takes a token from this bucket. Functions with their own
+# limit also take one from a bucket named after the function.
+MOODLE_RATE_LIMIT_DEFAULT = "default"
+
+
+def parse_rate_limits(rate_limits):
+    # "default=20:40,core_user_get_users_by_field=5:10" sets a rate of 20
+    # calls per second with bursts of 40 for all calls, and a tighter limit
+    # for user lookups
+    parsed = {}
+    for rate_limit in filter(None, rate_limits.split(",")):
+        name, limit = rate_limit.strip().split("=")
+        rate_per_sec, burst = limit.split(":")
+        parsed[name] = (float(rate_per_sec), float(burst))
+    return parsed
+
+
+class LocalTokenBucketBackend:
+    # Buckets shared by the threads of one process
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def reserve(self, name, rate_per_sec, burst):
+        with self.lock:
+            now = time.monotonic()
+            tokens, refilled_at = self.buckets.get(name, (burst, now))
+            tokens = min(burst, tokens + (now - refilled_at) * rate_per_sec) - 1
+            self.buckets[name] = (tokens, now)
+        return max(0, -tokens / rate_per_sec)
+
+
+class PostgresTokenBucketBackend:
+    # Buckets in the moodle_rate_limit_bucket table so the API and processor
+    # pods share one budget. Reserving a token is a single upsert.
+    def __init__(self, get_sessionmaker):
+        self.get_sessionmaker = get_sessionmaker
+
+    def reserve(self, name, rate_per_sec, burst):
+        bucket = MoodleRateLimitBucket.__table__
+        now = func.clock_timestamp()
+        refilled_tokens = func.least(
+            burst,
+            bucket.c.tokens
+            + func.extract("epoch", now - bucket.c.refilled_at) * rate_per_sec,
+        )
+        statement = (
+            insert(bucket)
+            .values(name=name, tokens=burst - 1, refilled_at=now)
+            .on_conflict_do_update(
+                index_elements=[bucket.c.name],
+                set_={"tokens": refilled_tokens - 1, "refilled_at": now},
+            )
+            .returning(bucket.c.tokens)
+        )
+        with self.get_sessionmaker()() as session:
+            tokens = session.scalar(statement)
+            session.commit()
+        return max(0, -tokens / rate_per_sec)
+
+
+class MoodleRateLimiter:
+    # Tokens are reserved up front, going into debt when a bucket is empty,
+    # and the caller waits until its reservation is due
+    def __init__(self, backend, rate_limits):
+        self.backend = backend
+        self.rate_limits = rate_limits
+
+    def reserve(self, wsfunction):
+        wait_secs = 0
+        for name in [MOODLE_RATE_LIMIT_DEFAULT, wsfunction]:
+            if name in self.rate_limits:
+                wait_secs = max(
+                    wait_secs, self.backend.reserve(name, *self.rate_limits[name])
+                )
+        return wait_secs
+
+    def acquire(self, wsfunction):
+        time.sleep(self.reserve(wsfunction))
+
+
+def get_moodle_rate_limiter(get_sessionmaker):
+    rate_limits = parse_rate_limits(settings.MOODLE_RATE_LIMITS)
+    if not rate_limits:
+        return None
+    if settings.MOODLE_RATE_LIMIT_BACKEND == "postgres":
+        return MoodleRateLimiter(
+            PostgresTokenBucketBackend(get_sessionmaker), rate_limits
+        )
+    return MoodleRateLimiter(LocalTokenBucketBackend(), rate_limits)
+
+
+class RateLimitedAdapter(MoodleAdapter):
+    def __init__(self, rate_limiter, adapter=None):
+        super().__init__(adapter)
+        self.rate_limiter = rate_limiter
+
+    def before_call(self, wsfunction):
+        self.rate_limiter.acquire(wsfunction)
+
+
+class AsyncRateLimitedTransport(AsyncMoodleTransport):
+    def __init__(self, rate_limiter, transport):
+        super().__init__(transport)
+        self.rate_limiter = rate_limiter
+
+    async def before_call(self, wsfunction):
+        # The shared backend queries Postgres so reserve off the event loop
+        wait_secs = await asyncio.to_thread(self.rate_limiter.reserve, wsfunction)
+        await asyncio.sleep(wait_secs)
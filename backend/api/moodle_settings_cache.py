@@ -0,0 +1,78 @@
+import logging
+import select
+import threading
+
+from sqlalchemy import select as sql_select
+
+from rope.api.background import BackgroundThread
+from rope.db.schema import MoodleSetting
+
+# Channel notified by the moodle_setting_changed trigger whenever a setting
+# is inserted, updated or deleted
+MOODLE_SETTING_CHANNEL = "moodle_setting_changed"
+MOODLE_SETTING_LISTEN_POLL_SECS = 5
+MOODLE_SETTING_RECONNECT_SECS = 5
+
+
+def load_moodle_settings(db):
+    return dict(db.execute(sql_select(MoodleSetting.name, MoodleSetting.value)).all())
+
+
+class MoodleSettingsCache(BackgroundThread):
+    # Snapshot of the whole moodle_setting table loaded with a single query.
+    # It is only kept while the LISTEN connection is open so changes made by
+    # other API pods, processors or scripts are never missed. Otherwise every
+    # lookup reads the table again.
+    def __init__(self, get_engine):
+        super().__init__()
+        self.get_engine = get_engine
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.generation = 0
+        self.listening = False
+
+    def get(self, db):
+        with self.lock:
+            snapshot = self.snapshot
+            generation = self.generation
+        if snapshot is not None:
+            return snapshot
+        snapshot = load_moodle_settings(db)
+        with self.lock:
+            # A change notified while loading may be missing from the snapshot
+            if self.listening and self.generation == generation:
+                self.snapshot = snapshot
+        return snapshot
+
+    def invalidate(self, listening=None):
+        with self.lock:
+            if listening is not None:
+                self.listening = listening
+            self.snapshot = None
+            self.generation += 1
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.listen()
+            except Exception as e:
+                logging.error(f"Lost the {MOODLE_SETTING_CHANNEL} listener: {e}")
+            finally:
+                self.invalidate(listening=False)
+            self.stopped.wait(MOODLE_SETTING_RECONNECT_SECS)
+
+    def listen(self):
+        with self.get_engine().connect() as connection:
+            connection.execution_options(isolation_level="AUTOCOMMIT")
+            connection.exec_driver_sql(f"LISTEN {MOODLE_SETTING_CHANNEL}")
+            dbapi_connection = connection.connection.dbapi_connection
+            self.invalidate(listening=True)
+            while not self.stopped.is_set():
+                readable, _, _ = select.select(
+                    [dbapi_connection], [], [], MOODLE_SETTING_LISTEN_POLL_SECS
+                )
+                if readable:
+                    dbapi_connection.poll()
+                if len(dbapi_connection.notifies) > 0:
+                    dbapi_connection.notifies.clear()
+                    self.invalidate()
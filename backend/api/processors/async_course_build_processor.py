@@ -0,0 +1,436 @@
+import asyncio
+import logging
+import secrets
+import time
+from collections import deque
+
+import httpx
+
+from rope.api import settings
+from rope.api.async_moodle import AsyncMoodleClient
+from rope.api.moodle_circuit_breaker import (
+    AsyncCircuitBreakerTransport,
+    MoodleCircuitOpenError,
+)
+from rope.api.moodle_rate_limiter import AsyncRateLimitedTransport
+from rope.api.routers.moodle import moodle_circuit_breaker, moodle_rate_limiter
+from rope.api.processors import course_build_processor, course_build_steps, metrics
+from rope.api.processors.concurrency_limiter import (
+    AsyncAIMDLimiter,
+    AsyncConcurrencyLimitedTransport,
+)
+from rope.api.processors.course_build_processor import (
+    DeferredProcessorException,
+    ProcessorException,
+    SQSDeleteBatcher,
+    SQSRetryPolicy,
+    SQSVisibilityHeartbeat,
+    save_course_build_step,
+    SQS_DELETE_BATCH_MAX_WAIT_SECS,
+    SQS_MAX_MESSAGES,
+)
+from rope.db.schema import CourseBuild, CourseBuildStatus
+
+MOODLE_TIMEOUT_SECS = 60
+
+
+async def get_moodle_user_role_by_shortname(moodle, shortname):
+    # Shares the role cache prewarmed and refreshed by the processor
+    moodle_role_cache = course_build_processor.moodle_role_cache
+    role_id = moodle_role_cache.get_cached(shortname)
+    if role_id is None:
+        moodle_user_role = await moodle.get_role_by_shortname(shortname)
+        role_id = moodle_user_role["id"]
+        moodle_role_cache.set(shortname, role_id)
+    return role_id
+
+
+# The DB helpers below run in worker threads and each open their own short
+# lived session so no connection is held while a build waits on Moodle
+def claim_course_build(course_build_id):
+    get_sessionmaker = course_build_processor.get_db()
+    with get_sessionmaker() as session:
+        course_build = course_build_processor.claim_course_build(
+            session, course_build_id
+        )
+        if course_build is None:
+            return None, None
+        return (
+            course_build_steps.get_course_build_snapshot(course_build),
+            course_build_steps.get_step_results(session, course_build_id),
+        )
+
+
+def complete_course_build(course_build_id, results, courses_csv_writer):
+    get_sessionmaker = course_build_processor.get_db()
+    with get_sessionmaker() as session:
+        course_build = session.get(CourseBuild, course_build_id)
+        course_build_processor.record_csv(
+            session, course_build, results, courses_csv_writer
+        )
+
+
+def fail_course_build(course_build_id, status=CourseBuildStatus.FAILED):
+    get_sessionmaker = course_build_processor.get_db()
+    with get_sessionmaker() as session:
+        course_build = session.get(CourseBuild, course_build_id)
+        course_build.status = status.value
+        session.commit()
+
+
+async def resolve_roles(moodle, course_build, results):
+    instructor_role_id, student_role_id = await asyncio.gather(
+        get_moodle_user_role_by_shortname(moodle, "teacher"),
+        get_moodle_user_role_by_shortname(moodle, "student"),
+    )
+    return {
+        "instructor_role_id": instructor_role_id,
+        "student_role_id": student_role_id,
+    }
+
+
+async def resolve_instructor(moodle, course_build, results):
+    instructor_user = await moodle.get_user_by_email(course_build["instructor_email"])
+    return {"instructor_user_id": instructor_user["id"]}
+
+
+async def duplicate_course(moodle, course_build, results):
+    # See course_build_processor.duplicate_course
+    if course_build_steps.DUPLICATE_COURSE_STARTED in results:
+        existing_courses = (
+            await moodle.get_course_by_shortname(course_build["course_shortname"])
+        )["courses"]
+        if existing_courses:
+            return {"course_id": existing_courses[0]["id"]}
+    else:
+        await asyncio.to_thread(
+            save_course_build_step,
+            course_build["id"],
+            course_build_steps.DUPLICATE_COURSE_STARTED,
+            {},
+        )
+    course_pool = course_build_processor.course_pool
+    if course_pool is not None:
+        pooled_course_id = await asyncio.to_thread(course_pool.claim, course_build)
+        if pooled_course_id is not None:
+            await moodle.update_course(
+                pooled_course_id,
+                fullname=course_build["course_name"],
+                shortname=course_build["course_shortname"],
+                visible=1,
+            )
+            return {"course_id": pooled_course_id, "pooled": True}
+    new_course = await moodle.copy_course(
+        course_build["base_course_id"],
+        course_build["course_name"],
+        course_build["course_shortname"],
+        course_build["course_category_id"],
+    )
+    return {"course_id": new_course["id"]}
+
+
+async def set_enrolment_key(moodle, course_id, student_role_id):
+    enrolment_methods = await moodle.get_self_enrolment_methods(
+        course_id, student_role_id
+    )
+    enrolment_key = secrets.token_urlsafe(8)
+    await moodle.set_self_enrolment_method_key(
+        enrolment_methods[0]["id"], enrolment_key
+    )
+    return enrolment_key
+
+
+async def enrol(moodle, course_build, results):
+    course_id = results[course_build_steps.DUPLICATE_COURSE]["course_id"]
+    roles = results[course_build_steps.RESOLVE_ROLES]
+    _, enrolment_key = await asyncio.gather(
+        moodle.enrol_user(
+            course_id,
+            results[course_build_steps.RESOLVE_INSTRUCTOR]["instructor_user_id"],
+            roles["instructor_role_id"],
+        ),
+        set_enrolment_key(moodle, course_id, roles["student_role_id"]),
+    )
+    return {
+        "course_enrolment_url": course_build_steps.get_enrolment_url(
+            moodle.url, course_id
+        ),
+        "course_enrolment_key": enrolment_key,
+    }
+
+
+MOODLE_STEPS = {
+    course_build_steps.RESOLVE_ROLES: resolve_roles,
+    course_build_steps.RESOLVE_INSTRUCTOR: resolve_instructor,
+    course_build_steps.DUPLICATE_COURSE: duplicate_course,
+    course_build_steps.ENROL: enrol,
+}
+
+
+async def process_course_build(course_build_id, courses_csv_writer, moodle):
+    timer = metrics.StageTimer()
+    with timer.stage("db_claim"):
+        course_build, results = await asyncio.to_thread(
+            claim_course_build, course_build_id
+        )
+    if course_build is None:
+        return
+    course_build_processor.course_build_leases.track(course_build_id)
+
+    async def run_step(step, dependencies):
+        # Each step starts as soon as the steps it depends on have finished
+        await asyncio.gather(*dependencies)
+        if step in results:
+            return
+        with timer.stage(step):
+            if step == course_build_steps.RECORD_CSV:
+                await asyncio.to_thread(
+                    complete_course_build, course_build_id, results, courses_csv_writer
+                )
+                return
+            result = await MOODLE_STEPS[step](moodle, course_build, results)
+            await asyncio.to_thread(
+                save_course_build_step, course_build_id, step, result
+            )
+        results[step] = result
+
+    try:
+        steps = {}
+        for step in course_build_steps.COURSE_BUILD_STEPS:
+            steps[step] = asyncio.ensure_future(
+                run_step(
+                    step,
+                    [
+                        steps[dependency]
+                        for dependency in (
+                            course_build_steps.COURSE_BUILD_STEP_DEPENDENCIES[step]
+                        )
+                    ],
+                )
+            )
+        # Let every step that can finish do so before failing the build so
+        # their results are kept for the retry
+        for outcome in await asyncio.gather(*steps.values(), return_exceptions=True):
+            if isinstance(outcome, Exception):
+                raise outcome
+
+    except MoodleCircuitOpenError as e:
+        # Moodle is down rather than the build being bad so it is left to be
+        # retried from its checkpoints once the circuit closes
+        await asyncio.to_thread(
+            fail_course_build, course_build_id, CourseBuildStatus.CREATED
+        )
+        logging.warning(f"Deferred course build {course_build_id}: {e}")
+        raise DeferredProcessorException(
+            f"Deferred course build {course_build_id}: {e}",
+            course_build_processor.get_deferral_secs(),
+        )
+    except Exception as e:
+        await asyncio.to_thread(fail_course_build, course_build_id)
+        logging.error(f"Failed to build course: {e}")
+        raise ProcessorException(f"Failed to build course {course_build_id}: {e}")
+    finally:
+        course_build_processor.course_build_leases.untrack(course_build_id)
+        timer.report("course_build_timings", course_build_id=course_build_id)
+
+
+def get_sqs_message_processor(courses_csv_writer, moodle):
+    async def inner(sqs_message):
+        course_build_id = course_build_processor.get_course_build_id(sqs_message)
+        build_start_time = time.perf_counter()
+        await process_course_build(course_build_id, courses_csv_writer, moodle)
+        build_completion_time = time.perf_counter()
+        logging.info(
+            f"The course build took: \
+                      {(build_completion_time - build_start_time)} seconds"
+        )
+
+    return inner
+
+
+async def handle_sqs_message(retry_policy, heartbeat, processor, message):
+    receipt_handle = message["ReceiptHandle"]
+    metrics.observe_start_latency(message)
+
+    error = None
+    heartbeat.track(receipt_handle)
+    try:
+        await processor(message)
+    except ProcessorException as e:
+        error = e
+    finally:
+        heartbeat.untrack(receipt_handle)
+
+    if error is None:
+        await asyncio.to_thread(retry_policy.delete, message)
+    else:
+        await asyncio.to_thread(retry_policy.handle_failure, message, error)
+
+
+def reap_completed_builds(in_flight):
+    remaining = set()
+    for task in in_flight:
+        if task.done():
+            task.result()
+        else:
+            remaining.add(task)
+    return remaining
+
+
+async def processor_runner(
+    sqs_client,
+    sqs_queue_name,
+    processor,
+    idle_backoff_max_secs,
+    daemonize,
+    workers,
+    circuit_breaker=None,
+    dead_letter_queue_name=None,
+    max_receive_count=course_build_processor.SQS_MAX_RECEIVE_COUNT,
+):
+    queue_url_data = await asyncio.to_thread(
+        sqs_client.get_queue_url, QueueName=sqs_queue_name
+    )
+    queue_url = queue_url_data["QueueUrl"]
+    delete_batcher = SQSDeleteBatcher(sqs_client, queue_url)
+    retry_policy = SQSRetryPolicy(
+        sqs_client,
+        queue_url,
+        delete_batcher,
+        await asyncio.to_thread(
+            course_build_processor.get_dead_letter_queue_url,
+            sqs_client,
+            dead_letter_queue_name,
+        ),
+        max_receive_count,
+    )
+    heartbeat = SQSVisibilityHeartbeat(sqs_client, queue_url)
+    heartbeat.start()
+
+    if not daemonize:
+        sqs_messages = await asyncio.to_thread(
+            course_build_processor.get_sqs_messages,
+            sqs_client,
+            queue_url,
+            heartbeat,
+            min(SQS_MAX_MESSAGES, workers),
+        )
+        builds = {
+            asyncio.create_task(
+                handle_sqs_message(retry_policy, heartbeat, processor, message)
+            )
+            for message in sqs_messages
+        }
+        if builds:
+            await asyncio.wait(builds)
+        await asyncio.to_thread(heartbeat.stop)
+        await asyncio.to_thread(delete_batcher.flush_all)
+        reap_completed_builds(builds)
+        return
+
+    in_flight = set()
+    prefetched = deque()
+    receive = None
+    empty_polls = 0
+    paused = False
+    try:
+        while True:
+            # Builds would only fail fast while the Moodle circuit breaker is
+            # open so messages are left on the queue until it probes
+            paused = course_build_processor.is_paused(circuit_breaker, paused)
+            while not paused and prefetched and len(in_flight) < workers:
+                in_flight.add(
+                    asyncio.create_task(
+                        handle_sqs_message(
+                            retry_policy, heartbeat, processor, prefetched.popleft()
+                        )
+                    )
+                )
+
+            # The long poll blocks a single thread while builds already in
+            # flight keep making progress on the event loop
+            prefetch_size = course_build_processor.get_prefetch_size(
+                workers, len(in_flight), len(prefetched)
+            )
+            if receive is None and prefetch_size > 0 and not paused:
+                receive = asyncio.create_task(
+                    asyncio.to_thread(
+                        course_build_processor.get_sqs_messages_after_backoff,
+                        course_build_processor.get_idle_backoff_secs(
+                            empty_polls, idle_backoff_max_secs
+                        ),
+                        sqs_client,
+                        queue_url,
+                        heartbeat,
+                        prefetch_size,
+                    )
+                )
+
+            pending = in_flight | {receive} if receive else in_flight
+            if pending:
+                await asyncio.wait(
+                    pending,
+                    timeout=SQS_DELETE_BATCH_MAX_WAIT_SECS,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+            else:
+                await asyncio.sleep(SQS_DELETE_BATCH_MAX_WAIT_SECS)
+            in_flight = reap_completed_builds(in_flight)
+            if delete_batcher.is_due():
+                await asyncio.to_thread(delete_batcher.flush)
+
+            if receive is not None and receive.done():
+                sqs_messages = receive.result()
+                receive = None
+                prefetched.extend(sqs_messages)
+                if len(sqs_messages) == 0:
+                    empty_polls += 1
+                else:
+                    empty_polls = 0
+                    logging.info(f"Received {len(sqs_messages)} messages")
+    finally:
+        if in_flight:
+            await asyncio.wait(in_flight)
+        await asyncio.to_thread(heartbeat.stop)
+        await asyncio.to_thread(delete_batcher.flush_all)
+
+
+async def run(
+    sqs_client,
+    courses_csv_writer,
+    sqs_queue_name,
+    idle_backoff_max_secs,
+    daemonize,
+    workers,
+    moodle_limiter_args=None,
+    dead_letter_queue_name=None,
+    max_receive_count=course_build_processor.SQS_MAX_RECEIVE_COUNT,
+):
+    limits = httpx.Limits(max_connections=workers, max_keepalive_connections=workers)
+    transport = httpx.AsyncHTTPTransport(limits=limits)
+    if moodle_circuit_breaker is not None:
+        transport = AsyncCircuitBreakerTransport(moodle_circuit_breaker, transport)
+    if moodle_limiter_args is not None:
+        transport = AsyncConcurrencyLimitedTransport(
+            AsyncAIMDLimiter(**moodle_limiter_args), transport
+        )
+    if moodle_rate_limiter is not None:
+        transport = AsyncRateLimitedTransport(moodle_rate_limiter, transport)
+    async with httpx.AsyncClient(
+        transport=transport, timeout=MOODLE_TIMEOUT_SECS
+    ) as http_client:
+        moodle = AsyncMoodleClient(
+            http_client, settings.MOODLE_URL, settings.MOODLE_TOKEN
+        )
+        processor = get_sqs_message_processor(courses_csv_writer, moodle)
+        await processor_runner(
+            sqs_client=sqs_client,
+            sqs_queue_name=sqs_queue_name,
+            processor=processor,
+            idle_backoff_max_secs=idle_backoff_max_secs,
+            daemonize=daemonize,
+            workers=workers,
+            circuit_breaker=moodle_circuit_breaker,
+            dead_letter_queue_name=dead_letter_queue_name,
+            max_receive_count=max_receive_count,
+        )
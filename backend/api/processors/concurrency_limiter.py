@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+
+from rope.api.moodle_http import AsyncMoodleTransport, MoodleAdapter
+from rope.api.processors import metrics
+
+MOODLE_CONCURRENCY_BACKOFF_RATIO = 0.5
+# Duplicating a course routinely takes far longer than any other web service
+# function so it is judged against its own latency target
+MOODLE_FUNCTION_TARGET_LATENCY_SECS = {
+    "core_course_duplicate_course": 60,
+}
+
+
+class AIMDLimiter:
+    # Bounds the number of concurrent Moodle calls. The limit grows by one
+    # for each window of calls that finish under their latency target and is
+    # cut by MOODLE_CONCURRENCY_BACKOFF_RATIO when a call is slow or fails.
+    def __init__(
+        self,
+        initial_limit,
+        min_limit,
+        max_limit,
+        target_latency_secs,
+        function_target_latency_secs=MOODLE_FUNCTION_TARGET_LATENCY_SECS,
+    ):
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency_secs = target_latency_secs
+        self.function_target_latency_secs = function_target_latency_secs
+        self.in_flight = 0
+        self.last_backoff_time = 0
+        self.condition = threading.Condition()
+        metrics.MOODLE_CONCURRENCY_LIMIT.set(self.limit)
+
+    def has_capacity(self):
+        return self.in_flight < int(self.limit)
+
+    def record(self, wsfunction, start_time, failed):
+        latency_secs = time.monotonic() - start_time
+        target_latency_secs = self.function_target_latency_secs.get(
+            wsfunction, self.target_latency_secs
+        )
+        if failed or latency_secs > target_latency_secs:
+            # Calls that started before the last backoff already saw the
+            # overload that caused it so only back off once for them
+            if start_time >= self.last_backoff_time:
+                self.limit = max(
+                    self.min_limit, self.limit * MOODLE_CONCURRENCY_BACKOFF_RATIO
+                )
+                self.last_backoff_time = time.monotonic()
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        metrics.MOODLE_CONCURRENCY_LIMIT.set(self.limit)
+
+    def acquire(self):
+        with self.condition:
+            self.condition.wait_for(self.has_capacity)
+            self.in_flight += 1
+        return time.monotonic()
+
+    def release(self, wsfunction, start_time, failed):
+        with self.condition:
+            self.in_flight -= 1
+            self.record(wsfunction, start_time, failed)
+            self.condition.notify_all()
+
+
+class AsyncAIMDLimiter(AIMDLimiter):
+    # Same limit for the asyncio engine where waiting must not block the loop
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(self.has_capacity)
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def release(self, wsfunction, start_time, failed):
+        async with self.condition:
+            self.in_flight -= 1
+            self.record(wsfunction, start_time, failed)
+            self.condition.notify_all()
+
+
+class ConcurrencyLimitedAdapter(MoodleAdapter):
+    def __init__(self, limiter, adapter=None):
+        super().__init__(adapter)
+        self.limiter = limiter
+
+    def before_call(self, wsfunction):
+        return self.limiter.acquire()
+
+    def after_call(self, wsfunction, started, failed):
+        self.limiter.release(wsfunction, started, failed)
+
+
+class AsyncConcurrencyLimitedTransport(AsyncMoodleTransport):
+    def __init__(self, limiter, transport):
+        super().__init__(transport)
+        self.limiter = limiter
+
+    async def before_call(self, wsfunction):
+        return await self.limiter.acquire()
+
+    async def after_call(self, wsfunction, started, failed):
+        await self.limiter.release(wsfunction, started, failed)
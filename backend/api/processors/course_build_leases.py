@@ -0,0 +1,133 @@
+import logging
+import threading
+from datetime import timedelta
+
+from sqlalchemy import func, select, update
+
+from rope.api.background import BackgroundThread
+from rope.api.processors import metrics
+from rope.db.schema import CourseBuild, CourseBuildStatus
+
+# A build whose lease has not been renewed for this long is assumed to have
+# lost its processor, e.g. to a pod killed by a deploy
+COURSE_BUILD_LEASE_SECS = 300
+COURSE_BUILD_LEASE_RENEW_SECS = 60
+COURSE_BUILD_REAP_BATCH_SIZE = 500
+COURSE_BUILD_REAP_LOCK_ID = 7203
+
+
+def get_lease_expiry():
+    # Lease deadlines use the database clock so processor clock skew can't
+    # reap a build that is still running
+    return func.now() + timedelta(seconds=COURSE_BUILD_LEASE_SECS)
+
+
+def renew_course_build_leases(session, course_build_ids):
+    renewed_ids = session.scalars(
+        update(CourseBuild)
+        .where(
+            CourseBuild.id.in_(course_build_ids),
+            CourseBuild.status == CourseBuildStatus.PROCESSING,
+        )
+        .values(lease_expires_at=get_lease_expiry())
+        .returning(CourseBuild.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    session.commit()
+    return renewed_ids
+
+
+def reap_expired_course_builds(session, limit):
+    # Resets builds whose lease expired back to CREATED without committing so
+    # the caller can re-enqueue them first. Like claim_course_builds the CTE
+    # is only evaluated once so it can't lock more than limit builds.
+    expired_course_builds = (
+        select(CourseBuild.id)
+        .where(
+            CourseBuild.status == CourseBuildStatus.PROCESSING,
+            CourseBuild.lease_expires_at < func.now(),
+        )
+        .order_by(CourseBuild.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .cte("expired_course_builds")
+    )
+    course_build_ids = session.scalars(
+        update(CourseBuild)
+        .where(CourseBuild.id.in_(select(expired_course_builds.c.id)))
+        .values(status=CourseBuildStatus.CREATED, lease_expires_at=None)
+        .returning(CourseBuild.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    return sorted(course_build_ids)
+
+
+class CourseBuildLeases(BackgroundThread):
+    # Renews the leases of the builds this processor is running and reclaims
+    # builds whose processor stopped renewing theirs. enqueue is called with
+    # the reclaimed build ids before they are committed when builds are
+    # received from SQS; the postgres queue trigger picks them up otherwise.
+    def __init__(
+        self,
+        get_sessionmaker,
+        enqueue=None,
+        renew_interval_secs=COURSE_BUILD_LEASE_RENEW_SECS,
+    ):
+        super().__init__()
+        self.get_sessionmaker = get_sessionmaker
+        self.enqueue = enqueue
+        self.renew_interval_secs = renew_interval_secs
+        self.lock = threading.Lock()
+        self.course_build_ids = set()
+
+    def run(self):
+        while not self.stopped.wait(self.renew_interval_secs):
+            try:
+                self.renew()
+                self.reap()
+            except Exception as e:
+                logging.error(f"Failed renewing course build leases: {e}")
+
+    def track(self, course_build_id):
+        with self.lock:
+            self.course_build_ids.add(course_build_id)
+
+    def untrack(self, course_build_id):
+        with self.lock:
+            self.course_build_ids.discard(course_build_id)
+
+    def renew(self):
+        with self.lock:
+            course_build_ids = list(self.course_build_ids)
+        if len(course_build_ids) == 0:
+            return
+        with self.get_sessionmaker()() as session:
+            renewed_ids = renew_course_build_leases(session, course_build_ids)
+        for course_build_id in set(course_build_ids) - set(renewed_ids):
+            logging.warning(f"Lost the lease on course build {course_build_id}")
+
+    def reap(self):
+        while True:
+            with self.get_sessionmaker()() as session:
+                # Only one processor replica reaps at a time
+                acquired = session.scalar(
+                    select(func.pg_try_advisory_xact_lock(COURSE_BUILD_REAP_LOCK_ID))
+                )
+                if not acquired:
+                    return
+                course_build_ids = reap_expired_course_builds(
+                    session, COURSE_BUILD_REAP_BATCH_SIZE
+                )
+                if len(course_build_ids) == 0:
+                    session.commit()
+                    return
+                if self.enqueue is not None:
+                    self.enqueue(course_build_ids)
+                session.commit()
+            metrics.COURSE_BUILDS_REAPED.inc(len(course_build_ids))
+            logging.warning(
+                f"Reclaimed {len(course_build_ids)} course builds with expired "
+                f"leases: {course_build_ids}"
+            )
+            if len(course_build_ids) < COURSE_BUILD_REAP_BATCH_SIZE:
+                return
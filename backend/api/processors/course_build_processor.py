@@ -1,23 +1,60 @@
 import argparse
-import io
+import asyncio
 import time
 import boto3
+import requests
 import json
 import logging
-import csv
-from functools import cache
-from sqlalchemy.exc import NoResultFound
-
-from moodlecli.utils import create_course
-from rope.api.routers.moodle import moodle_client
+import math
+import secrets
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from botocore.exceptions import ClientError
+from sqlalchemy import select, update
+
+from rope.api.routers.moodle import (
+    get_moodle_adapter,
+    moodle_circuit_breaker,
+    moodle_client,
+    moodle_session,
+)
 from rope.api import database
 from rope.db.schema import CourseBuild, CourseBuildStatus
 from rope.api import settings
+from rope.api.background import BackgroundThread
+from rope.api.moodle_circuit_breaker import MoodleCircuitOpenError
+from rope.api.processors import course_build_steps, metrics
+from rope.api.processors.concurrency_limiter import (
+    AIMDLimiter,
+    ConcurrencyLimitedAdapter,
+)
+from rope.api.processors.course_build_leases import CourseBuildLeases, get_lease_expiry
+from rope.api.processors.course_pool import CoursePool
+from rope.api.processors.courses_csv import CoursesCsvWriter
+from rope.api.processors.metadata_cache import MetadataCache
 
 SQS_WAIT_TIME_SECS = 20
-SQS_MAX_MESSAGES = 1
+SQS_MAX_MESSAGES = 10
+SQS_IDLE_BACKOFF_BASE_SECS = 1
+SQS_DELETE_BATCH_MAX_WAIT_SECS = 1
+SQS_HEARTBEAT_VISIBILITY_TIMEOUT_SECS = 180
+# Beating at half the timeout leaves a whole beat of slack for a failed one
+SQS_HEARTBEAT_INTERVAL_SECS = SQS_HEARTBEAT_VISIBILITY_TIMEOUT_SECS // 2
+SQS_MAX_RECEIVE_COUNT = 5
+SQS_RETRY_BACKOFF_BASE_SECS = 30
+# The longest visibility timeout SQS allows
+SQS_RETRY_BACKOFF_MAX_SECS = 43200
+# The longest delay SQS allows on a sent message
+SQS_MAX_DELAY_SECS = 900
+MOODLE_ROLE_CACHE_TTL_SECS = 900
+MOODLE_ROLE_CACHE_REFRESH_SECS = 300
+MOODLE_ROLE_SHORTNAMES = ["teacher", "student"]
 
 session_factory = database.SessionLocal
+# Set by main when the processor keeps a pool of pre-duplicated courses
+course_pool = None
+moodle_http_session = requests.Session()
 
 
 logging.basicConfig(level=logging.INFO)
@@ -27,107 +64,315 @@ class ProcessorException(Exception):
     pass
 
 
+# Raised for messages that can never succeed, like one for a build that no
+# longer exists, so they are deleted instead of retried
+class NonRetryableProcessorException(ProcessorException):
+    pass
+
+
+# Raised for builds put off while the Moodle circuit breaker is open. They
+# are sent again as a fresh message so waiting on Moodle doesn't use up the
+# retries meant for builds that fail.
+class DeferredProcessorException(ProcessorException):
+    def __init__(self, message, delay_secs):
+        super().__init__(message)
+        self.delay_secs = delay_secs
+
+
+def get_deferral_secs():
+    # Long enough for the circuit breaker to let a probe through
+    open_secs = 0
+    if moodle_circuit_breaker is not None:
+        open_secs = moodle_circuit_breaker.get_open_secs()
+    return min(
+        SQS_MAX_DELAY_SECS, max(SQS_RETRY_BACKOFF_BASE_SECS, math.ceil(open_secs))
+    )
+
+
 # This function allows the code to be testable and
 # talk to the mocked sessionmaker in test_course_build_processor.py
 def get_db():
     return session_factory  # pragma: no cover
 
 
-@cache
-def get_moodle_user_role_by_shortname(shortname: str):
+# Replaced by main with one that renews and reaps leases in the background
+course_build_leases = CourseBuildLeases(get_db)
+
+
+def load_moodle_user_role_id(shortname: str):
     moodle_user_role = moodle_client.get_role_by_shortname(shortname)
     moodle_user_id = moodle_user_role["id"]
     return moodle_user_id
 
 
-def process_course_build(course_build_id, s3_client):
+moodle_role_cache = MetadataCache(
+    "moodle_role",
+    load_moodle_user_role_id,
+    MOODLE_ROLE_CACHE_TTL_SECS,
+    MOODLE_ROLE_CACHE_REFRESH_SECS,
+    prewarm_keys=MOODLE_ROLE_SHORTNAMES,
+)
+
+
+def get_moodle_user_role_by_shortname(shortname: str):
+    return moodle_role_cache.get(shortname)
+
+
+def claim_course_build(session, course_build_id):
+    # Moving the build from CREATED to PROCESSING in a single conditional
+    # update means only one processor replica can ever claim a given build
+    course_build = session.scalars(
+        update(CourseBuild)
+        .where(
+            CourseBuild.id == course_build_id,
+            CourseBuild.status == CourseBuildStatus.CREATED,
+        )
+        .values(
+            status=CourseBuildStatus.PROCESSING, lease_expires_at=get_lease_expiry()
+        )
+        .returning(CourseBuild)
+    ).one_or_none()
+    session.commit()
+    if course_build is not None:
+        return course_build
+
+    course_build_status = session.scalar(
+        select(CourseBuild.status).where(CourseBuild.id == course_build_id)
+    )
+    if course_build_status is None:
+        raise NonRetryableProcessorException(
+            f"""A course build with the id: {course_build_id} does not exist in the course_build table"""  # noqa: E501
+        )
+    elif course_build_status == CourseBuildStatus.PROCESSING:
+        raise ProcessorException(
+            f"""Course build id: {course_build_id} status is processing"""  # noqa: E501
+        )
+    logging.info(
+        f"""The SQS message for course build id: {course_build_id} \
+        has been deleted because the build has a {course_build_status.value} status"""
+    )
+    return None
+
+
+def update_moodle_course(course_id, **fields):
+    # core_course_update_courses isn't wrapped by MoodleClient
+    data = {
+        "wstoken": settings.MOODLE_TOKEN,
+        "moodlewsrestformat": "json",
+        "wsfunction": "core_course_update_courses",
+        "courses[0][id]": course_id,
+    }
+    data.update({f"courses[0][{name}]": value for name, value in fields.items()})
+    response = moodle_http_session.post(
+        f"{settings.MOODLE_URL}/webservice/rest/server.php", data=data
+    )
+    response.raise_for_status()
+    response_data = response.json()
+    if isinstance(response_data, dict) and "exception" in response_data:
+        raise ProcessorException(
+            f"core_course_update_courses failed: {response_data.get('message')}"
+        )
+
+
+def resolve_roles(course_build, results):
+    return {
+        "instructor_role_id": get_moodle_user_role_by_shortname("teacher"),
+        "student_role_id": get_moodle_user_role_by_shortname("student"),
+    }
+
+
+def resolve_instructor(course_build, results):
+    instructor_user = moodle_client.get_user_by_email(
+        course_build["instructor_email"]
+    )
+    return {"instructor_user_id": instructor_user["id"]}
+
+
+def save_course_build_step(course_build_id, step, result):
+    # Steps run away from the build's session so they checkpoint in their own
+    with get_db()() as session:
+        course_build_steps.save_step_result(session, course_build_id, step, result)
+
+
+def duplicate_course(course_build, results):
+    # A previous attempt may have duplicated the course and failed before its
+    # result was saved. Shortnames are unique so reuse that course if so.
+    if course_build_steps.DUPLICATE_COURSE_STARTED in results:
+        existing_courses = moodle_client.get_course_by_shortname(
+            course_build["course_shortname"]
+        )["courses"]
+        if existing_courses:
+            return {"course_id": existing_courses[0]["id"]}
+    else:
+        save_course_build_step(
+            course_build["id"], course_build_steps.DUPLICATE_COURSE_STARTED, {}
+        )
+    if course_pool is not None:
+        pooled_course_id = course_pool.claim(course_build)
+        if pooled_course_id is not None:
+            update_moodle_course(
+                pooled_course_id,
+                fullname=course_build["course_name"],
+                shortname=course_build["course_shortname"],
+                visible=1,
+            )
+            return {"course_id": pooled_course_id, "pooled": True}
+    new_course = moodle_client.copy_course(
+        course_build["base_course_id"],
+        course_build["course_name"],
+        course_build["course_shortname"],
+        course_build["course_category_id"],
+    )
+    return {"course_id": new_course["id"]}
+
+
+def set_enrolment_key(course_id, student_role_id):
+    enrolment_methods = moodle_client.get_self_enrolment_methods(
+        course_id, student_role_id
+    )
+    enrolment_key = secrets.token_urlsafe(8)
+    moodle_client.set_self_enrolment_method_key(
+        enrolment_methods[0]["id"], enrolment_key
+    )
+    return enrolment_key
+
+
+def enrol(course_build, results):
+    course_id = results[course_build_steps.DUPLICATE_COURSE]["course_id"]
+    roles = results[course_build_steps.RESOLVE_ROLES]
+    # Enrolling the instructor and setting up self enrolment are independent
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        enrolment_key = executor.submit(
+            set_enrolment_key, course_id, roles["student_role_id"]
+        )
+        moodle_client.enrol_user(
+            course_id,
+            results[course_build_steps.RESOLVE_INSTRUCTOR]["instructor_user_id"],
+            roles["instructor_role_id"],
+        )
+    return {
+        "course_enrolment_url": course_build_steps.get_enrolment_url(
+            settings.MOODLE_URL, course_id
+        ),
+        "course_enrolment_key": enrolment_key.result(),
+    }
+
+
+def record_csv(session, course_build, results, courses_csv_writer):
+    enrolment = results[course_build_steps.ENROL]
+    # The build is completed in the same commit as this step's result
+    course_build.status = CourseBuildStatus.COMPLETED.value
+    course_build.course_id = results[course_build_steps.DUPLICATE_COURSE]["course_id"]
+    course_build.course_enrollment_url = enrolment["course_enrolment_url"]
+    course_build.course_enrollment_key = enrolment["course_enrolment_key"]
+    course_build_steps.save_step_result(
+        session, course_build.id, course_build_steps.RECORD_CSV, {}
+    )
+    # Only handed to the writer once committed so its export sees the build
+    # as completed
+    courses_csv_writer.add()
+
+
+MOODLE_STEPS = {
+    course_build_steps.RESOLVE_ROLES: resolve_roles,
+    course_build_steps.RESOLVE_INSTRUCTOR: resolve_instructor,
+    course_build_steps.DUPLICATE_COURSE: duplicate_course,
+    course_build_steps.ENROL: enrol,
+}
+
+
+def run_moodle_step(timer, step, course_build, results):
+    with timer.stage(step):
+        return MOODLE_STEPS[step](course_build, results)
+
+
+def run_moodle_steps(session, course_build, results, timer):
+    # Moodle steps run on a thread per step as soon as their dependencies
+    # have results, while results are saved from this thread since the
+    # session must stay on it
+    snapshot = course_build_steps.get_course_build_snapshot(course_build)
+    running = {}
+    error = None
+    with ThreadPoolExecutor(max_workers=len(MOODLE_STEPS)) as executor:
+        while True:
+            if error is None:
+                for step in course_build_steps.get_ready_steps(
+                    results, running.values()
+                ):
+                    if step not in MOODLE_STEPS:
+                        continue
+                    future = executor.submit(
+                        run_moodle_step, timer, step, snapshot, results
+                    )
+                    running[future] = step
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # Let steps already running finish so their results are
+                    # kept for the retry
+                    error = error or e
+                    continue
+                course_build_steps.save_step_result(
+                    session, snapshot["id"], step, result
+                )
+                results[step] = result
+    if error is not None:
+        raise error
+
+
+def process_course_build(course_build_id, courses_csv_writer, claimed=False):
+    timer = metrics.StageTimer()
     get_sessionmaker = get_db()
     with get_sessionmaker() as session:
-        try:
-            course_build = (
-                session.query(CourseBuild)
-                .filter(CourseBuild.id == course_build_id)
-                .one()
-            )
-        except NoResultFound:
-            raise ProcessorException(
-                f"""A course build with the id: {course_build_id} does not exist in the course_build table"""  # noqa: E501
-            )
-        course_build_status = course_build.status.value
-        if course_build_status == CourseBuildStatus.CREATED.value:
-            course_build.status = CourseBuildStatus.PROCESSING.value
-            session.commit()
-        elif course_build_status == CourseBuildStatus.PROCESSING.value:
-            raise ProcessorException(
-                f"""Course build id: {course_build_id} status is processing"""  # noqa: E501
-            )
-        elif (
-            course_build_status == CourseBuildStatus.FAILED.value
-            or course_build_status == CourseBuildStatus.COMPLETED.value
-        ):
-            logging.info(
-                f"""The SQS message for course build id: {course_build_id} \
-                has been deleted because the build has a {course_build_status} status"""
-            )
+        with timer.stage("db_claim"):
+            if claimed:
+                course_build = session.get(CourseBuild, course_build_id)
+            else:
+                course_build = claim_course_build(session, course_build_id)
+        if course_build is None:
+            if claimed:
+                raise NonRetryableProcessorException(
+                    f"""A course build with the id: {course_build_id} does not exist in the course_build table"""  # noqa: E501
+                )
             return
+        course_build_leases.track(course_build_id)
         try:
-            instructor_role_id = get_moodle_user_role_by_shortname("teacher")
-            student_role_id = get_moodle_user_role_by_shortname("student")
-            instructor_user = moodle_client.get_user_by_email(
-                course_build.instructor_email
-            )
-            instructor_user_id = instructor_user["id"]
-            new_course = create_course(
-                moodle_client,
-                course_build.base_course_id,
-                course_build.course_name,
-                course_build.course_shortname,
-                course_build.course_category_id,
-                instructor_role_id,
-                instructor_user_id,
-                student_role_id,
-            )
-
-            course_build.status = CourseBuildStatus.COMPLETED.value
-            course_build.course_id = new_course["course_id"]
-            course_build.course_enrollment_url = new_course["course_enrolment_url"]
-            course_build.course_enrollment_key = new_course["course_enrolment_key"]
+            results = course_build_steps.get_step_results(session, course_build_id)
+            run_moodle_steps(session, course_build, results, timer)
+            if course_build_steps.RECORD_CSV not in results:
+                with timer.stage(course_build_steps.RECORD_CSV):
+                    record_csv(session, course_build, results, courses_csv_writer)
+
+        except MoodleCircuitOpenError as e:
+            # Moodle is down rather than the build being bad so it is left to
+            # be retried from its checkpoints once the circuit closes
+            session.rollback()
+            course_build.status = CourseBuildStatus.CREATED.value
             session.commit()
-
-            s3_bucket = settings.COURSES_CSV_S3_BUCKET
-            s3_key = settings.COURSES_CSV_S3_KEY
-            response = s3_client.get_object(Bucket=s3_bucket, Key=s3_key)
-            csv_data = response["Body"].read().decode("utf-8")
-
-            csv_rows = list(csv.DictReader(io.StringIO(csv_data)))
-            csv_rows.append({
-                "course_id": course_build.course_id,
-                "district": course_build.school_district.name,
-                "research_participation": 0
-            })
-
-            updated_csv_data = io.StringIO()
-            csv_writer = csv.DictWriter(
-                updated_csv_data,
-                fieldnames=csv_rows[0].keys()
+            logging.warning(f"Deferred course build {course_build_id}: {e}")
+            raise DeferredProcessorException(
+                f"Deferred course build {course_build_id}: {e}", get_deferral_secs()
             )
-            csv_writer.writeheader()
-            csv_writer.writerows(csv_rows)
-            s3_client.put_object(Bucket=s3_bucket, Key=s3_key,
-                                 Body=updated_csv_data.getvalue().encode("utf-8"))
-
         except Exception as e:
+            session.rollback()
             course_build.status = CourseBuildStatus.FAILED.value
             session.commit()
             logging.error(f"Failed to build course: {e}")
-            raise ProcessorException
+            raise ProcessorException(f"Failed to build course {course_build_id}: {e}")
+        finally:
+            course_build_leases.untrack(course_build_id)
+            timer.report("course_build_timings", course_build_id=course_build_id)
 
 
-def get_sqs_message_processor(s3_client):
-    def inner(sqs_message):
-        message = json.loads(sqs_message["Body"])
+def get_course_build_processor(courses_csv_writer):
+    def inner(course_build_id, claimed=False):
         build_start_time = time.perf_counter()
-        process_course_build(message["course_build_id"], s3_client)
+        process_course_build(course_build_id, courses_csv_writer, claimed)
         build_completion_time = time.perf_counter()
         logging.info(
             f"The course build took: \
@@ -137,63 +382,591 @@ def get_sqs_message_processor(s3_client):
     return inner
 
 
-def get_sqs_messages(sqs_client, queue_url):
+def get_course_build_id(sqs_message):
+    try:
+        return json.loads(sqs_message["Body"])["course_build_id"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise NonRetryableProcessorException(f"Malformed SQS message: {e}")
+
+
+def get_sqs_message_processor(courses_csv_writer):
+    build_processor = get_course_build_processor(courses_csv_writer)
+
+    def inner(sqs_message):
+        build_processor(get_course_build_id(sqs_message))
+
+    return inner
+
+
+def get_dead_letter_queue_url(sqs_client, dead_letter_queue_name):
+    if not dead_letter_queue_name:
+        return None
+    return sqs_client.get_queue_url(QueueName=dead_letter_queue_name)["QueueUrl"]
+
+
+def enqueue_course_builds(sqs_client, queue_url, course_build_ids):
+    for index in range(0, len(course_build_ids), SQS_MAX_MESSAGES):
+        batch = course_build_ids[index:index + SQS_MAX_MESSAGES]
+        res = sqs_client.send_message_batch(
+            QueueUrl=queue_url,
+            Entries=[
+                {
+                    "Id": str(course_build_id),
+                    "MessageBody": json.dumps({"course_build_id": course_build_id}),
+                }
+                for course_build_id in batch
+            ],
+        )
+        if len(res.get("Failed", [])) > 0:
+            raise ProcessorException(
+                f"Failed enqueueing course builds: {res['Failed']}"
+            )
+
+
+def get_course_build_enqueuer(sqs_client, queue_url):
+    def inner(course_build_ids):
+        enqueue_course_builds(sqs_client, queue_url, course_build_ids)
+
+    return inner
+
+
+def get_sqs_messages(sqs_client, queue_url, heartbeat, max_messages=SQS_MAX_MESSAGES):
     res = sqs_client.receive_message(
         QueueUrl=queue_url,
-        MaxNumberOfMessages=SQS_MAX_MESSAGES,
+        MaxNumberOfMessages=max_messages,
         WaitTimeSeconds=SQS_WAIT_TIME_SECS,
+        AttributeNames=["SentTimestamp", "ApproximateReceiveCount"],
     )
-    return res.get("Messages", [])
+    sqs_messages = res.get("Messages", [])
+    # Prefetched messages can wait for a worker or for the Moodle circuit
+    # breaker to close so they are kept invisible from the moment they arrive
+    for sqs_message in sqs_messages:
+        heartbeat.track(sqs_message["ReceiptHandle"])
+    return sqs_messages
 
 
-def processor_runner(
-    sqs_client, sqs_queue_name, processor, poll_interval_mins, daemonize
+def get_sqs_messages_after_backoff(
+    backoff_secs, sqs_client, queue_url, heartbeat, max_messages
 ):
-    queue_url_data = sqs_client.get_queue_url(QueueName=sqs_queue_name)
-    queue_url = queue_url_data["QueueUrl"]
+    time.sleep(backoff_secs)
+    return get_sqs_messages(sqs_client, queue_url, heartbeat, max_messages)
+
+
+def get_idle_backoff_secs(empty_polls, idle_backoff_max_secs):
+    # Every empty receive has already long polled for SQS_WAIT_TIME_SECS, so
+    # by default the processor polls again right away. The optional backoff
+    # doubles per empty poll up to idle_backoff_max_secs.
+    if empty_polls == 0 or idle_backoff_max_secs <= 0:
+        return 0
+    return min(
+        SQS_IDLE_BACKOFF_BASE_SECS * 2 ** (empty_polls - 1), idle_backoff_max_secs
+    )
+
 
-    while True:
-        sqs_messages = get_sqs_messages(sqs_client, queue_url)
-        for message in sqs_messages:
-            receipt_handle = message["ReceiptHandle"]
+def get_prefetch_size(workers, in_flight, prefetched):
+    # Keep at most one extra round of messages buffered beyond the running
+    # builds so prefetched messages don't sit out their visibility timeout
+    capacity = workers + min(SQS_MAX_MESSAGES, workers) - in_flight - prefetched
+    return min(SQS_MAX_MESSAGES, capacity)
+
+
+class SQSDeleteBatcher:
+    def __init__(self, sqs_client, queue_url):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.lock = threading.Lock()
+        self.pending = []
+        self.oldest_pending_time = None
+
+    def add(self, receipt_handle):
+        with self.lock:
+            if not self.pending:
+                self.oldest_pending_time = time.monotonic()
+            self.pending.append(receipt_handle)
+            return len(self.pending) >= SQS_MAX_MESSAGES
+
+    def is_due(self):
+        with self.lock:
+            if not self.pending:
+                return False
+            return (
+                len(self.pending) >= SQS_MAX_MESSAGES
+                or time.monotonic() - self.oldest_pending_time
+                >= SQS_DELETE_BATCH_MAX_WAIT_SECS
+            )
+
+    def flush(self):
+        with self.lock:
+            batch = self.pending[:SQS_MAX_MESSAGES]
+            self.pending = self.pending[SQS_MAX_MESSAGES:]
+            if self.pending:
+                self.oldest_pending_time = time.monotonic()
+        if not batch:
+            return
+
+        res = self.sqs_client.delete_message_batch(
+            QueueUrl=self.queue_url,
+            Entries=[
+                {"Id": str(index), "ReceiptHandle": receipt_handle}
+                for index, receipt_handle in enumerate(batch)
+            ],
+        )
+        for failure in res.get("Failed", []):
+            logging.error(f"Failed deleting SQS message: {failure}")
+
+    def flush_all(self):
+        while self.pending:
+            self.flush()
+
+
+class SQSVisibilityHeartbeat(BackgroundThread):
+    # Keeps extending the visibility timeout of messages whose builds are still
+    # running so long Moodle course duplications don't get redelivered
+    def __init__(self, sqs_client, queue_url):
+        super().__init__()
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.lock = threading.Lock()
+        self.extensions = {}
+
+    def run(self):
+        while not self.stopped.wait(SQS_HEARTBEAT_INTERVAL_SECS):
+            self.beat()
+
+    def track(self, receipt_handle):
+        # The queue's own visibility timeout can be shorter than a beat so
+        # messages are extended as soon as they are tracked
+        with self.lock:
+            if receipt_handle in self.extensions:
+                return
+            self.extensions[receipt_handle] = 0
+            self.extend(receipt_handle)
+
+    def untrack(self, receipt_handle):
+        # Waits for an extension in progress so it can't overwrite the retry
+        # delay set once the message is untracked
+        with self.lock:
+            extensions = self.extensions.pop(receipt_handle)
+        metrics.COURSE_BUILD_VISIBILITY_EXTENSIONS.observe(extensions)
+
+    def beat(self):
+        with self.lock:
+            receipt_handles = list(self.extensions)
+        for receipt_handle in receipt_handles:
+            with self.lock:
+                # Skips messages untracked since the beat started
+                if receipt_handle in self.extensions:
+                    self.extend(receipt_handle)
+
+    def extend(self, receipt_handle):
+        # Called with the lock held
+        try:
+            self.sqs_client.change_message_visibility(
+                QueueUrl=self.queue_url,
+                ReceiptHandle=receipt_handle,
+                VisibilityTimeout=SQS_HEARTBEAT_VISIBILITY_TIMEOUT_SECS,
+            )
+        except ClientError as e:
+            logging.warning(f"Failed extending SQS message visibility: {e}")
+            return
+        self.extensions[receipt_handle] += 1
+
+
+def get_receive_count(sqs_message):
+    return int(sqs_message.get("Attributes", {}).get("ApproximateReceiveCount", 1))
+
+
+class SQSRetryPolicy:
+    # Decides what happens to a message whose build failed. Messages that can
+    # never succeed are deleted right away, retries are pushed out
+    # exponentially and messages still failing after max_receive_count
+    # attempts are moved to the dead-letter queue with the failure reason.
+    def __init__(
+        self,
+        sqs_client,
+        queue_url,
+        delete_batcher,
+        dead_letter_queue_url=None,
+        max_receive_count=SQS_MAX_RECEIVE_COUNT,
+    ):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.delete_batcher = delete_batcher
+        self.dead_letter_queue_url = dead_letter_queue_url
+        self.max_receive_count = max_receive_count
+
+    def get_retry_delay_secs(self, receive_count):
+        return min(
+            SQS_RETRY_BACKOFF_MAX_SECS,
+            SQS_RETRY_BACKOFF_BASE_SECS * 2 ** (receive_count - 1),
+        )
 
+    def handle_failure(self, sqs_message, error):
+        receive_count = get_receive_count(sqs_message)
+        reason = str(error) or type(error).__name__
+        if isinstance(error, NonRetryableProcessorException):
+            logging.error(f"Deleting SQS message that can't succeed: {reason}")
+            self.delete(sqs_message)
+        elif isinstance(error, DeferredProcessorException):
+            self.requeue(sqs_message, error.delay_secs)
+        elif receive_count >= self.max_receive_count:
+            self.dead_letter(sqs_message, reason, receive_count)
+        else:
+            retry_delay_secs = self.get_retry_delay_secs(receive_count)
+            logging.error(
+                f"Failed processing SQS message, retrying in {retry_delay_secs} "
+                f"seconds: {reason}"
+            )
             try:
-                processor(message)
+                self.sqs_client.change_message_visibility(
+                    QueueUrl=self.queue_url,
+                    ReceiptHandle=sqs_message["ReceiptHandle"],
+                    VisibilityTimeout=retry_delay_secs,
+                )
+            except ClientError as e:
+                logging.warning(f"Failed delaying SQS message retry: {e}")
+
+    def requeue(self, sqs_message, delay_secs):
+        # A fresh message starts over at a receive count of one. The old one
+        # is only deleted once its replacement is sent so the build can't be
+        # lost, and a duplicate finds the build already claimed.
+        logging.warning(f"Requeueing deferred SQS message in {delay_secs} seconds")
+        self.sqs_client.send_message(
+            QueueUrl=self.queue_url,
+            MessageBody=sqs_message["Body"],
+            DelaySeconds=delay_secs,
+        )
+        self.delete(sqs_message)
+
+    def dead_letter(self, sqs_message, reason, receive_count):
+        if self.dead_letter_queue_url is None:
+            logging.error(
+                f"Dropping SQS message after {receive_count} attempts: {reason}"
+            )
+        else:
+            logging.error(
+                f"Dead-lettering SQS message after {receive_count} attempts: {reason}"
+            )
+            self.sqs_client.send_message(
+                QueueUrl=self.dead_letter_queue_url,
+                MessageBody=sqs_message["Body"],
+                MessageAttributes={
+                    "FailureReason": {"DataType": "String", "StringValue": reason},
+                    "ReceiveCount": {
+                        "DataType": "Number",
+                        "StringValue": str(receive_count),
+                    },
+                },
+            )
+        self.delete(sqs_message)
+
+    def delete(self, sqs_message):
+        if self.delete_batcher.add(sqs_message["ReceiptHandle"]):
+            self.delete_batcher.flush()
+
+
+def handle_sqs_message(retry_policy, heartbeat, processor, message):
+    receipt_handle = message["ReceiptHandle"]
+    metrics.observe_start_latency(message)
+
+    error = None
+    heartbeat.track(receipt_handle)
+    try:
+        processor(message)
+    except ProcessorException as e:
+        error = e
+    finally:
+        # Untracked before any retry delay is set so the heartbeat can't
+        # extend the visibility timeout over it
+        heartbeat.untrack(receipt_handle)
+
+    if error is None:
+        retry_policy.delete(message)
+    else:
+        retry_policy.handle_failure(message, error)
+
+
+def is_paused(circuit_breaker, was_paused):
+    paused = circuit_breaker is not None and circuit_breaker.is_open()
+    if paused and not was_paused:
+        logging.warning("Pausing while the Moodle circuit breaker is open")
+    elif was_paused and not paused:
+        logging.info("Resuming after the Moodle circuit breaker stopped failing fast")
+    return paused
+
+
+def reap_completed_builds(in_flight):
+    # Calling result() re-raises anything other than a ProcessorException
+    # so unexpected errors still stop the processor like they used to
+    remaining = set()
+    for future in in_flight:
+        if future.done():
+            future.result()
+        else:
+            remaining.add(future)
+    return remaining
+
+
+def processor_runner(
+    sqs_client,
+    sqs_queue_name,
+    processor,
+    idle_backoff_max_secs,
+    daemonize,
+    workers=1,
+    circuit_breaker=None,
+    dead_letter_queue_name=None,
+    max_receive_count=SQS_MAX_RECEIVE_COUNT,
+):
+    queue_url_data = sqs_client.get_queue_url(QueueName=sqs_queue_name)
+    queue_url = queue_url_data["QueueUrl"]
+    delete_batcher = SQSDeleteBatcher(sqs_client, queue_url)
+    retry_policy = SQSRetryPolicy(
+        sqs_client,
+        queue_url,
+        delete_batcher,
+        get_dead_letter_queue_url(sqs_client, dead_letter_queue_name),
+        max_receive_count,
+    )
+    heartbeat = SQSVisibilityHeartbeat(sqs_client, queue_url)
+    heartbeat.start()
 
-                sqs_client.delete_message(
-                    QueueUrl=queue_url,
-                    ReceiptHandle=receipt_handle,
+    if not daemonize:
+        sqs_messages = get_sqs_messages(
+            sqs_client, queue_url, heartbeat, min(SQS_MAX_MESSAGES, workers)
+        )
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            builds = {
+                executor.submit(
+                    handle_sqs_message, retry_policy, heartbeat, processor, message
+                )
+                for message in sqs_messages
+            }
+        heartbeat.stop()
+        delete_batcher.flush_all()
+        reap_completed_builds(builds)
+        return
+
+    in_flight = set()
+    prefetched = deque()
+    receive = None
+    empty_polls = 0
+    paused = False
+    try:
+        with (
+            ThreadPoolExecutor(max_workers=workers) as executor,
+            ThreadPoolExecutor(max_workers=1) as receiver,
+        ):
+            while True:
+                # Builds would only fail fast while the Moodle circuit breaker
+                # is open so messages are left on the queue until it probes
+                paused = is_paused(circuit_breaker, paused)
+                while not paused and prefetched and len(in_flight) < workers:
+                    in_flight.add(
+                        executor.submit(
+                            handle_sqs_message,
+                            retry_policy,
+                            heartbeat,
+                            processor,
+                            prefetched.popleft(),
+                        )
+                    )
+
+                # Receive the next messages in the background while the
+                # current builds run
+                prefetch_size = get_prefetch_size(
+                    workers, len(in_flight), len(prefetched)
                 )
-            except ProcessorException as e:
-                logging.error(f"Failed processing SQS message: {e}")
+                if receive is None and prefetch_size > 0 and not paused:
+                    receive = receiver.submit(
+                        get_sqs_messages_after_backoff,
+                        get_idle_backoff_secs(empty_polls, idle_backoff_max_secs),
+                        sqs_client,
+                        queue_url,
+                        heartbeat,
+                        prefetch_size,
+                    )
+
+                pending = in_flight | {receive} if receive else in_flight
+                if pending:
+                    wait(
+                        pending,
+                        timeout=SQS_DELETE_BATCH_MAX_WAIT_SECS,
+                        return_when=FIRST_COMPLETED,
+                    )
+                else:
+                    time.sleep(SQS_DELETE_BATCH_MAX_WAIT_SECS)
+                in_flight = reap_completed_builds(in_flight)
+                if delete_batcher.is_due():
+                    delete_batcher.flush()
+
+                if receive is not None and receive.done():
+                    sqs_messages = receive.result()
+                    receive = None
+                    prefetched.extend(sqs_messages)
+                    if len(sqs_messages) == 0:
+                        empty_polls += 1
+                    else:
+                        empty_polls = 0
+                        logging.info(f"Received {len(sqs_messages)} messages")
+    finally:
+        # Builds that finished while the processor was stopping still get
+        # their messages deleted
+        heartbeat.stop()
+        delete_batcher.flush_all()
+
+
+def get_moodle_limiter_args():
+    # The adaptive limit on concurrent Moodle calls is off unless a maximum
+    # is configured
+    max_limit = int(settings.PROCESSOR_MOODLE_CONCURRENCY_MAX)
+    if max_limit <= 0:
+        return None
+    return {
+        "initial_limit": int(settings.PROCESSOR_WORKERS),
+        "min_limit": 1,
+        "max_limit": max_limit,
+        "target_latency_secs": float(settings.PROCESSOR_MOODLE_TARGET_LATENCY_SECS),
+    }
+
+
+def get_moodle_pool_maxsize(workers):
+    # Each worker may run its build's Moodle steps in parallel
+    return workers * len(MOODLE_STEPS)
+
+
+def mount_moodle_adapters(moodle_limiter_args):
+    pool_maxsize = get_moodle_pool_maxsize(int(settings.PROCESSOR_WORKERS))
+    if moodle_limiter_args is None:
+        adapter = get_moodle_adapter(pool_maxsize=pool_maxsize)
+    else:
+        limiter = AIMDLimiter(**moodle_limiter_args)
+        adapter = get_moodle_adapter(
+            lambda adapter: ConcurrencyLimitedAdapter(limiter, adapter),
+            pool_maxsize=pool_maxsize,
+        )
+    for session in [moodle_session, moodle_http_session]:
+        session.mount(settings.MOODLE_URL, adapter)
 
-        if not daemonize:
-            break
 
-        if len(sqs_messages) == 0:  # pragma: no cover
-            time.sleep(poll_interval_mins * 60)
-        else:  # pragma: no cover
-            logging.info(f"Received {len(sqs_messages)} messages")
+def start_course_build_leases(args, sqs_client):
+    global course_build_leases
+    enqueue = None
+    if args.queue == "sqs":
+        queue_url = sqs_client.get_queue_url(QueueName=settings.SQS_QUEUE)["QueueUrl"]
+        enqueue = get_course_build_enqueuer(sqs_client, queue_url)
+    course_build_leases = CourseBuildLeases(get_db, enqueue)
+    course_build_leases.start()
 
 
 def main():
+    global course_pool
     logging.info("Starting processor...")
     parser = argparse.ArgumentParser(description="")
     parser.add_argument("--daemonize", action="store_true", help="Daemonize processor")
+    parser.add_argument(
+        "--engine",
+        choices=["threaded", "asyncio"],
+        default="threaded",
+        help="Run builds on a thread pool or on a single asyncio event loop",
+    )
+    parser.add_argument(
+        "--queue",
+        choices=["sqs", "postgres"],
+        default="sqs",
+        help="Receive builds from SQS or claim them from the course_build table",
+    )
     args = parser.parse_args()
-    daemonize = args.daemonize
+    if args.queue == "postgres" and args.engine != "threaded":
+        parser.error("The postgres queue only supports the threaded engine")
 
     sqs_client = boto3.client("sqs")
     s3_client = boto3.client("s3")
+    courses_csv_writer = CoursesCsvWriter(
+        get_db,
+        s3_client,
+        settings.COURSES_CSV_S3_BUCKET,
+        settings.COURSES_CSV_S3_KEY,
+    )
+
+    if settings.PROCESSOR_METRICS_PORT:
+        metrics.start_metrics_server(int(settings.PROCESSOR_METRICS_PORT))
+
+    moodle_limiter_args = get_moodle_limiter_args()
+    mount_moodle_adapters(moodle_limiter_args)
+
+    # Role ids are loaded before the first build is received and kept fresh
+    # in the background
+    moodle_role_cache.start()
+    course_pool_size = int(settings.PROCESSOR_COURSE_POOL_SIZE)
+    if course_pool_size > 0:
+        course_pool = CoursePool(
+            get_db, moodle_client, update_moodle_course, course_pool_size
+        )
+        course_pool.start()
+    # Builds left in PROCESSING by a processor that was killed are reclaimed
+    # once their lease expires
+    if args.daemonize:  # pragma: no cover
+        start_course_build_leases(args, sqs_client)
+        database.moodle_settings_cache.start()
+    courses_csv_writer.start()
+    try:
+        run_processor(args, sqs_client, courses_csv_writer, moodle_limiter_args)
+    finally:
+        courses_csv_writer.stop()
+        course_build_leases.stop()
+        database.moodle_settings_cache.stop()
+        moodle_role_cache.stop()
+        if course_pool is not None:
+            course_pool.stop()
+            course_pool = None
+
+
+def run_processor(args, sqs_client, courses_csv_writer, moodle_limiter_args=None):
+    if args.queue == "postgres":
+        # Imported here since the postgres queue builds on this module
+        from rope.api.processors import postgres_queue
+
+        postgres_queue.processor_runner(
+            engine=database.engine,
+            processor=get_course_build_processor(courses_csv_writer),
+            daemonize=args.daemonize,
+            workers=int(settings.PROCESSOR_WORKERS),
+            circuit_breaker=moodle_circuit_breaker,
+        )
+        return
+
+    if args.engine == "asyncio":
+        # Imported here since the asyncio engine builds on this module
+        from rope.api.processors import async_course_build_processor
+
+        asyncio.run(
+            async_course_build_processor.run(
+                sqs_client=sqs_client,
+                courses_csv_writer=courses_csv_writer,
+                sqs_queue_name=settings.SQS_QUEUE,
+                idle_backoff_max_secs=int(settings.SQS_IDLE_BACKOFF_MAX_SECS),
+                daemonize=args.daemonize,
+                workers=int(settings.PROCESSOR_WORKERS),
+                moodle_limiter_args=moodle_limiter_args,
+                dead_letter_queue_name=settings.SQS_DEAD_LETTER_QUEUE,
+                max_receive_count=int(settings.SQS_MAX_RECEIVE_COUNT),
+            )
+        )
+        return
 
-    processor = get_sqs_message_processor(s3_client)
+    processor = get_sqs_message_processor(courses_csv_writer)
 
     processor_runner(
         sqs_client=sqs_client,
         sqs_queue_name=settings.SQS_QUEUE,
         processor=processor,
-        poll_interval_mins=int(settings.SQS_POLL_INTERVAL_MINS),
-        daemonize=daemonize,
+        idle_backoff_max_secs=int(settings.SQS_IDLE_BACKOFF_MAX_SECS),
+        daemonize=args.daemonize,
+        workers=int(settings.PROCESSOR_WORKERS),
+        circuit_breaker=moodle_circuit_breaker,
+        dead_letter_queue_name=settings.SQS_DEAD_LETTER_QUEUE,
+        max_receive_count=int(settings.SQS_MAX_RECEIVE_COUNT),
     )
 
 
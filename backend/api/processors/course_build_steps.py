@@ -0,0 +1,81 @@
+from sqlalchemy import select
+
+from rope.db.schema import CourseBuildStep
+
+# Each step's result is checkpointed in course_build_step once it succeeds so
+# a retried build resumes from the first step without a result instead of
+# duplicating the Moodle course again
+RESOLVE_ROLES = "resolve_roles"
+RESOLVE_INSTRUCTOR = "resolve_instructor"
+DUPLICATE_COURSE = "duplicate_course"
+ENROL = "enrol"
+RECORD_CSV = "record_csv"
+# Saved before the course is duplicated. A retry only takes a Moodle course
+# with the build's shortname as its own when this is set since one created
+# some other way may have the same shortname.
+DUPLICATE_COURSE_STARTED = "duplicate_course_started"
+
+COURSE_BUILD_STEPS = [
+    RESOLVE_ROLES,
+    RESOLVE_INSTRUCTOR,
+    DUPLICATE_COURSE,
+    ENROL,
+    RECORD_CSV,
+]
+
+# The steps each step needs results from. Steps whose dependencies have all
+# completed run at the same time. The course is only duplicated once the
+# instructor is found so a bad email can't leave behind a course that is
+# never enrolled.
+COURSE_BUILD_STEP_DEPENDENCIES = {
+    RESOLVE_ROLES: [],
+    RESOLVE_INSTRUCTOR: [],
+    DUPLICATE_COURSE: [RESOLVE_INSTRUCTOR],
+    ENROL: [RESOLVE_ROLES, RESOLVE_INSTRUCTOR, DUPLICATE_COURSE],
+    RECORD_CSV: [ENROL],
+}
+
+
+def get_ready_steps(results, running):
+    return [
+        step
+        for step in COURSE_BUILD_STEPS
+        if step not in results
+        and step not in running
+        and all(dep in results for dep in COURSE_BUILD_STEP_DEPENDENCIES[step])
+    ]
+
+
+def get_course_build_snapshot(course_build):
+    # Moodle steps only need these fields and may run outside the session's
+    # thread so they are given a plain copy
+    return {
+        "id": course_build.id,
+        "instructor_email": course_build.instructor_email,
+        "base_course_id": course_build.base_course_id,
+        "academic_year": course_build.academic_year,
+        "course_name": course_build.course_name,
+        "course_shortname": course_build.course_shortname,
+        "course_category_id": course_build.course_category_id,
+    }
+
+
+def get_step_results(session, course_build_id):
+    rows = session.execute(
+        select(CourseBuildStep.step, CourseBuildStep.result).where(
+            CourseBuildStep.course_build_id == course_build_id
+        )
+    )
+    return {step: result for step, result in rows}
+
+
+def save_step_result(session, course_build_id, step, result):
+    # Committed along with any other changes pending in the session
+    session.add(
+        CourseBuildStep(course_build_id=course_build_id, step=step, result=result)
+    )
+    session.commit()
+
+
+def get_enrolment_url(moodle_url, course_id):
+    return f"{moodle_url}/enrol/index.php?id={course_id}"
@@ -0,0 +1,269 @@
+import logging
+import secrets
+from datetime import timedelta
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from rope.api import database
+from rope.api.background import BackgroundThread
+from rope.api.processors import metrics
+from rope.db.schema import PooledCourse, PooledCourseStatus
+
+COURSE_POOL_FILL_INTERVAL_SECS = 60
+COURSE_POOL_FILL_LOCK_ID = 7202
+# Longer than any duplication takes so only courses whose processor failed or
+# stopped before recording them are reaped
+COURSE_POOL_PENDING_TIMEOUT_SECS = 3600
+POOLED_COURSE_SHORTNAME_PREFIX = "rope-pool"
+
+
+def get_pool_settings(session):
+    moodle_settings = database.get_moodle_settings_snapshot(session)
+    if any(
+        name not in moodle_settings
+        for name in ["base_course_id", "academic_year", "course_category_id"]
+    ):
+        return None
+    return {
+        "base_course_id": int(moodle_settings["base_course_id"]),
+        "academic_year": moodle_settings["academic_year"],
+        "course_category_id": int(moodle_settings["course_category_id"]),
+    }
+
+
+def invalidate_pooled_courses(session, pool_settings):
+    # Stock duplicated from a previous base course or academic year can never
+    # be claimed again. The courses stay hidden in Moodle.
+    invalidated = session.execute(
+        update(PooledCourse)
+        .where(
+            PooledCourse.status == PooledCourseStatus.AVAILABLE,
+            (PooledCourse.base_course_id != pool_settings["base_course_id"])
+            | (PooledCourse.academic_year != pool_settings["academic_year"])
+            | (
+                PooledCourse.course_category_id
+                != pool_settings["course_category_id"]
+            ),
+        )
+        .values(status=PooledCourseStatus.INVALIDATED)
+    ).rowcount
+    if invalidated:
+        logging.info(f"Invalidated {invalidated} pooled courses")
+
+
+def count_available_courses(
+    session, pool_settings, status=PooledCourseStatus.AVAILABLE
+):
+    return session.scalar(
+        select(func.count())
+        .select_from(PooledCourse)
+        .where(
+            PooledCourse.status == status,
+            PooledCourse.base_course_id == pool_settings["base_course_id"],
+            PooledCourse.academic_year == pool_settings["academic_year"],
+            PooledCourse.course_category_id == pool_settings["course_category_id"],
+        )
+    )
+
+
+def get_stale_pending_courses(session):
+    return session.execute(
+        select(
+            PooledCourse.id,
+            PooledCourse.course_shortname,
+            PooledCourse.base_course_id,
+            PooledCourse.academic_year,
+            PooledCourse.course_category_id,
+        ).where(
+            PooledCourse.status == PooledCourseStatus.PENDING,
+            PooledCourse.created_at
+            < func.timezone("UTC", func.now())
+            - timedelta(seconds=COURSE_POOL_PENDING_TIMEOUT_SECS),
+        )
+    ).mappings().all()
+
+
+def make_pooled_course_available(session, pending_course, course_id):
+    made_available = session.execute(
+        update(PooledCourse)
+        .where(
+            PooledCourse.id == pending_course["id"],
+            PooledCourse.status == PooledCourseStatus.PENDING,
+        )
+        .values(course_id=course_id, status=PooledCourseStatus.AVAILABLE)
+    ).rowcount
+    # The pending row may have been reaped while a slow duplication was still
+    # running, or already recorded by another replica's reaper
+    if not made_available:
+        session.execute(
+            insert(PooledCourse)
+            .values(
+                course_id=course_id,
+                course_shortname=pending_course["course_shortname"],
+                base_course_id=pending_course["base_course_id"],
+                academic_year=pending_course["academic_year"],
+                course_category_id=pending_course["course_category_id"],
+                status=PooledCourseStatus.AVAILABLE,
+            )
+            .on_conflict_do_nothing(index_elements=[PooledCourse.course_id])
+        )
+    session.commit()
+
+
+def claim_pooled_course(session, course_build):
+    # A previous attempt of this build may already hold a pooled course
+    claimed_course_id = session.scalar(
+        select(PooledCourse.course_id).where(
+            PooledCourse.course_build_id == course_build["id"],
+            PooledCourse.status == PooledCourseStatus.CLAIMED,
+        )
+    )
+    if claimed_course_id is not None:
+        return claimed_course_id
+
+    available_course = (
+        select(PooledCourse.id)
+        .where(
+            PooledCourse.status == PooledCourseStatus.AVAILABLE,
+            PooledCourse.base_course_id == course_build["base_course_id"],
+            PooledCourse.academic_year == course_build["academic_year"],
+            PooledCourse.course_category_id == course_build["course_category_id"],
+        )
+        .order_by(PooledCourse.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    course_id = session.scalar(
+        update(PooledCourse)
+        .where(PooledCourse.id == available_course)
+        .values(
+            status=PooledCourseStatus.CLAIMED, course_build_id=course_build["id"]
+        )
+        .returning(PooledCourse.course_id)
+    )
+    session.commit()
+    return course_id
+
+
+class CoursePool(BackgroundThread):
+    # Keeps a pool of hidden duplicates of the current base course so builds
+    # can rename one instead of waiting on core_course_duplicate_course
+    def __init__(
+        self,
+        get_sessionmaker,
+        moodle_client,
+        update_course,
+        size,
+        fill_interval_secs=COURSE_POOL_FILL_INTERVAL_SECS,
+    ):
+        super().__init__()
+        self.get_sessionmaker = get_sessionmaker
+        self.moodle_client = moodle_client
+        self.update_course = update_course
+        self.size = size
+        self.fill_interval_secs = fill_interval_secs
+
+    def run(self):
+        while True:
+            try:
+                self.fill()
+            except Exception as e:
+                logging.error(f"Failed filling the course pool: {e}")
+            if self.stopped.wait(self.fill_interval_secs):
+                return
+
+    def fill(self):
+        self.reap_pending_courses()
+        while not self.stopped.is_set() and self.add_course():
+            pass
+
+    def reserve_course(self):
+        with self.get_sessionmaker()() as session:
+            # Only one processor replica tops up the pool at a time. The lock
+            # is released once the pending course is committed so nothing is
+            # held open while Moodle duplicates it.
+            acquired = session.scalar(
+                select(func.pg_try_advisory_xact_lock(COURSE_POOL_FILL_LOCK_ID))
+            )
+            if not acquired:
+                return None
+            pool_settings = get_pool_settings(session)
+            if pool_settings is None:
+                return None
+            invalidate_pooled_courses(session, pool_settings)
+            available = count_available_courses(session, pool_settings)
+            pending = count_available_courses(
+                session, pool_settings, PooledCourseStatus.PENDING
+            )
+            metrics.COURSE_POOL_AVAILABLE.set(available)
+            if available + pending >= self.size:
+                session.commit()
+                return None
+
+            pending_course = {
+                "course_shortname": (
+                    f"{POOLED_COURSE_SHORTNAME_PREFIX}-{secrets.token_hex(6)}"
+                ),
+                **pool_settings,
+            }
+            pooled_course = PooledCourse(
+                status=PooledCourseStatus.PENDING, **pending_course
+            )
+            session.add(pooled_course)
+            session.commit()
+            return {"id": pooled_course.id, **pending_course}
+
+    def add_course(self):
+        pending_course = self.reserve_course()
+        if pending_course is None:
+            return False
+        # A failure from here on leaves the course pending for
+        # reap_pending_courses to record or drop
+        new_course = self.moodle_client.copy_course(
+            pending_course["base_course_id"],
+            f"Course pool {pending_course['academic_year']}",
+            pending_course["course_shortname"],
+            pending_course["course_category_id"],
+        )
+        self.update_course(new_course["id"], visible=0)
+        with self.get_sessionmaker()() as session:
+            make_pooled_course_available(session, pending_course, new_course["id"])
+            available = count_available_courses(session, pending_course)
+        metrics.COURSE_POOL_AVAILABLE.set(available)
+        return True
+
+    def reap_pending_courses(self):
+        # Whether Moodle created a course that was never recorded can only be
+        # told from its shortname
+        with self.get_sessionmaker()() as session:
+            stale_courses = get_stale_pending_courses(session)
+        for pending_course in stale_courses:
+            existing_courses = self.moodle_client.get_course_by_shortname(
+                pending_course["course_shortname"]
+            )["courses"]
+            if existing_courses:
+                course_id = existing_courses[0]["id"]
+                self.update_course(course_id, visible=0)
+                with self.get_sessionmaker()() as session:
+                    make_pooled_course_available(session, pending_course, course_id)
+                logging.info(f"Recovered pending pooled course {course_id}")
+                continue
+            with self.get_sessionmaker()() as session:
+                session.execute(
+                    delete(PooledCourse).where(
+                        PooledCourse.id == pending_course["id"],
+                        PooledCourse.status == PooledCourseStatus.PENDING,
+                    )
+                )
+                session.commit()
+
+    def claim(self, course_build):
+        with self.get_sessionmaker()() as session:
+            course_id = claim_pooled_course(session, course_build)
+        if course_id is None:
+            metrics.COURSE_POOL_MISSES.inc()
+        else:
+            metrics.COURSE_POOL_HITS.inc()
+        return course_id
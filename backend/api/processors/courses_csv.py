@@ -0,0 +1,375 @@
+import csv
+import itertools
+import logging
+import threading
+import time
+
+from botocore.exceptions import ClientError
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from rope.api.background import BackgroundThread
+from rope.api.processors import metrics
+from rope.db.schema import (
+    CourseBuild,
+    CourseBuildStatus,
+    CoursesCsvRow,
+    SchoolDistrict,
+    generate_utc_timestamp,
+)
+
+COURSES_CSV_FLUSH_ROWS = 25
+COURSES_CSV_FLUSH_INTERVAL_SECS = 30
+COURSES_CSV_CHECK_INTERVAL_SECS = 1
+COURSES_CSV_FIELDNAMES = ["course_id", "district", "research_participation"]
+COURSES_CSV_EXPORT_LOCK_ID = 7201
+# Set on every CSV the exporter writes. A CSV without it was written by
+# something else and may have courses that aren't tracked yet.
+COURSES_CSV_EXPORTED_AT_METADATA_KEY = "exported-at"
+COURSES_CSV_YIELD_PER = 1000
+S3_MULTIPART_PART_SIZE = 8 * 1024 * 1024
+# Every part but the last must be at least this large
+S3_MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class S3MultipartUpload:
+    # File-like object that streams writes to S3 as multipart upload parts so
+    # the whole object never has to be held in memory
+    def __init__(self, s3_client, s3_bucket, s3_key, metadata, timer=None):
+        self.s3_client = s3_client
+        self.s3_bucket = s3_bucket
+        self.s3_key = s3_key
+        self.timer = timer or metrics.StageTimer()
+        with self.timer.stage("s3_csv_write"):
+            res = s3_client.create_multipart_upload(
+                Bucket=s3_bucket,
+                Key=s3_key,
+                ContentType="text/csv",
+                Metadata=metadata,
+            )
+        self.upload_id = res["UploadId"]
+        self.parts = []
+        self.buffer = bytearray()
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.buffer.extend(data)
+        if len(self.buffer) >= S3_MULTIPART_PART_SIZE:
+            self.upload_part()
+
+    def upload_part(self):
+        part_number = len(self.parts) + 1
+        with self.timer.stage("s3_csv_write"):
+            res = self.s3_client.upload_part(
+                Bucket=self.s3_bucket,
+                Key=self.s3_key,
+                UploadId=self.upload_id,
+                PartNumber=part_number,
+                Body=bytes(self.buffer),
+            )
+        self.parts.append({"ETag": res["ETag"], "PartNumber": part_number})
+        self.buffer = bytearray()
+
+    def copy_part(self, etag):
+        # S3 copies the existing object into the upload server side so
+        # appending to it doesn't download and upload it again
+        part_number = len(self.parts) + 1
+        with self.timer.stage("s3_csv_write"):
+            res = self.s3_client.upload_part_copy(
+                Bucket=self.s3_bucket,
+                Key=self.s3_key,
+                UploadId=self.upload_id,
+                PartNumber=part_number,
+                CopySource={"Bucket": self.s3_bucket, "Key": self.s3_key},
+                CopySourceIfMatch=etag,
+            )
+        self.parts.append(
+            {"ETag": res["CopyPartResult"]["ETag"], "PartNumber": part_number}
+        )
+
+    def complete(self, conditions=None):
+        if self.buffer or not self.parts:
+            self.upload_part()
+        with self.timer.stage("s3_csv_write"):
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.s3_bucket,
+                Key=self.s3_key,
+                UploadId=self.upload_id,
+                MultipartUpload={"Parts": self.parts},
+                **(conditions or {}),
+            )
+
+    def abort(self):
+        self.s3_client.abort_multipart_upload(
+            Bucket=self.s3_bucket, Key=self.s3_key, UploadId=self.upload_id
+        )
+
+
+def timed_iter(timer, stage, iterable):
+    # Streaming interleaves reads and writes so only the time spent fetching
+    # each item is counted towards the stage
+    iterator = iter(iterable)
+    while True:
+        with timer.stage(stage):
+            item = next(iterator, None)
+        if item is None:
+            return
+        yield item
+
+
+def get_courses_csv_rows(session, new_only):
+    query = (
+        select(CourseBuild.course_id, SchoolDistrict.name)
+        .join(SchoolDistrict, CourseBuild.school_district_id == SchoolDistrict.id)
+        .where(
+            CourseBuild.status == CourseBuildStatus.COMPLETED,
+            CourseBuild.course_id.is_not(None),
+        )
+        .order_by(CourseBuild.id)
+        .execution_options(yield_per=COURSES_CSV_YIELD_PER)
+    )
+    if new_only:
+        # Courses already in the CSV are skipped even when their build was
+        # updated after they were exported
+        query = query.outerjoin(
+            CoursesCsvRow, CoursesCsvRow.course_id == CourseBuild.course_id
+        ).where(CoursesCsvRow.id.is_(None))
+
+    # yield_per streams rows from a server side cursor
+    for course_id, district in session.execute(query):
+        yield [course_id, district, 0]
+
+
+def record_courses_csv_rows(session, course_ids):
+    if len(course_ids) == 0:
+        return
+    session.execute(
+        insert(CoursesCsvRow).on_conflict_do_nothing(index_elements=["course_id"]),
+        [{"course_id": course_id} for course_id in course_ids],
+    )
+
+
+def iter_csv_lines(chunks):
+    # csv.reader needs one line at a time while S3 streams arbitrary chunks
+    rest = b""
+    for chunk in chunks:
+        lines = (rest + chunk).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            yield (line + b"\n").decode("utf-8")
+    if rest:
+        yield rest.decode("utf-8")
+
+
+def copy_chunks(upload, chunks):
+    for chunk in chunks:
+        upload.write(chunk)
+        yield chunk
+
+
+def get_existing_courses_csv(s3_client, s3_bucket, s3_key):
+    try:
+        return s3_client.head_object(Bucket=s3_bucket, Key=s3_key)
+    except ClientError:
+        return None
+
+
+def is_untracked(existing):
+    metadata = existing.get("Metadata", {})
+    return COURSES_CSV_EXPORTED_AT_METADATA_KEY not in metadata
+
+
+def get_write_conditions(existing):
+    # The advisory lock only serializes exporters. The ETag also stops an
+    # incremental export from overwriting a CSV that anything else, like a
+    # manual upload, changed since it was read.
+    if existing is None:
+        return {"IfNoneMatch": "*"}
+    return {"IfMatch": existing["ETag"]}
+
+
+def copy_existing_courses_csv(session, s3_client, upload, existing, timer):
+    untracked = is_untracked(existing)
+    if not untracked and existing["ContentLength"] >= S3_MULTIPART_MIN_PART_SIZE:
+        upload.copy_part(existing["ETag"])
+        return
+
+    with timer.stage("s3_csv_read"):
+        res = s3_client.get_object(
+            Bucket=upload.s3_bucket, Key=upload.s3_key, IfMatch=existing["ETag"]
+        )
+        chunks = res["Body"].iter_chunks(S3_MULTIPART_PART_SIZE)
+    chunks = timed_iter(timer, "s3_csv_read", chunks)
+    if not untracked:
+        for chunk in chunks:
+            upload.write(chunk)
+        return
+
+    # Courses in a CSV the exporter didn't write, like the one the processor
+    # used to append to, are tracked so they aren't appended again
+    logging.info("Tracking the courses already in the courses CSV")
+    course_ids = []
+    for row in csv.reader(iter_csv_lines(copy_chunks(upload, chunks))):
+        if len(row) == 0 or row[0] == COURSES_CSV_FIELDNAMES[0]:
+            continue
+        course_ids.append(int(row[0]))
+        if len(course_ids) >= COURSES_CSV_YIELD_PER:
+            record_courses_csv_rows(session, course_ids)
+            course_ids = []
+    record_courses_csv_rows(session, course_ids)
+
+
+def write_courses_csv_rows(session, csv_writer, rows):
+    course_ids = []
+    for row in rows:
+        csv_writer.writerow(row)
+        course_ids.append(row[0])
+        if len(course_ids) >= COURSES_CSV_YIELD_PER:
+            record_courses_csv_rows(session, course_ids)
+            course_ids = []
+    record_courses_csv_rows(session, course_ids)
+
+
+def export_courses_csv(session, s3_client, s3_bucket, s3_key, incremental=False):
+    # Only one exporter may run at a time otherwise two incremental exports
+    # could append the same rows
+    acquired = session.scalar(
+        select(func.pg_try_advisory_xact_lock(COURSES_CSV_EXPORT_LOCK_ID))
+    )
+    if not acquired:
+        logging.info("Another courses CSV export is running, skipping")
+        return False
+
+    timer = metrics.StageTimer()
+    try:
+        existing = None
+        conditions = None
+        if incremental:
+            with timer.stage("s3_csv_read"):
+                existing = get_existing_courses_csv(s3_client, s3_bucket, s3_key)
+            conditions = get_write_conditions(existing)
+        if existing is None:
+            # A full export rewrites every row so tracking starts over
+            session.execute(delete(CoursesCsvRow))
+
+        rows = timed_iter(
+            timer,
+            "db_csv_rows",
+            get_courses_csv_rows(session, new_only=existing is not None),
+        )
+        if existing is not None and not is_untracked(existing):
+            first_row = next(rows, None)
+            if first_row is None:
+                logging.info("No new courses to export to the courses CSV")
+                session.commit()
+                return True
+            rows = itertools.chain([first_row], rows)
+
+        upload = S3MultipartUpload(
+            s3_client,
+            s3_bucket,
+            s3_key,
+            {
+                COURSES_CSV_EXPORTED_AT_METADATA_KEY: (
+                    generate_utc_timestamp().isoformat()
+                )
+            },
+            timer,
+        )
+        try:
+            csv_writer = csv.writer(upload)
+            if existing is None:
+                csv_writer.writerow(COURSES_CSV_FIELDNAMES)
+            else:
+                copy_existing_courses_csv(session, s3_client, upload, existing, timer)
+            write_courses_csv_rows(session, csv_writer, rows)
+            upload.complete(conditions)
+        except Exception:
+            upload.abort()
+            raise
+        # The courses are only tracked once the CSV with them is written. A
+        # failed commit appends them again rather than losing them.
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        timer.report("courses_csv_export_timings", incremental=incremental)
+    return True
+
+
+class CoursesCsvWriter(BackgroundThread):
+    # Coalesces completed builds into incremental exports of the courses CSV
+    # which run in the background on a size or time trigger. Builds are only
+    # added once the transaction completing them has committed so the export
+    # always sees them as completed.
+    def __init__(
+        self,
+        get_sessionmaker,
+        s3_client,
+        s3_bucket,
+        s3_key,
+        flush_rows=COURSES_CSV_FLUSH_ROWS,
+        flush_interval_secs=COURSES_CSV_FLUSH_INTERVAL_SECS,
+    ):
+        super().__init__()
+        self.get_sessionmaker = get_sessionmaker
+        self.s3_client = s3_client
+        self.s3_bucket = s3_bucket
+        self.s3_key = s3_key
+        self.flush_rows = flush_rows
+        self.flush_interval_secs = flush_interval_secs
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = []
+
+    def stop(self):
+        super().stop()
+        self.flush()
+
+    def run(self):
+        while not self.stopped.wait(COURSES_CSV_CHECK_INTERVAL_SECS):
+            if not self.is_due():
+                continue
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Failed exporting courses CSV: {e}")
+
+    def add(self):
+        # Exports read the completed builds from the database so only the
+        # time each one completed is needed to trigger them
+        with self.lock:
+            self.pending.append(time.monotonic())
+
+    def is_due(self):
+        with self.lock:
+            if not self.pending:
+                return False
+            return (
+                len(self.pending) >= self.flush_rows
+                or time.monotonic() - self.pending[0] >= self.flush_interval_secs
+            )
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                exportable = self.pending
+                self.pending = []
+            if not exportable:
+                return
+            try:
+                with self.get_sessionmaker()() as session:
+                    export_courses_csv(
+                        session,
+                        self.s3_client,
+                        self.s3_bucket,
+                        self.s3_key,
+                        incremental=True,
+                    )
+            except Exception:
+                # Keep the builds pending so the next flush exports them
+                with self.lock:
+                    self.pending = exportable + self.pending
+                raise
@@ -0,0 +1,66 @@
+import logging
+import threading
+import time
+
+from rope.api.background import BackgroundThread
+from rope.api.processors import metrics
+
+
+class MetadataCache(BackgroundThread):
+    # Small TTL cache for Moodle metadata such as role ids which rarely
+    # changes but is needed by every build. Entries can be prewarmed at
+    # startup and are reloaded in the background before they expire so
+    # builds almost never wait on a lookup. Failed loads are not cached.
+    def __init__(
+        self, name, loader, ttl_secs, refresh_interval_secs, prewarm_keys=()
+    ):
+        super().__init__()
+        self.name = name
+        self.loader = loader
+        self.ttl_secs = ttl_secs
+        self.refresh_interval_secs = refresh_interval_secs
+        self.prewarm_keys = list(prewarm_keys)
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get_cached(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and time.monotonic() < entry[1]:
+            metrics.METADATA_CACHE_HITS.labels(cache=self.name).inc()
+            return entry[0]
+        metrics.METADATA_CACHE_MISSES.labels(cache=self.name).inc()
+        return None
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl_secs)
+
+    def get(self, key):
+        value = self.get_cached(key)
+        if value is None:
+            value = self.loader(key)
+            self.set(key, value)
+        return value
+
+    def load(self, keys):
+        for key in keys:
+            try:
+                self.set(key, self.loader(key))
+            except Exception as e:
+                # Keep serving the previous value until it expires
+                logging.error(f"Failed loading {self.name} {key}: {e}")
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def start(self):
+        self.load(self.prewarm_keys)
+        super().start()
+
+    def run(self):
+        while not self.stopped.wait(self.refresh_interval_secs):
+            with self.lock:
+                keys = list(self.entries)
+            self.load(keys)
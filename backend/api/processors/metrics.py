@@ -0,0 +1,97 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+COURSE_BUILD_START_LATENCY = Histogram(
+    "rope_course_build_start_latency_seconds",
+    "Time from a course build being queued until a processor starts it",
+    buckets=(1, 5, 10, 20, 30, 60, 120, 300, 600, 1800, 3600),
+)
+COURSE_BUILD_VISIBILITY_EXTENSIONS = Histogram(
+    "rope_course_build_visibility_extensions",
+    "Number of SQS visibility timeout extensions made while a build ran",
+    buckets=(0, 1, 2, 3, 5, 10, 20),
+)
+COURSE_BUILD_STAGE_DURATION = Histogram(
+    "rope_course_build_stage_duration_seconds",
+    "Time spent in each stage of building a course and exporting the courses CSV",
+    ["stage"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+METADATA_CACHE_HITS = Counter(
+    "rope_metadata_cache_hits",
+    "Moodle metadata lookups served from the processor cache",
+    ["cache"],
+)
+METADATA_CACHE_MISSES = Counter(
+    "rope_metadata_cache_misses",
+    "Moodle metadata lookups that missed the processor cache",
+    ["cache"],
+)
+COURSE_POOL_HITS = Counter(
+    "rope_course_pool_hits",
+    "Course builds that claimed a pre-duplicated course from the pool",
+)
+COURSE_POOL_MISSES = Counter(
+    "rope_course_pool_misses",
+    "Course builds that found the pool empty and duplicated the base course",
+)
+COURSE_POOL_AVAILABLE = Gauge(
+    "rope_course_pool_available",
+    "Pre-duplicated courses available in the pool",
+)
+COURSE_BUILDS_REAPED = Counter(
+    "rope_course_builds_reaped",
+    "Course builds reset to CREATED after their processor's lease expired",
+)
+MOODLE_CONCURRENCY_LIMIT = Gauge(
+    "rope_moodle_concurrency_limit",
+    "Concurrent Moodle calls currently allowed by the processor",
+)
+
+
+def start_metrics_server(port):
+    start_http_server(port)
+
+
+def observe_start_latency(sqs_message):
+    sent_timestamp = sqs_message.get("Attributes", {}).get("SentTimestamp")
+    if sent_timestamp is None:
+        return
+    start_latency = max(0, time.time() - int(sent_timestamp) / 1000)
+    COURSE_BUILD_START_LATENCY.observe(start_latency)
+
+
+class StageTimer:
+    # Accumulates the time spent in each named stage of a course build or CSV
+    # export so it can be observed and logged together once the work is done
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = (
+                self.timings.get(name, 0) + time.perf_counter() - start_time
+            )
+
+    def report(self, event, **fields):
+        for name, secs in self.timings.items():
+            COURSE_BUILD_STAGE_DURATION.labels(stage=name).observe(secs)
+        logging.info(
+            json.dumps(
+                {
+                    "event": event,
+                    **fields,
+                    "stage_secs": {
+                        name: round(secs, 4) for name, secs in self.timings.items()
+                    },
+                }
+            )
+        )
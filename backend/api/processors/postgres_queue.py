@@ -0,0 +1,116 @@
+import logging
+import select
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from sqlalchemy import select as sql_select, update
+
+from rope.api.processors import course_build_processor
+from rope.api.processors.course_build_leases import get_lease_expiry
+from rope.api.processors.course_build_processor import (
+    ProcessorException,
+    reap_completed_builds,
+)
+from rope.db.schema import CourseBuild, CourseBuildStatus
+
+# Channel notified by the course_build_created trigger whenever a build is
+# inserted or reset with a CREATED status
+COURSE_BUILD_CHANNEL = "course_build_created"
+# Upper bound on how long an idle worker waits for a notification before
+# checking the table again
+POSTGRES_QUEUE_POLL_SECS = 30
+
+
+def claim_course_builds(session, limit):
+    # SKIP LOCKED lets concurrent processors claim disjoint sets of pending
+    # builds without waiting on each other. The CTE is only evaluated once so
+    # a rescanned subquery can't lock more than limit builds.
+    pending_course_builds = (
+        sql_select(CourseBuild.id)
+        .where(CourseBuild.status == CourseBuildStatus.CREATED)
+        .order_by(CourseBuild.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .cte("pending_course_builds")
+    )
+    course_build_ids = session.scalars(
+        update(CourseBuild)
+        .where(CourseBuild.id.in_(sql_select(pending_course_builds.c.id)))
+        .values(
+            status=CourseBuildStatus.PROCESSING, lease_expires_at=get_lease_expiry()
+        )
+        .returning(CourseBuild.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    session.commit()
+    return sorted(course_build_ids)
+
+
+class CourseBuildListener:
+    def __init__(self, engine):
+        self.connection = engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        )
+        self.connection.exec_driver_sql(f"LISTEN {COURSE_BUILD_CHANNEL}")
+        self.dbapi_connection = self.connection.connection.dbapi_connection
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.dbapi_connection], [], [], timeout)
+        if readable:
+            self.dbapi_connection.poll()
+        notified = len(self.dbapi_connection.notifies) > 0
+        self.dbapi_connection.notifies.clear()
+        return notified
+
+    def close(self):
+        self.connection.close()
+
+
+def handle_course_build(processor, course_build_id):
+    try:
+        processor(course_build_id, claimed=True)
+    except ProcessorException as e:
+        logging.error(f"Failed processing course build {course_build_id}: {e}")
+
+
+def processor_runner(engine, processor, daemonize, workers=1, circuit_breaker=None):
+    get_sessionmaker = course_build_processor.get_db()
+    listener = CourseBuildListener(engine)
+
+    in_flight = set()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                if len(in_flight) >= workers:
+                    wait(in_flight, return_when=FIRST_COMPLETED)
+                in_flight = reap_completed_builds(in_flight)
+
+                # Builds deferred while the Moodle circuit breaker is open are
+                # reset to CREATED so claiming waits until it probes again
+                if daemonize and circuit_breaker is not None:
+                    open_secs = circuit_breaker.get_open_secs()
+                    if open_secs > 0:  # pragma: no cover
+                        logging.warning("Paused while the Moodle circuit is open")
+                        time.sleep(open_secs)
+                        continue
+
+                with get_sessionmaker() as session:
+                    course_build_ids = claim_course_builds(
+                        session, workers - len(in_flight)
+                    )
+                for course_build_id in course_build_ids:
+                    in_flight.add(
+                        executor.submit(handle_course_build, processor, course_build_id)
+                    )
+
+                if not daemonize:
+                    wait(in_flight)
+                    reap_completed_builds(in_flight)
+                    break
+
+                if len(course_build_ids) == 0:  # pragma: no cover
+                    listener.wait(POSTGRES_QUEUE_POLL_SECS)
+                else:  # pragma: no cover
+                    logging.info(f"Claimed {len(course_build_ids)} course builds")
+    finally:
+        listener.close()
@@ -1,10 +1,17 @@
-import json
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from typing import Annotated, Optional
+from datetime import datetime
+from fastapi import APIRouter, Depends, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session, sessionmaker
+from typing import Annotated, Literal, Optional
 import requests
-from rope.api.auth import verify_user, verify_manager
-from rope.api import database, settings, utils
+from requests.adapters import HTTPAdapter
+from rope.api.auth import verify_admin, verify_user, verify_manager
+from rope.api import course_build_export, database, settings, utils
+from rope.api.moodle_circuit_breaker import (
+    CircuitBreakerAdapter,
+    get_moodle_circuit_breaker,
+)
+from rope.api.moodle_rate_limiter import get_moodle_rate_limiter, RateLimitedAdapter
 from rope.db.schema import CourseBuildStatus
 from moodlecli.moodle import MoodleClient
 from rope.api.models import (
@@ -12,27 +19,80 @@ from rope.api.models import (
     FullCourseBuildSettings,
     MoodleUser,
 )
+
+COURSE_BUILDS_PAGE_SIZE = 100
+COURSE_BUILDS_MAX_LIMIT = 1000
+COURSE_SHORTNAME_MAX_ATTEMPTS = 5
+# FastAPI runs sync endpoints on a threadpool of 40 threads, each of which may
+# be calling Moodle
+MOODLE_POOL_MAXSIZE = 40
+
 router = APIRouter(
     tags=["moodle"],
 )
+moodle_session = requests.Session()
+# Shared with the processor so both stay within one Moodle call budget
+moodle_rate_limiter = get_moodle_rate_limiter(lambda: database.SessionLocal)
+moodle_circuit_breaker = get_moodle_circuit_breaker()
+
+
+def get_moodle_adapter(wrap_sender=None, pool_maxsize=MOODLE_POOL_MAXSIZE):
+    # Calls wait for a rate limit token, then go through wrap_sender (the
+    # processor's concurrency limit) and fail fast while Moodle is down. The
+    # pool keeps a connection open for every call that can run at once
+    # instead of discarding them and handshaking again.
+    adapter = HTTPAdapter(pool_maxsize=pool_maxsize)
+    if moodle_circuit_breaker is not None:
+        adapter = CircuitBreakerAdapter(moodle_circuit_breaker)
+    if wrap_sender is not None:
+        adapter = wrap_sender(adapter)
+    if moodle_rate_limiter is not None:
+        adapter = RateLimitedAdapter(moodle_rate_limiter, adapter)
+    return adapter
+
+
+moodle_session.mount(settings.MOODLE_URL, get_moodle_adapter())
 moodle_client = MoodleClient(
-    requests.Session(),
+    moodle_session,
     settings.MOODLE_URL,
     settings.MOODLE_TOKEN,
 )
 
 
+def search_moodle_course_shortnames(search):
+    # core_course_search_courses isn't wrapped by MoodleClient. It matches
+    # more than shortnames and can miss courses so it only rules candidates
+    # out, the one picked is checked with get_course_by_shortname.
+    response = moodle_session.post(
+        f"{settings.MOODLE_URL}/webservice/rest/server.php",
+        data={
+            "wstoken": settings.MOODLE_TOKEN,
+            "moodlewsrestformat": "json",
+            "wsfunction": "core_course_search_courses",
+            "criterianame": "search",
+            "criteriavalue": search,
+        },
+    )
+    response.raise_for_status()
+    response_data = response.json()
+    if "exception" in response_data:
+        raise Exception(
+            f"core_course_search_courses failed: {response_data.get('message')}"
+        )
+    return {course["shortname"] for course in response_data["courses"]}
+
+
 @router.post("/moodle/course/build")
 def create_course_build(
     current_user: Annotated[dict, Depends(verify_manager)],
     course_build_settings: BaseCourseBuildSettings,
     db: Session = Depends(database.get_db),
-    sqs_client=Depends(utils.get_sqs_client)
 ) -> FullCourseBuildSettings:
-    academic_year = database.get_moodle_setting_by_name(db, "academic_year")
-    academic_year_short = database.get_moodle_setting_by_name(db, "academic_year_short")
-    course_category_id = database.get_moodle_setting_by_name(db, "course_category_id")
-    base_course_id = database.get_moodle_setting_by_name(db, "base_course_id")
+    moodle_settings = database.get_moodle_settings_snapshot(db)
+    academic_year = moodle_settings.get("academic_year")
+    academic_year_short = moodle_settings.get("academic_year_short")
+    course_category_id = moodle_settings.get("course_category_id")
+    base_course_id = moodle_settings.get("base_course_id")
     if any(
         setting is None
         for setting in [
@@ -51,47 +111,52 @@ def create_course_build(
         instructor_lastname,
         academic_year,
     )
-    maybe_course_shortname = utils.create_course_shortname(
-        instructor_firstname, instructor_lastname, academic_year_short
+    course_shortname_prefix = utils.get_course_shortname_prefix(
+        instructor_firstname, instructor_lastname
     )
-    nonce = 1
-    while not utils.check_course_shortname_uniqueness(
-        db, moodle_client, maybe_course_shortname
-    ):
-        maybe_course_shortname = utils.create_course_shortname(
-            instructor_firstname, instructor_lastname, academic_year_short, nonce
-        )
-        nonce += 1
+    taken_course_shortnames = database.get_course_shortnames_by_prefix(
+        db, course_shortname_prefix
+    ) | search_moodle_course_shortnames(course_shortname_prefix)
     user_db = database.get_user_by_email(db, current_user["email"])
     school_district_name = course_build_settings.school_district_name
     school_district = database.get_district_by_name(db, school_district_name)
     school_district_id = school_district.id
     creator = user_db.id
     status = CourseBuildStatus.CREATED.value
-    new_course_build = database.create_course_build(
-        db,
-        instructor_firstname,
-        instructor_lastname,
-        instructor_email,
-        school_district_id,
-        academic_year,
-        academic_year_short,
-        course_category_id,
-        base_course_id,
-        course_name,
-        maybe_course_shortname,
-        status,
-        creator,
-    )
-    if settings.SQS_QUEUE:
-        queue_url = utils.get_sqs_queue_url(sqs_client, settings.SQS_QUEUE)
-        message_body = {
-            "course_build_id": new_course_build.id
-        }
-        sqs_client.send_message(
-            QueueUrl=queue_url,
-            MessageBody=json.dumps(message_body)
+    # The unique constraint on course_shortname settles concurrent
+    # submissions that picked the same shortname. Moodle courses the search
+    # missed cost an attempt each.
+    for _ in range(COURSE_SHORTNAME_MAX_ATTEMPTS):
+        maybe_course_shortname = utils.allocate_course_shortname(
+            instructor_firstname,
+            instructor_lastname,
+            academic_year_short,
+            taken_course_shortnames,
+        )
+        if moodle_client.get_course_by_shortname(maybe_course_shortname)["courses"]:
+            taken_course_shortnames.add(maybe_course_shortname)
+            continue
+        new_course_build = database.create_course_build(
+            db,
+            instructor_firstname,
+            instructor_lastname,
+            instructor_email,
+            school_district_id,
+            academic_year,
+            academic_year_short,
+            course_category_id,
+            base_course_id,
+            course_name,
+            maybe_course_shortname,
+            status,
+            creator,
+            enqueue=bool(settings.SQS_QUEUE),
         )
+        if new_course_build is not None:
+            break
+        taken_course_shortnames.add(maybe_course_shortname)
+    else:
+        raise Exception("Could not allocate a unique course shortname.")
 
     return {
         "id": new_course_build.id,
@@ -110,31 +175,75 @@ def create_course_build(
 
 @router.get("/moodle/course/build", dependencies=[Depends(verify_user)])
 def get_course_builds(
+    response: Response,
     db: Session = Depends(database.get_db),
     academic_year: str = None,
     instructor_email: str = None,
+    status: CourseBuildStatus = None,
+    school_district_name: str = None,
+    created_after: datetime = None,
+    created_before: datetime = None,
+    after_id: int = None,
+    limit: Annotated[int, Query(ge=1, le=COURSE_BUILDS_MAX_LIMIT)] = (
+        COURSE_BUILDS_PAGE_SIZE
+    ),
 ) -> list[FullCourseBuildSettings]:
-    course_builds = database.get_course_builds(db, academic_year, instructor_email)
-    response = []
-    for course in course_builds:
-        response.append({
-            "id": course.id,
-            "instructor_firstname": course.instructor_firstname,
-            "instructor_lastname": course.instructor_lastname,
-            "instructor_email": course.instructor_email,
-            "school_district_name": course.school_district.name,
-            "academic_year": course.academic_year,
-            "academic_year_short": course.academic_year_short,
-            "course_name": course.course_name,
-            "course_shortname": course.course_shortname,
-            "creator_email": course.creator.email,
-            "status": course.status.value,
-            "course_id": course.course_id,
-            "course_enrollment_url": course.course_enrollment_url,
-            "course_enrollment_key": course.course_enrollment_key
-        })
-
-    return response
+    course_builds = database.get_course_builds(
+        db,
+        academic_year,
+        instructor_email,
+        status=status,
+        school_district_name=school_district_name,
+        created_after=created_after,
+        created_before=created_before,
+        after_id=after_id,
+        limit=limit,
+    )
+    # A full page may be followed by another that starts after its last build
+    if len(course_builds) == limit:
+        response.headers["X-Next-After-Id"] = str(course_builds[-1]["id"])
+    return [
+        {**course_build, "status": course_build["status"].value}
+        for course_build in course_builds
+    ]
+
+
+@router.get("/moodle/course/build/export", dependencies=[Depends(verify_admin)])
+def export_course_builds(
+    format: Literal["csv", "ndjson"] = "ndjson",
+    academic_year: str = None,
+    instructor_email: str = None,
+    status: CourseBuildStatus = None,
+    school_district_name: str = None,
+    created_after: datetime = None,
+    created_before: datetime = None,
+    session_factory: sessionmaker = Depends(database.get_sessionmaker),
+):
+    # Streams every matching build without holding them in memory. The
+    # request's session is closed before the body is sent so the stream opens
+    # its own.
+    query = course_build_export.get_course_build_export_query(
+        academic_year,
+        instructor_email,
+        status=status,
+        school_district_name=school_district_name,
+        created_after=created_after,
+        created_before=created_before,
+    )
+    if format == "csv":
+        return StreamingResponse(
+            course_build_export.stream_course_builds_csv(
+                lambda: session_factory, query
+            ),
+            media_type="text/csv",
+            headers={"Content-Disposition": "attachment; filename=course_builds.csv"},
+        )
+    return StreamingResponse(
+        course_build_export.stream_course_builds_ndjson(
+            lambda: session_factory, query
+        ),
+        media_type="application/x-ndjson",
+    )
 
 
 @router.get("/moodle/user", dependencies=[Depends(verify_user)])
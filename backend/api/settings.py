@@ -9,9 +9,23 @@ PG_USER = os.getenv("POSTGRES_USER", "")
 PG_PASSWORD = os.getenv("POSTGRES_PASSWORD", "")
 MOODLE_TOKEN = os.getenv("MOODLE_TOKEN", "")
 MOODLE_URL = os.getenv("MOODLE_URL", "")
+MOODLE_RATE_LIMITS = os.getenv("MOODLE_RATE_LIMITS", "")
+MOODLE_RATE_LIMIT_BACKEND = os.getenv("MOODLE_RATE_LIMIT_BACKEND", "local")
+MOODLE_CIRCUIT_FAILURE_THRESHOLD = os.getenv("MOODLE_CIRCUIT_FAILURE_THRESHOLD", "5")
+MOODLE_CIRCUIT_SLOW_CALL_SECS = os.getenv("MOODLE_CIRCUIT_SLOW_CALL_SECS", "30")
+MOODLE_CIRCUIT_RESET_SECS = os.getenv("MOODLE_CIRCUIT_RESET_SECS", "30")
 
 SQS_QUEUE = os.getenv("SQS_QUEUE", "")
-SQS_POLL_INTERVAL_MINS = os.getenv("SQS_POLL_INTERVAL_MINS", "")
+SQS_IDLE_BACKOFF_MAX_SECS = os.getenv("SQS_IDLE_BACKOFF_MAX_SECS", "0")
+SQS_DEAD_LETTER_QUEUE = os.getenv("SQS_DEAD_LETTER_QUEUE", "")
+SQS_MAX_RECEIVE_COUNT = os.getenv("SQS_MAX_RECEIVE_COUNT", "5")
+PROCESSOR_WORKERS = os.getenv("PROCESSOR_WORKERS", "1")
+PROCESSOR_METRICS_PORT = os.getenv("PROCESSOR_METRICS_PORT", "")
+PROCESSOR_COURSE_POOL_SIZE = os.getenv("PROCESSOR_COURSE_POOL_SIZE", "0")
+PROCESSOR_MOODLE_CONCURRENCY_MAX = os.getenv("PROCESSOR_MOODLE_CONCURRENCY_MAX", "0")
+PROCESSOR_MOODLE_TARGET_LATENCY_SECS = os.getenv(
+    "PROCESSOR_MOODLE_TARGET_LATENCY_SECS", "2"
+)
 
 COURSES_CSV_S3_BUCKET = os.getenv("COURSES_CSV_S3_BUCKET")
 COURSES_CSV_S3_KEY = os.getenv("COURSES_CSV_S3_KEY")
@@ -1,5 +1,4 @@
 import boto3
-from rope.api import database
 
 
 def create_course_name(instructor_firstname, instructor_lastname, academic_year):
@@ -9,25 +8,40 @@ def create_course_name(instructor_firstname, instructor_lastname, academic_year)
     return course_name
 
 
+def get_course_shortname_prefix(instructor_firstname, instructor_lastname):
+    return f"Alg1 {instructor_firstname[0]}{instructor_lastname[0]}"
+
+
 def create_course_shortname(
     instructor_firstname, instructor_lastname, academic_year_short, nonce=None
 ):
-    course_shortname = (
-        f"Alg1 {instructor_firstname[0]}{instructor_lastname[0]} {academic_year_short}"
+    course_shortname_prefix = get_course_shortname_prefix(
+        instructor_firstname, instructor_lastname
     )
+    course_shortname = f"{course_shortname_prefix} {academic_year_short}"
     if nonce is not None:
-        course_shortname = f"Alg1 {instructor_firstname[0]}{instructor_lastname[0]}{nonce} {academic_year_short}"  # noqa: E501
+        course_shortname = f"{course_shortname_prefix}{nonce} {academic_year_short}"
     return course_shortname
 
 
-def check_course_shortname_uniqueness(db, moodle_client, course_shortname):
-    moodle_course_shortname = moodle_client.get_course_by_shortname(course_shortname)
-    db_course_shortname = database.get_course_by_shortname(db, course_shortname)
-    if len(moodle_course_shortname["courses"]) > 0:
-        return False
-    if db_course_shortname is not None:
-        return False
-    return True
+def allocate_course_shortname(
+    instructor_firstname,
+    instructor_lastname,
+    academic_year_short,
+    taken_course_shortnames,
+):
+    # Picks the lowest free nonce from shortnames already known to be taken
+    # so no lookup is made per candidate
+    course_shortname = create_course_shortname(
+        instructor_firstname, instructor_lastname, academic_year_short
+    )
+    nonce = 1
+    while course_shortname in taken_course_shortnames:
+        course_shortname = create_course_shortname(
+            instructor_firstname, instructor_lastname, academic_year_short, nonce
+        )
+        nonce += 1
+    return course_shortname
 
 
 def get_sqs_client():
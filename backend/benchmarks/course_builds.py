@@ -0,0 +1,290 @@
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+import uuid
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from moodlecli.moodle import MoodleClient
+from sqlalchemy import delete, select
+
+from fakes import (
+    FakeMoodle,
+    FakeMoodleServer,
+    InMemoryS3Client,
+    InMemorySQSClient,
+    QueueDrained,
+)
+from rope.api import settings
+from rope.api.async_moodle import AsyncMoodleClient
+from rope.api.processors import async_course_build_processor, course_build_processor
+from rope.api.processors.course_build_processor import ProcessorException
+from rope.api.processors.courses_csv import CoursesCsvWriter
+from rope.db.schema import (
+    CourseBuild,
+    CourseBuildStatus,
+    SchoolDistrict,
+    UserAccount,
+)
+from rope.scripts.inject_course_build_sqs import inject_course_build
+
+BENCHMARK_QUEUE = "benchmark"
+BENCHMARK_DISTRICT = "benchmark_isd"
+BENCHMARK_MANAGER = "benchmark@rice.edu"
+BENCHMARK_SHORTNAME_PREFIX = "Bench"
+
+
+class BuildStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.failed = 0
+
+    def record(self, latency_secs, failed):
+        with self.lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.latencies.append(latency_secs)
+
+    @property
+    def finished(self):
+        with self.lock:
+            return len(self.latencies) + self.failed
+
+
+def get_or_create(session, model, **fields):
+    instance = session.scalars(select(model).filter_by(**fields)).first()
+    if instance is None:
+        instance = model(**fields)
+        session.add(instance)
+        session.commit()
+    return instance
+
+
+def generate_workload(session, sqs_client, builds, run_id):
+    district = get_or_create(
+        session, SchoolDistrict, name=BENCHMARK_DISTRICT, active=True
+    )
+    manager = get_or_create(
+        session, UserAccount, email=BENCHMARK_MANAGER, is_manager=True, is_admin=False
+    )
+    course_builds = [
+        CourseBuild(
+            instructor_firstname="Bench",
+            instructor_lastname=f"{i}",
+            instructor_email=f"bench-{run_id}-{i}@rice.edu",
+            course_name=f"Algebra 1 - Bench {run_id} {i} (AY 2024)",
+            course_shortname=f"{BENCHMARK_SHORTNAME_PREFIX} {run_id} {i}",
+            course_category_id=6,
+            school_district_id=district.id,
+            academic_year="AY 2024",
+            academic_year_short="AY24",
+            base_course_id=70,
+            status=CourseBuildStatus.CREATED,
+            creator_id=manager.id,
+        )
+        for i in range(builds)
+    ]
+    session.add_all(course_builds)
+    session.commit()
+    for course_build in course_builds:
+        inject_course_build(sqs_client, BENCHMARK_QUEUE, course_build.id)
+
+
+def cleanup_workload(session, run_id):
+    session.execute(
+        delete(CourseBuild).where(
+            CourseBuild.course_shortname.startswith(
+                f"{BENCHMARK_SHORTNAME_PREFIX} {run_id} "
+            )
+        )
+    )
+    session.commit()
+
+
+def get_timed_processor(processor, stats):
+    def inner(sqs_message):
+        start_time = time.perf_counter()
+        failed = True
+        try:
+            processor(sqs_message)
+            failed = False
+        finally:
+            stats.record(time.perf_counter() - start_time, failed)
+
+    return inner
+
+
+def get_async_timed_processor(processor, stats):
+    async def inner(sqs_message):
+        start_time = time.perf_counter()
+        failed = True
+        try:
+            await processor(sqs_message)
+            failed = False
+        finally:
+            stats.record(time.perf_counter() - start_time, failed)
+
+    return inner
+
+
+def run_threaded(sqs_client, courses_csv_writer, stats, workers):
+    processor = get_timed_processor(
+        course_build_processor.get_sqs_message_processor(courses_csv_writer), stats
+    )
+    course_build_processor.processor_runner(
+        sqs_client=sqs_client,
+        sqs_queue_name=BENCHMARK_QUEUE,
+        processor=processor,
+        idle_backoff_max_secs=0,
+        daemonize=True,
+        workers=workers,
+    )
+
+
+async def run_asyncio(sqs_client, courses_csv_writer, stats, workers):
+    limits = httpx.Limits(max_connections=workers, max_keepalive_connections=workers)
+    async with httpx.AsyncClient(limits=limits) as http_client:
+        moodle = AsyncMoodleClient(
+            http_client, settings.MOODLE_URL, settings.MOODLE_TOKEN
+        )
+        processor = get_async_timed_processor(
+            async_course_build_processor.get_sqs_message_processor(
+                courses_csv_writer, moodle
+            ),
+            stats,
+        )
+        await async_course_build_processor.processor_runner(
+            sqs_client=sqs_client,
+            sqs_queue_name=BENCHMARK_QUEUE,
+            processor=processor,
+            idle_backoff_max_secs=0,
+            daemonize=True,
+            workers=workers,
+        )
+
+
+def run(builds, workers, engine, fake_moodle):
+    server = FakeMoodleServer(fake_moodle)
+    server.start()
+    # Point the processor at the fake Moodle rather than the configured one
+    settings.MOODLE_URL = server.url
+    settings.MOODLE_TOKEN = "benchmark"
+    moodle_session = requests.Session()
+    moodle_session.mount(
+        server.url,
+        HTTPAdapter(
+            pool_maxsize=course_build_processor.get_moodle_pool_maxsize(workers)
+        ),
+    )
+    course_build_processor.moodle_client = MoodleClient(
+        moodle_session, server.url, "benchmark"
+    )
+    course_build_processor.moodle_role_cache.clear()
+
+    sqs_client = InMemorySQSClient()
+    s3_client = InMemoryS3Client()
+    courses_csv_writer = CoursesCsvWriter(
+        course_build_processor.get_db, s3_client, "benchmark", "courses.csv"
+    )
+    stats = BuildStats()
+    run_id = uuid.uuid4().hex[:8]
+
+    with course_build_processor.get_db()() as session:
+        generate_workload(session, sqs_client, builds, run_id)
+    sqs_client.is_drained = lambda: stats.finished >= builds
+
+    course_build_processor.moodle_role_cache.start()
+    courses_csv_writer.start()
+    start_time = time.perf_counter()
+    try:
+        if engine == "asyncio":
+            asyncio.run(run_asyncio(sqs_client, courses_csv_writer, stats, workers))
+        else:
+            run_threaded(sqs_client, courses_csv_writer, stats, workers)
+    except (QueueDrained, ProcessorException):
+        pass
+    elapsed = time.perf_counter() - start_time
+    courses_csv_writer.stop()
+    course_build_processor.moodle_role_cache.stop()
+    server.stop()
+
+    with course_build_processor.get_db()() as session:
+        cleanup_workload(session, run_id)
+
+    return elapsed, stats
+
+
+def report(builds, elapsed, stats, fake_moodle):
+    latencies = sorted(stats.latencies)
+    if len(latencies) >= 2:
+        percentiles = statistics.quantiles(latencies, n=100)
+        p50, p99 = percentiles[49], percentiles[98]
+    else:
+        p50 = p99 = latencies[0] if latencies else 0
+    moodle_calls = sum(fake_moodle.calls.values())
+
+    print(f"builds:              {builds} ({stats.failed} failed)")
+    print(f"builds/min:          {len(latencies) / elapsed * 60:.1f}")
+    print(f"p50 build latency:   {p50:.3f}s")
+    print(f"p99 build latency:   {p99:.3f}s")
+    print(f"moodle calls/build:  {moodle_calls / builds:.2f}")
+    for wsfunction, calls in sorted(fake_moodle.calls.items()):
+        print(f"  {wsfunction:<45} {calls / builds:.2f}")
+
+
+def parse_function_values(values):
+    parsed = {}
+    for value in values:
+        wsfunction, number = value.split("=")
+        parsed[wsfunction] = float(number)
+    return parsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Run course builds end to end against a fake Moodle and in-memory "
+            "SQS and S3. Requires the development Postgres database."
+        )
+    )
+    parser.add_argument("--builds", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--engine", choices=["threaded", "asyncio"], default="threaded")
+    parser.add_argument(
+        "--moodle-latency-secs",
+        type=float,
+        default=0.05,
+        help="Latency of every Moodle web service function",
+    )
+    parser.add_argument(
+        "--function-latency-secs",
+        nargs="*",
+        default=[],
+        metavar="WSFUNCTION=SECS",
+        help="Latency of specific web service functions",
+    )
+    parser.add_argument(
+        "--function-error-rate",
+        nargs="*",
+        default=[],
+        metavar="WSFUNCTION=RATE",
+        help="Fraction of calls to specific web service functions that fail",
+    )
+    args = parser.parse_args()
+
+    fake_moodle = FakeMoodle(
+        default_latency_secs=args.moodle_latency_secs,
+        latency_secs=parse_function_values(args.function_latency_secs),
+        error_rates=parse_function_values(args.function_error_rate),
+    )
+    elapsed, stats = run(args.builds, args.workers, args.engine, fake_moodle)
+    report(args.builds, elapsed, stats, fake_moodle)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from botocore.exceptions import ClientError
+
+
+class QueueDrained(Exception):
+    pass
+
+
+class InMemorySQSClient:
+    # Just enough of the SQS API for the processor. Messages are never
+    # redelivered since the benchmark builds don't outlive their visibility.
+    # Setting is_drained lets a daemonized processor runner be stopped.
+    def __init__(self, message_count=0):
+        self.lock = threading.Lock()
+        self.messages = deque(
+            {
+                "ReceiptHandle": f"message{i}",
+                "Body": json.dumps({"course_build_id": i}),
+            }
+            for i in range(message_count)
+        )
+        self.sent = message_count
+        self.deleted = 0
+        self.is_drained = None
+
+    def get_queue_url(self, QueueName):
+        return {"QueueUrl": f"https://{QueueName}"}
+
+    def send_message(self, QueueUrl, MessageBody):
+        with self.lock:
+            self.messages.append(
+                {
+                    "ReceiptHandle": f"message{self.sent}",
+                    "Body": MessageBody,
+                    "Attributes": {"SentTimestamp": str(int(time.time() * 1000))},
+                }
+            )
+            self.sent += 1
+        return {"MessageId": str(self.sent)}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages, **kwargs):
+        with self.lock:
+            if self.is_drained is not None and self.is_drained():
+                raise QueueDrained
+            received = [
+                self.messages.popleft()
+                for _ in range(min(MaxNumberOfMessages, len(self.messages)))
+            ]
+        if not received:
+            # Stand in for a short long poll
+            time.sleep(0.05)
+        return {"Messages": received}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        with self.lock:
+            self.deleted += len(Entries)
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        return {}
+
+
+def get_etag(data):
+    return f'"{hashlib.md5(data).hexdigest()}"'
+
+
+class InMemoryS3Body:
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+    def read(self):
+        return self.stream.read()
+
+    def iter_chunks(self, chunk_size):
+        while chunk := self.stream.read(chunk_size):
+            yield chunk
+
+
+class InMemoryS3Client:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.objects = {}
+        self.uploads = {}
+        self.upload_count = 0
+
+    def get(self, Bucket, Key):
+        with self.lock:
+            if (Bucket, Key) not in self.objects:
+                raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+            return self.objects[(Bucket, Key)]
+
+    def head_object(self, Bucket, Key):
+        data, metadata = self.get(Bucket, Key)
+        return {
+            "ETag": get_etag(data),
+            "ContentLength": len(data),
+            "Metadata": metadata,
+        }
+
+    def get_object(self, Bucket, Key, **kwargs):
+        data, metadata = self.get(Bucket, Key)
+        return {"Body": InMemoryS3Body(data), "Metadata": metadata}
+
+    def create_multipart_upload(self, Bucket, Key, Metadata, **kwargs):
+        with self.lock:
+            self.upload_count += 1
+            upload_id = f"upload{self.upload_count}"
+            self.uploads[upload_id] = ({}, Metadata)
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        with self.lock:
+            self.uploads[UploadId][0][PartNumber] = Body
+        return {"ETag": f'"{UploadId}-{PartNumber}"'}
+
+    def upload_part_copy(
+        self, Bucket, Key, UploadId, PartNumber, CopySource, **kwargs
+    ):
+        data, _ = self.get(CopySource["Bucket"], CopySource["Key"])
+        with self.lock:
+            self.uploads[UploadId][0][PartNumber] = data
+        return {"CopyPartResult": {"ETag": f'"{UploadId}-{PartNumber}"'}}
+
+    def complete_multipart_upload(
+        self, Bucket, Key, UploadId, MultipartUpload, **kwargs
+    ):
+        # Conditional writes always succeed since the benchmark has a single
+        # exporter
+        with self.lock:
+            parts, metadata = self.uploads.pop(UploadId)
+            self.objects[(Bucket, Key)] = (
+                b"".join(parts[number] for number in sorted(parts)),
+                metadata,
+            )
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        with self.lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+
+class FakeMoodle:
+    # Responds to the web service functions used by course builds after a
+    # configurable latency, failing a configurable fraction of calls
+    def __init__(self, default_latency_secs=0, latency_secs=None, error_rates=None):
+        self.default_latency_secs = default_latency_secs
+        self.latency_secs = latency_secs or {}
+        self.error_rates = error_rates or {}
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.next_id = 1000
+
+    def get_next_id(self):
+        with self.lock:
+            self.next_id += 1
+            return self.next_id
+
+    def handle(self, params):
+        wsfunction = params["wsfunction"]
+        with self.lock:
+            self.calls[wsfunction] += 1
+        time.sleep(self.latency_secs.get(wsfunction, self.default_latency_secs))
+        if random.random() < self.error_rates.get(wsfunction, 0):
+            return {"exception": "moodle_exception", "message": "Injected error"}
+
+        if wsfunction == "local_raisecli_get_role_by_shortname":
+            return {"id": 3 if params["shortname"] == "teacher" else 5}
+        elif wsfunction == "core_user_get_users_by_field":
+            return [{"id": self.get_next_id(), "email": params["values[0]"]}]
+        elif wsfunction == "core_course_get_courses_by_field":
+            return {"courses": [], "warnings": []}
+        elif wsfunction == "core_course_duplicate_course":
+            return {"id": self.get_next_id(), "shortname": params["shortname"]}
+        elif wsfunction == "local_raisecli_get_self_enrolment_methods":
+            return [{"id": self.get_next_id()}]
+        return None
+
+
+class FakeMoodleServer:
+    def __init__(self, fake_moodle):
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                content_length = int(self.headers["Content-Length"])
+                params = {
+                    name: values[0]
+                    for name, values in parse_qs(
+                        self.rfile.read(content_length).decode("utf-8")
+                    ).items()
+                }
+                body = json.dumps(fake_moodle.handle(params)).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,52 @@
+import argparse
+import time
+
+from fakes import InMemorySQSClient
+from rope.api.processors import course_build_processor
+
+
+def get_simulated_processor(build_latency_secs):
+    # Builds spend almost all of their time waiting on Moodle so a sleep is
+    # a reasonable stand in for process_course_build here
+    def inner(sqs_message):
+        time.sleep(build_latency_secs)
+
+    return inner
+
+
+def run(builds, workers, build_latency_secs):
+    sqs_client = InMemorySQSClient(builds)
+    processor = get_simulated_processor(build_latency_secs)
+
+    start_time = time.perf_counter()
+    while sqs_client.deleted < builds:
+        course_build_processor.processor_runner(
+            sqs_client=sqs_client,
+            sqs_queue_name="benchmark",
+            processor=processor,
+            idle_backoff_max_secs=0,
+            daemonize=False,
+            workers=workers,
+        )
+    elapsed = time.perf_counter() - start_time
+
+    return builds / elapsed * 60
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure course build throughput for processor pool sizes"
+    )
+    parser.add_argument("--builds", type=int, default=40)
+    parser.add_argument("--build-latency-secs", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'builds/min':>12}")
+    for workers in args.workers:
+        builds_per_min = run(args.builds, workers, args.build_latency_secs)
+        print(f"{workers:>8} {builds_per_min:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import UniqueConstraint, ForeignKey
+from sqlalchemy import DateTime, UniqueConstraint, ForeignKey, Index, text
+from sqlalchemy.dialects.postgresql import JSONB
 
 from datetime import datetime, timezone
 
@@ -67,6 +68,17 @@ class CourseBuild(Base):
     __table_args__ = (
         UniqueConstraint("course_shortname"),
         UniqueConstraint("instructor_email", "academic_year"),
+        Index(
+            "ix_course_build_pending",
+            "id",
+            postgresql_where=text("status = 'CREATED'"),
+        ),
+        Index("ix_course_build_academic_year", "academic_year", "id"),
+        Index(
+            "ix_course_build_lease_expires_at",
+            "lease_expires_at",
+            postgresql_where=text("status = 'PROCESSING'"),
+        ),
     )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
@@ -84,7 +96,89 @@ class CourseBuild(Base):
     academic_year_short: Mapped[str]
     base_course_id: Mapped[int]
     status: Mapped[CourseBuildStatus]
+    lease_expires_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True)
+    )
     creator_id: Mapped[int] = mapped_column(ForeignKey("user_account.id"))
 
     school_district: Mapped[SchoolDistrict] = relationship()
     creator: Mapped[UserAccount] = relationship()
+
+
+class CourseBuildStep(Base):
+    __tablename__ = "course_build_step"
+    __table_args__ = (
+        UniqueConstraint("course_build_id", "step"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    course_build_id: Mapped[int] = mapped_column(
+        ForeignKey("course_build.id", ondelete="CASCADE")
+    )
+    step: Mapped[str]
+    result: Mapped[dict] = mapped_column(JSONB)
+
+
+class CourseBuildOutbox(Base):
+    __tablename__ = "course_build_outbox"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    course_build_id: Mapped[int] = mapped_column(
+        ForeignKey("course_build.id", ondelete="CASCADE")
+    )
+
+
+class CoursesCsvRow(Base):
+    __tablename__ = "courses_csv_row"
+    __table_args__ = (
+        UniqueConstraint("course_id"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    course_id: Mapped[int]
+
+
+class PooledCourseStatus(str, enum.Enum):
+    # Reserved before the course is duplicated so a course Moodle creates is
+    # always tracked even if the processor fails before it is recorded
+    PENDING = "pending"
+    AVAILABLE = "available"
+    CLAIMED = "claimed"
+    INVALIDATED = "invalidated"
+
+
+class PooledCourse(Base):
+    __tablename__ = "pooled_course"
+    __table_args__ = (
+        UniqueConstraint("course_id"),
+        Index(
+            "ix_pooled_course_available",
+            "base_course_id",
+            "academic_year",
+            "course_category_id",
+            postgresql_where=text("status = 'AVAILABLE'"),
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    course_id: Mapped[Optional[int]]
+    course_shortname: Mapped[Optional[str]]
+    base_course_id: Mapped[int]
+    academic_year: Mapped[str]
+    course_category_id: Mapped[int]
+    status: Mapped[PooledCourseStatus]
+    course_build_id: Mapped[Optional[int]] = mapped_column(
+        ForeignKey("course_build.id", ondelete="SET NULL")
+    )
+
+
+class MoodleRateLimitBucket(Base):
+    __tablename__ = "moodle_rate_limit_bucket"
+    __table_args__ = (
+        UniqueConstraint("name"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    name: Mapped[str]
+    tokens: Mapped[float]
+    refilled_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
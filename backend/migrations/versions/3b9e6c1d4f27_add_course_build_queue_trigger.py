@@ -0,0 +1,54 @@
+"""Add course_build queue trigger
+
+Revision ID: 3b9e6c1d4f27
+Revises: 8136a365e462
+Create Date: 2026-10-18 09:12:41.503318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9e6c1d4f27'
+down_revision = '8136a365e462'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_course_build_pending',
+        'course_build',
+        ['id'],
+        unique=False,
+        postgresql_where=sa.text("status = 'CREATED'"),
+    )
+    op.execute(
+        """
+        CREATE FUNCTION notify_course_build_created() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('course_build_created', NEW.id::text);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER course_build_created
+        AFTER INSERT OR UPDATE OF status ON course_build
+        FOR EACH ROW WHEN (NEW.status = 'CREATED')
+        EXECUTE FUNCTION notify_course_build_created()
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER IF EXISTS course_build_created ON course_build')
+    op.execute('DROP FUNCTION IF EXISTS notify_course_build_created()')
+    op.drop_index(
+        'ix_course_build_pending',
+        table_name='course_build',
+        postgresql_where=sa.text("status = 'CREATED'"),
+    )
@@ -0,0 +1,44 @@
+"""Add course_build_outbox inserted trigger
+
+Revision ID: 7c1f5a3d9b42
+Revises: 9e4b2d6a8f15
+Create Date: 2026-10-19 14:05:31.218406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1f5a3d9b42'
+down_revision = '9e4b2d6a8f15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE FUNCTION notify_course_build_outbox_inserted() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('course_build_outbox_inserted', '');
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER course_build_outbox_inserted
+        AFTER INSERT ON course_build_outbox
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION notify_course_build_outbox_inserted()
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        'DROP TRIGGER IF EXISTS course_build_outbox_inserted ON course_build_outbox'
+    )
+    op.execute('DROP FUNCTION IF EXISTS notify_course_build_outbox_inserted()')
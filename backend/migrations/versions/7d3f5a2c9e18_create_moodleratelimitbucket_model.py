@@ -0,0 +1,33 @@
+"""Create MoodleRateLimitBucket model
+
+Revision ID: 7d3f5a2c9e18
+Revises: e84d2b7a0c19
+Create Date: 2026-10-18 18:02:37.104562
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3f5a2c9e18'
+down_revision = 'e84d2b7a0c19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('moodle_rate_limit_bucket',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('tokens', sa.Float(), nullable=False),
+    sa.Column('refilled_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('moodle_rate_limit_bucket')
@@ -0,0 +1,35 @@
+"""Create CourseBuildStep model
+
+Revision ID: c5a1f0e93b6d
+Revises: 3b9e6c1d4f27
+Create Date: 2026-10-18 14:03:27.118406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5a1f0e93b6d'
+down_revision = '3b9e6c1d4f27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('course_build_step',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('course_build_id', sa.Integer(), nullable=False),
+    sa.Column('step', sa.String(), nullable=False),
+    sa.Column('result', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['course_build_id'], ['course_build.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('course_build_id', 'step')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('course_build_step')
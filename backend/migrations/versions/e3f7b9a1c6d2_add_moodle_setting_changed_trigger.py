@@ -0,0 +1,42 @@
+"""Add moodle_setting changed trigger
+
+Revision ID: e3f7b9a1c6d2
+Revises: 4c8a2e6f1d93
+Create Date: 2026-10-18 21:37:08.641925
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3f7b9a1c6d2'
+down_revision = '4c8a2e6f1d93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE FUNCTION notify_moodle_setting_changed() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('moodle_setting_changed', '');
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER moodle_setting_changed
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON moodle_setting
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION notify_moodle_setting_changed()
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER IF EXISTS moodle_setting_changed ON moodle_setting')
+    op.execute('DROP FUNCTION IF EXISTS notify_moodle_setting_changed()')
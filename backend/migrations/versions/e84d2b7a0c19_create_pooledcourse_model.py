@@ -0,0 +1,50 @@
+"""Create PooledCourse model
+
+Revision ID: e84d2b7a0c19
+Revises: c5a1f0e93b6d
+Create Date: 2026-10-18 16:41:09.725113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e84d2b7a0c19'
+down_revision = 'c5a1f0e93b6d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('pooled_course',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('course_id', sa.Integer(), nullable=False),
+    sa.Column('base_course_id', sa.Integer(), nullable=False),
+    sa.Column('academic_year', sa.String(), nullable=False),
+    sa.Column('course_category_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.Enum('AVAILABLE', 'CLAIMED', 'INVALIDATED', name='pooledcoursestatus'), nullable=False),
+    sa.Column('course_build_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['course_build_id'], ['course_build.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('course_id')
+    )
+    op.create_index(
+        'ix_pooled_course_available',
+        'pooled_course',
+        ['base_course_id', 'academic_year', 'course_category_id'],
+        unique=False,
+        postgresql_where=sa.text("status = 'AVAILABLE'"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        'ix_pooled_course_available',
+        table_name='pooled_course',
+        postgresql_where=sa.text("status = 'AVAILABLE'"),
+    )
+    op.drop_table('pooled_course')
+    op.execute('DROP TYPE IF EXISTS pooledcoursestatus')
@@ -0,0 +1,44 @@
+import argparse
+
+import boto3
+
+from rope.api import database, settings
+from rope.api.processors.courses_csv import export_courses_csv
+
+
+session_factory = database.SessionLocal
+
+
+# This function allows the code to be testable and
+# talk to the mocked sessionmaker in test_export_courses_csv.py
+def get_db():
+    return session_factory  # pragma: no cover
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Regenerate the courses CSV in S3 from the database"
+    )
+    # Only appending new courses is the default since a full export rewrites
+    # every row and drops edits made to the CSV downstream
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Rewrite every course instead of only appending new ones",
+    )
+    args = parser.parse_args()
+
+    s3_client = boto3.client("s3")
+    get_sessionmaker = get_db()
+    with get_sessionmaker() as session:
+        export_courses_csv(
+            session,
+            s3_client,
+            settings.COURSES_CSV_S3_BUCKET,
+            settings.COURSES_CSV_S3_KEY,
+            incremental=not args.full,
+        )
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
@@ -98,6 +98,10 @@ def override_get_db():
         db.close()
 
 
+def override_get_sessionmaker():
+    return TestingSessionLocal
+
+
 def override_get_request_session():
     session_id = {"session_id": "12345"}
     return session_id
@@ -119,3 +123,4 @@ def override_empty_get_request_session():
 
 
 app.dependency_overrides[database.get_db] = override_get_db
+app.dependency_overrides[database.get_sessionmaker] = override_get_sessionmaker
@@ -0,0 +1,71 @@
+import asyncio
+import httpx
+import pytest
+from urllib.parse import parse_qs
+from rope.api.async_moodle import AsyncMoodleClient, AsyncMoodleClientException
+
+
+def get_moodle_client(handler):
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return AsyncMoodleClient(http_client, "https://moodle", "token")
+
+
+def test_get_user_by_email():
+    requests = []
+
+    def handler(request):
+        requests.append(parse_qs(request.content.decode("utf-8")))
+        return httpx.Response(200, json=[{"id": 42, "email": "tlee@rice.edu"}])
+
+    moodle = get_moodle_client(handler)
+    user = asyncio.run(moodle.get_user_by_email("tlee@rice.edu"))
+
+    assert user == {"id": 42, "email": "tlee@rice.edu"}
+    assert requests == [
+        {
+            "wstoken": ["token"],
+            "moodlewsrestformat": ["json"],
+            "wsfunction": ["core_user_get_users_by_field"],
+            "field": ["email"],
+            "values[0]": ["tlee@rice.edu"],
+        }
+    ]
+
+
+def test_get_user_by_email_not_found():
+    moodle = get_moodle_client(lambda request: httpx.Response(200, json=[]))
+
+    assert asyncio.run(moodle.get_user_by_email("tlee@rice.edu")) is None
+
+
+def test_moodle_exception():
+    moodle = get_moodle_client(
+        lambda request: httpx.Response(
+            200, json={"exception": "moodle_exception", "message": "Invalid token"}
+        )
+    )
+
+    with pytest.raises(AsyncMoodleClientException):
+        asyncio.run(moodle.get_role_by_shortname("teacher"))
+
+
+def test_update_course():
+    requests = []
+
+    def handler(request):
+        requests.append(parse_qs(request.content.decode("utf-8")))
+        return httpx.Response(200, json={"warnings": []})
+
+    moodle = get_moodle_client(handler)
+    asyncio.run(moodle.update_course(102, shortname="Alg1 TL AY24", visible=1))
+
+    assert requests == [
+        {
+            "wstoken": ["token"],
+            "moodlewsrestformat": ["json"],
+            "wsfunction": ["core_course_update_courses"],
+            "courses[0][id]": ["102"],
+            "courses[0][shortname]": ["Alg1 TL AY24"],
+            "courses[0][visible]": ["1"],
+        }
+    ]
@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import httpx
+import requests
+from prometheus_client import REGISTRY
+from rope.api.processors.concurrency_limiter import (
+    AIMDLimiter,
+    AsyncAIMDLimiter,
+    AsyncConcurrencyLimitedTransport,
+    ConcurrencyLimitedAdapter,
+)
+
+
+def get_limit_sample():
+    return REGISTRY.get_sample_value("rope_moodle_concurrency_limit")
+
+
+def test_aimd_limiter_increases_under_target(mocker):
+    monotonic = mocker.patch(
+        "rope.api.processors.concurrency_limiter.time.monotonic", return_value=100
+    )
+    limiter = AIMDLimiter(
+        initial_limit=2, min_limit=1, max_limit=3, target_latency_secs=1
+    )
+
+    # Each call under target adds 1 / limit so a full window adds one
+    for _ in range(2):
+        start_time = limiter.acquire()
+        monotonic.return_value += 0.5
+        limiter.release("core_user_get_users_by_field", start_time, False)
+    assert limiter.limit == 2 + 1 / 2 + 1 / 2.5
+    assert get_limit_sample() == limiter.limit
+
+    for _ in range(10):
+        limiter.release("core_user_get_users_by_field", limiter.acquire(), False)
+    assert limiter.limit == 3
+
+
+def test_aimd_limiter_backs_off_once_per_overload(mocker):
+    monotonic = mocker.patch(
+        "rope.api.processors.concurrency_limiter.time.monotonic", return_value=100
+    )
+    limiter = AIMDLimiter(
+        initial_limit=8, min_limit=1, max_limit=16, target_latency_secs=1
+    )
+
+    slow_start_time = limiter.acquire()
+    failed_start_time = limiter.acquire()
+    monotonic.return_value = 105
+    limiter.release("core_user_get_users_by_field", slow_start_time, False)
+    assert limiter.limit == 4
+
+    # Started before the backoff so doesn't cut the limit again
+    limiter.release("core_user_get_users_by_field", failed_start_time, True)
+    assert limiter.limit == 4
+
+    monotonic.return_value = 106
+    limiter.release("enrol_manual_enrol_users", limiter.acquire(), True)
+    assert limiter.limit == 2
+    assert get_limit_sample() == 2
+
+
+def test_aimd_limiter_function_target_latency(mocker):
+    monotonic = mocker.patch(
+        "rope.api.processors.concurrency_limiter.time.monotonic", return_value=100
+    )
+    limiter = AIMDLimiter(
+        initial_limit=4, min_limit=1, max_limit=16, target_latency_secs=1
+    )
+
+    start_time = limiter.acquire()
+    monotonic.return_value = 130
+    limiter.release("core_course_duplicate_course", start_time, False)
+
+    assert limiter.limit == 4.25
+
+
+def test_aimd_limiter_blocks_at_limit():
+    limiter = AIMDLimiter(
+        initial_limit=1, min_limit=1, max_limit=1, target_latency_secs=60
+    )
+    start_time = limiter.acquire()
+    acquired = threading.Event()
+
+    def acquire():
+        limiter.release("core_user_get_users_by_field", limiter.acquire(), False)
+        acquired.set()
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    assert not acquired.wait(0.1)
+
+    limiter.release("core_user_get_users_by_field", start_time, False)
+    assert acquired.wait(1)
+    thread.join()
+    assert limiter.in_flight == 0
+
+
+def test_concurrency_limited_adapter(mocker):
+    limiter = AIMDLimiter(
+        initial_limit=2, min_limit=1, max_limit=4, target_latency_secs=60
+    )
+    release = mocker.spy(limiter, "release")
+    response = requests.Response()
+    response.status_code = 503
+    mocker.patch("requests.adapters.HTTPAdapter.send", return_value=response)
+
+    session = requests.Session()
+    session.mount("https://moodle", ConcurrencyLimitedAdapter(limiter))
+    session.post(
+        "https://moodle/webservice/rest/server.php",
+        data={"wsfunction": "enrol_manual_enrol_users"},
+    )
+
+    assert release.call_args.args[0] == "enrol_manual_enrol_users"
+    assert release.call_args.args[2] is True
+    assert limiter.limit == 1
+    assert limiter.in_flight == 0
+
+
+def test_async_concurrency_limited_transport():
+    requests = []
+
+    def handler(request):
+        requests.append(request.content)
+        return httpx.Response(200, json=[])
+
+    async def post():
+        limiter = AsyncAIMDLimiter(
+            initial_limit=2, min_limit=1, max_limit=4, target_latency_secs=60
+        )
+        transport = AsyncConcurrencyLimitedTransport(
+            limiter, httpx.MockTransport(handler)
+        )
+        async with httpx.AsyncClient(transport=transport) as http_client:
+            await asyncio.gather(
+                *[
+                    http_client.post(
+                        "https://moodle/webservice/rest/server.php",
+                        data={"wsfunction": "core_user_get_users_by_field"},
+                    )
+                    for _ in range(3)
+                ]
+            )
+        return limiter
+
+    limiter = asyncio.run(post())
+
+    assert len(requests) == 3
+    assert limiter.in_flight == 0
+    assert limiter.limit == 2 + 1 / 2 + 1 / 2.5 + 1 / (2 + 1 / 2 + 1 / 2.5)
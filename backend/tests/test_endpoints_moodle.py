@@ -1,10 +1,16 @@
 import pytest
-from sqlalchemy import text
-from rope.db.schema import CourseBuild, MoodleSetting, SchoolDistrict, UserAccount
-from rope.api.main import app
-from rope.api.utils import get_sqs_client
-import boto3
-import botocore.stub
+from sqlalchemy import event, text
+from rope.db.schema import (
+    CourseBuild,
+    CourseBuildOutbox,
+    MoodleSetting,
+    SchoolDistrict,
+    UserAccount,
+)
+from rope.api.routers import moodle
+from rope.api.moodle_circuit_breaker import MoodleCircuitOpenError
+import csv
+import io
 import json
 
 
@@ -54,6 +60,14 @@ def setup_moodle_settings(db):
     return moodle_settings
 
 
+@pytest.fixture
+def mock_get_course_by_shortname(mocker):
+    return mocker.patch(
+        "rope.api.routers.moodle.moodle_client.get_course_by_shortname",
+        return_value={"courses": []},
+    )
+
+
 @pytest.fixture
 def setup_get_course_builds(
     db,
@@ -145,16 +159,13 @@ def test_create_course_build(
     setup_moodle_settings,
     setup_new_user_manager,
     setup_manager_session,
+    mock_get_course_by_shortname,
     mocker,
 ):
     mocker.patch(
-        "rope.api.routers.moodle.moodle_client.get_course_by_shortname",
-        return_value={
-            "courses": [],
-            "warnings": [],
-        },
+        "rope.api.routers.moodle.search_moodle_course_shortnames",
+        return_value=set(),
     )
-    app.dependency_overrides[get_sqs_client] = lambda : mocker.MagicMock()
     school_district_name = setup_school_district.name
     course_build_settings = {
         "instructor_firstname": "Franklin",
@@ -185,21 +196,19 @@ def test_create_course_build(
     assert data["creator_email"] == "manager@rice.edu"
 
 
-def test_create_course_build_sqs_message(
+def test_create_course_build_outbox(
     test_client,
     db,
     setup_school_district,
     setup_moodle_settings,
     setup_new_user_manager,
     setup_manager_session,
+    mock_get_course_by_shortname,
     mocker,
 ):
     mocker.patch(
-        "rope.api.routers.moodle.moodle_client.get_course_by_shortname",
-        return_value={
-            "courses": [],
-            "warnings": [],
-        },
+        "rope.api.routers.moodle.search_moodle_course_shortnames",
+        return_value=set(),
     )
     mock_settings = mocker.Mock()
     setattr(mock_settings, 'SQS_QUEUE', 'testqueue')
@@ -207,21 +216,6 @@ def test_create_course_build_sqs_message(
         "rope.api.routers.moodle.settings",
         mock_settings
     )
-    sqs_client = boto3.client("sqs", region_name="nor-cal")
-    stubber = botocore.stub.Stubber(sqs_client)
-
-    expected_params = {
-        'QueueUrl': 'https://testqueue',
-        'MessageBody': json.dumps({"course_build_id": 1})
-    }
-
-    stubber.add_response('get_queue_url', {'QueueUrl': 'https://testqueue'},
-                                          {'QueueName': 'testqueue'})
-
-    stubber.add_response('send_message', {}, expected_params)
-
-    app.dependency_overrides[get_sqs_client] = lambda : sqs_client
-    stubber.activate()
 
     school_district_name = setup_school_district.name
 
@@ -234,10 +228,12 @@ def test_create_course_build_sqs_message(
 
     response = test_client.post("/moodle/course/build", json=course_build_settings)
     course_build = db.query(CourseBuild).all()
+    outbox = db.query(CourseBuildOutbox).all()
     data = response.json()
 
-    stubber.assert_no_pending_responses()
     assert len(course_build) == 1
+    # The build is published to SQS by the outbox relay rather than the request
+    assert [row.course_build_id for row in outbox] == [data["id"]]
 
     assert response.status_code == 200
     assert data["instructor_firstname"] == "Franklin"
@@ -251,17 +247,13 @@ def test_create_course_build_duplicate_shortname(
     setup_moodle_settings,
     setup_new_user_manager,
     setup_manager_session,
+    mock_get_course_by_shortname,
     mocker,
 ):
     mocker.patch(
-        "rope.api.routers.moodle.moodle_client.get_course_by_shortname",
-        return_value={
-            "courses": [],
-            "warnings": [],
-        },
+        "rope.api.routers.moodle.search_moodle_course_shortnames",
+        return_value=set(),
     )
-    app.dependency_overrides[get_sqs_client] = lambda : mocker.MagicMock()
-
     school_district_name = setup_school_district.name
     course_build_settings1 = {
         "instructor_firstname": "Franklin",
@@ -327,6 +319,7 @@ def test_create_course_build_duplicate_shortname_moodle(
     setup_moodle_settings,
     setup_new_user_manager,
     setup_manager_session,
+    mock_get_course_by_shortname,
     mocker,
 ):
     school_district_name = setup_school_district.name
@@ -336,15 +329,10 @@ def test_create_course_build_duplicate_shortname_moodle(
         "instructor_email": "rthompson@rice.edu",
         "school_district_name": school_district_name,
     }
-    mocker.patch(
-        "rope.api.routers.moodle.moodle_client.get_course_by_shortname",
-        side_effect=[
-            {"courses": [{}]},
-            {"courses": []},
-        ],
+    search_moodle_course_shortnames = mocker.patch(
+        "rope.api.routers.moodle.search_moodle_course_shortnames",
+        return_value={"Alg1 RT AY24", "Alg1 RT2 AY24"},
     )
-    app.dependency_overrides[get_sqs_client] = lambda : mocker.MagicMock()
-
     response = test_client.post("/moodle/course/build", json=course_build_settings)
     course_build = db.query(CourseBuild).all()
     data = response.json()
@@ -358,6 +346,8 @@ def test_create_course_build_duplicate_shortname_moodle(
     assert data["instructor_email"] == "rthompson@rice.edu"
     assert data["course_name"] == "Algebra 1 - Reed Thompson (AY 2024)"
     assert data["course_shortname"] == "Alg1 RT1 AY24"
+    search_moodle_course_shortnames.assert_called_once_with("Alg1 RT")
+    mock_get_course_by_shortname.assert_called_once_with("Alg1 RT1 AY24")
     assert data["course_id"] is None
     assert data["course_enrollment_url"] is None
     assert data["course_enrollment_key"] is None
@@ -368,6 +358,120 @@ def test_create_course_build_duplicate_shortname_moodle(
     assert data["creator_email"] == "manager@rice.edu"
 
 
+def test_create_course_build_shortname_missed_by_search(
+    test_client,
+    db,
+    setup_school_district,
+    setup_moodle_settings,
+    setup_new_user_manager,
+    setup_manager_session,
+    mock_get_course_by_shortname,
+    mocker,
+):
+    mocker.patch(
+        "rope.api.routers.moodle.search_moodle_course_shortnames",
+        return_value=set(),
+    )
+    mock_get_course_by_shortname.side_effect = lambda course_shortname: {
+        "courses": [{"id": 37}] if course_shortname == "Alg1 RT AY24" else []
+    }
+
+    response = test_client.post(
+        "/moodle/course/build",
+        json={
+            "instructor_firstname": "Reed",
+            "instructor_lastname": "Thompson",
+            "instructor_email": "rthompson@rice.edu",
+            "school_district_name": setup_school_district.name,
+        },
+    )
+
+    assert response.status_code == 200
+    assert response.json()["course_shortname"] == "Alg1 RT1 AY24"
+    assert [
+        call.args[0] for call in mock_get_course_by_shortname.call_args_list
+    ] == ["Alg1 RT AY24", "Alg1 RT1 AY24"]
+    assert db.query(CourseBuild).count() == 1
+
+
+def test_create_course_build_shortname_conflict(
+    test_client,
+    db,
+    setup_school_district,
+    setup_moodle_settings,
+    setup_new_user_manager,
+    setup_manager_session,
+    mock_get_course_by_shortname,
+    mocker,
+):
+    mocker.patch(
+        "rope.api.routers.moodle.search_moodle_course_shortnames",
+        return_value=set(),
+    )
+    # Another submission inserts the shortname after the taken ones were read
+    mocker.patch(
+        "rope.api.database.get_course_shortnames_by_prefix",
+        return_value=set(),
+    )
+    db.add(
+        CourseBuild(
+            instructor_firstname="Freya",
+            instructor_lastname="Santiago",
+            instructor_email="fsantiago@rice.edu",
+            course_name="Algebra 1 - Freya Santiago (AY 2024)",
+            course_shortname="Alg1 FS AY24",
+            course_category_id=21,
+            school_district_id=setup_school_district.id,
+            academic_year="AY 2024",
+            academic_year_short="AY24",
+            base_course_id=100,
+            status="created",
+            creator_id=setup_new_user_manager.id,
+        )
+    )
+    db.commit()
+
+    response = test_client.post(
+        "/moodle/course/build",
+        json={
+            "instructor_firstname": "Franklin",
+            "instructor_lastname": "Saint",
+            "instructor_email": "fsaint@rice.edu",
+            "school_district_name": setup_school_district.name,
+        },
+    )
+
+    assert response.status_code == 200
+    assert response.json()["course_shortname"] == "Alg1 FS1 AY24"
+    assert db.query(CourseBuild).count() == 2
+
+
+def test_search_moodle_course_shortnames(mocker):
+    post = mocker.patch("rope.api.routers.moodle.moodle_session.post")
+    post.return_value.json.return_value = {
+        "total": 2,
+        "courses": [
+            {"id": 5, "shortname": "Alg1 FS AY24"},
+            {"id": 6, "shortname": "Alg1 FS1 AY24"},
+        ],
+        "warnings": [],
+    }
+
+    assert moodle.search_moodle_course_shortnames("Alg1 FS") == {
+        "Alg1 FS AY24",
+        "Alg1 FS1 AY24",
+    }
+    assert post.call_args.kwargs["data"]["wsfunction"] == "core_course_search_courses"
+    assert post.call_args.kwargs["data"]["criteriavalue"] == "Alg1 FS"
+
+    post.return_value.json.return_value = {
+        "exception": "moodle_exception",
+        "message": "Access denied",
+    }
+    with pytest.raises(Exception):
+        moodle.search_moodle_course_shortnames("Alg1 FS")
+
+
 def test_get_course_build_by_academic_year_and_instructor_email(
     test_client,
     setup_nonadmin_authenticated_user_session,
@@ -610,6 +714,177 @@ def test_get_all_course_builds(
     assert any(expected_data_4.items() == item.items() for item in data)
 
 
+def test_get_course_builds_paginated(
+    test_client,
+    db,
+    setup_nonadmin_authenticated_user_session,
+    setup_get_course_builds,
+):
+    queries = []
+
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    # The endpoint's session comes from the overridden get_db
+    engine = db.get_bind()
+    event.listen(engine, "before_cursor_execute", count_query)
+    try:
+        response = test_client.get("/moodle/course/build?limit=2")
+    finally:
+        event.remove(engine, "before_cursor_execute", count_query)
+
+    assert response.status_code == 200
+    assert [item["id"] for item in response.json()] == [1, 2]
+    assert response.headers["X-Next-After-Id"] == "2"
+    # The district and creator are read in the same query as the builds
+    assert len(queries) == 1
+
+    response = test_client.get("/moodle/course/build?limit=2&after_id=2")
+    assert [item["id"] for item in response.json()] == [3, 4]
+    assert response.headers["X-Next-After-Id"] == "4"
+
+    response = test_client.get("/moodle/course/build?limit=2&after_id=4")
+    assert response.json() == []
+    assert "X-Next-After-Id" not in response.headers
+
+    # Pages are bounded even when no limit is asked for
+    response = test_client.get("/moodle/course/build")
+    assert [item["id"] for item in response.json()] == [1, 2, 3, 4]
+    assert "X-Next-After-Id" not in response.headers
+
+    response = test_client.get("/moodle/course/build?limit=0")
+    assert response.status_code == 422
+
+
+def test_get_course_builds_filtered(
+    test_client,
+    db,
+    setup_nonadmin_authenticated_user_session,
+    setup_school_district,
+    setup_get_course_builds,
+):
+    db.get(CourseBuild, 4).status = "completed"
+    db.commit()
+
+    response = test_client.get("/moodle/course/build?status=completed")
+    assert [item["id"] for item in response.json()] == [4]
+
+    response = test_client.get(
+        "/moodle/course/build?academic_year=AY 2025&status=created"
+    )
+    assert [item["id"] for item in response.json()] == [1, 2]
+
+    response = test_client.get(
+        f"/moodle/course/build?school_district_name={setup_school_district.name}"
+    )
+    assert len(response.json()) == 4
+    response = test_client.get("/moodle/course/build?school_district_name=other_isd")
+    assert response.json() == []
+
+    response = test_client.get(
+        "/moodle/course/build?created_after=2000-01-01T00:00:00"
+        "&created_before=2100-01-01T00:00:00"
+    )
+    assert len(response.json()) == 4
+    response = test_client.get(
+        "/moodle/course/build?created_after=2100-01-01T00:00:00"
+    )
+    assert response.json() == []
+
+
+def test_export_course_builds_csv(
+    test_client,
+    setup_school_district,
+    setup_get_course_builds,
+    setup_admin_session,
+):
+    response = test_client.get(
+        "/moodle/course/build/export?format=csv&academic_year=AY 2025"
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["id"] for row in rows] == ["1", "2", "4"]
+    assert rows[2] == {
+        "id": "4",
+        "instructor_firstname": "Reed",
+        "instructor_lastname": "Thompson",
+        "instructor_email": "lthompson@rice.edu",
+        "school_district_name": setup_school_district.name,
+        "academic_year": "AY 2025",
+        "academic_year_short": "AY25",
+        "course_name": "Algebra 1 - Reed Thompson (AY 2025)",
+        "course_shortname": "Alg1 RT AY25",
+        "creator_email": "manager@rice.edu",
+        "status": "created",
+        "course_id": "47",
+        "course_enrollment_url": "url.com",
+        "course_enrollment_key": "12345",
+    }
+
+
+def test_export_course_builds_csv_escaping(
+    test_client,
+    db,
+    setup_school_district,
+    setup_get_course_builds,
+    setup_admin_session,
+):
+    course_build = db.get(CourseBuild, 3)
+    course_build.course_name = "Algebra 1 - Franklin\\Saint (100%)"
+    course_build.academic_year = "AY\\2030 'O%'"
+    course_build.status = "completed"
+    db.commit()
+
+    # Filter values are quoted once however many backslashes, quotes or
+    # percent signs they have
+    response = test_client.get(
+        "/moodle/course/build/export",
+        params={
+            "format": "csv",
+            "academic_year": "AY\\2030 'O%'",
+            "status": "completed",
+        },
+    )
+
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["id"] for row in rows] == ["3"]
+    assert rows[0]["course_name"] == "Algebra 1 - Franklin\\Saint (100%)"
+    assert rows[0]["academic_year"] == "AY\\2030 'O%'"
+    assert rows[0]["status"] == "completed"
+
+
+def test_export_course_builds_ndjson(
+    test_client,
+    setup_get_course_builds,
+    setup_admin_session,
+):
+    response = test_client.get(
+        "/moodle/course/build/export?instructor_email=fsaint@rice.edu"
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == [1, 3]
+    assert rows[1]["course_name"] == "Algebra 1 - Franklin Saint (AY 2030)"
+    assert rows[1]["status"] == "created"
+
+    response = test_client.get("/moodle/course/build/export?status=completed")
+    assert response.text == ""
+
+
+def test_export_course_builds_requires_admin(
+    test_client,
+    setup_nonadmin_authenticated_user_session,
+):
+    response = test_client.get("/moodle/course/build/export")
+
+    assert response.status_code == 403
+
+
 def test_get_moodle_user(
     test_client,
     setup_nonadmin_authenticated_user_session,
@@ -646,3 +921,18 @@ def test_get_moodle_user(
     data = response.json()
 
     assert not data
+
+
+def test_get_moodle_user_circuit_open(
+    test_client,
+    setup_nonadmin_authenticated_user_session,
+    mocker,
+):
+    mocker.patch(
+        "rope.api.routers.moodle.moodle_client.get_user_by_email",
+        side_effect=MoodleCircuitOpenError("Moodle circuit breaker is open"),
+    )
+
+    response = test_client.get("/moodle/user?email=first.last@email.com")
+
+    assert response.status_code == 503
@@ -0,0 +1,32 @@
+from rope.scripts import export_courses_csv
+
+
+def test_export_courses_csv(mocker):
+    mock_settings = mocker.Mock()
+    setattr(mock_settings, "COURSES_CSV_S3_BUCKET", "test-bucket")
+    setattr(mock_settings, "COURSES_CSV_S3_KEY", "test-key")
+    mocker.patch("rope.scripts.export_courses_csv.settings", mock_settings)
+    s3_client = mocker.Mock()
+    mocker.patch("boto3.client", lambda client: s3_client)
+    session = mocker.MagicMock()
+    mocker.patch(
+        "rope.scripts.export_courses_csv.get_db", lambda: lambda: session
+    )
+    export = mocker.patch("rope.scripts.export_courses_csv.export_courses_csv")
+
+    mocker.patch("sys.argv", [""])
+    export_courses_csv.main()
+
+    export.assert_called_once_with(
+        session.__enter__.return_value,
+        s3_client,
+        "test-bucket",
+        "test-key",
+        incremental=True,
+    )
+
+    # Rewriting the whole CSV has to be asked for
+    mocker.patch("sys.argv", ["", "--full"])
+    export_courses_csv.main()
+
+    assert export.call_args.kwargs == {"incremental": False}
@@ -0,0 +1,71 @@
+import pytest
+from prometheus_client import REGISTRY
+from rope.api.processors.metadata_cache import MetadataCache
+
+
+def get_cache_samples():
+    return tuple(
+        REGISTRY.get_sample_value(
+            f"rope_metadata_cache_{name}_total", {"cache": "test"}
+        )
+        or 0
+        for name in ("hits", "misses")
+    )
+
+
+def test_metadata_cache_ttl(mocker):
+    monotonic = mocker.patch(
+        "rope.api.processors.metadata_cache.time.monotonic", return_value=100
+    )
+    loader = mocker.Mock(side_effect=lambda key: f"{key}-id")
+    cache = MetadataCache("test", loader, ttl_secs=60, refresh_interval_secs=30)
+    initial_hits, initial_misses = get_cache_samples()
+
+    assert cache.get("teacher") == "teacher-id"
+    assert cache.get("teacher") == "teacher-id"
+    assert loader.call_count == 1
+
+    monotonic.return_value = 160
+    assert cache.get("teacher") == "teacher-id"
+    assert loader.call_count == 2
+
+    hits, misses = get_cache_samples()
+    assert hits - initial_hits == 1
+    assert misses - initial_misses == 2
+
+
+def test_metadata_cache_does_not_cache_failures(mocker):
+    loader = mocker.Mock(side_effect=[Exception("Moodle is down"), "teacher-id"])
+    cache = MetadataCache("test", loader, ttl_secs=60, refresh_interval_secs=30)
+
+    with pytest.raises(Exception):
+        cache.get("teacher")
+    assert cache.get("teacher") == "teacher-id"
+
+
+def test_metadata_cache_load_keeps_previous_value(mocker):
+    loader = mocker.Mock(side_effect=["teacher-id", Exception("Moodle is down")])
+    cache = MetadataCache("test", loader, ttl_secs=60, refresh_interval_secs=30)
+
+    cache.load(["teacher"])
+    cache.load(["teacher"])
+
+    assert cache.get_cached("teacher") == "teacher-id"
+
+
+def test_metadata_cache_prewarm_and_refresh(mocker):
+    loader = mocker.Mock(side_effect=["teacher-id", "new-teacher-id"])
+    cache = MetadataCache(
+        "test",
+        loader,
+        ttl_secs=60,
+        refresh_interval_secs=0.01,
+        prewarm_keys=["teacher"],
+    )
+    mocker.patch.object(cache.stopped, "wait", side_effect=[False, True])
+
+    cache.start()
+    cache.stop()
+
+    assert loader.call_count == 2
+    assert cache.get_cached("teacher") == "new-teacher-id"
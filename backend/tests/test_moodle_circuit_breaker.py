@@ -0,0 +1,134 @@
+import asyncio
+import httpx
+import pytest
+import requests
+from rope.api.moodle_circuit_breaker import (
+    AsyncCircuitBreakerTransport,
+    CircuitBreaker,
+    CircuitBreakerAdapter,
+    MoodleCircuitOpenError,
+)
+
+
+@pytest.fixture
+def monotonic(mocker):
+    return mocker.patch(
+        "rope.api.moodle_circuit_breaker.time.monotonic", return_value=100
+    )
+
+
+def call(circuit_breaker, failed=False, wsfunction="core_user_get_users_by_field"):
+    circuit_breaker.record(wsfunction, circuit_breaker.before_call(), failed)
+
+
+def test_circuit_breaker_opens_after_failures(monotonic):
+    circuit_breaker = CircuitBreaker(
+        failure_threshold=3, slow_call_secs=10, reset_timeout_secs=30
+    )
+
+    call(circuit_breaker, failed=True)
+    call(circuit_breaker, failed=True)
+    call(circuit_breaker)
+    call(circuit_breaker, failed=True)
+    call(circuit_breaker, failed=True)
+    assert not circuit_breaker.is_open()
+
+    call(circuit_breaker, failed=True)
+    assert circuit_breaker.is_open()
+    assert circuit_breaker.get_open_secs() == 30
+    with pytest.raises(MoodleCircuitOpenError):
+        circuit_breaker.before_call()
+
+    monotonic.return_value = 120
+    assert circuit_breaker.get_open_secs() == 10
+
+
+def test_circuit_breaker_counts_slow_calls(monotonic):
+    circuit_breaker = CircuitBreaker(
+        failure_threshold=1, slow_call_secs=10, reset_timeout_secs=30
+    )
+
+    start_time = circuit_breaker.before_call()
+    monotonic.return_value = 160
+    circuit_breaker.record("core_course_duplicate_course", start_time, False)
+    assert not circuit_breaker.is_open()
+
+    start_time = circuit_breaker.before_call()
+    monotonic.return_value = 171
+    circuit_breaker.record("enrol_manual_enrol_users", start_time, False)
+    assert circuit_breaker.is_open()
+
+
+def test_circuit_breaker_half_open_probe(monotonic):
+    circuit_breaker = CircuitBreaker(
+        failure_threshold=1, slow_call_secs=10, reset_timeout_secs=30
+    )
+    call(circuit_breaker, failed=True)
+
+    # Only one probe is let through once the reset timeout has passed
+    monotonic.return_value = 130
+    assert not circuit_breaker.is_open()
+    probe_start_time = circuit_breaker.before_call()
+    with pytest.raises(MoodleCircuitOpenError):
+        circuit_breaker.before_call()
+
+    circuit_breaker.record("core_user_get_users_by_field", probe_start_time, True)
+    assert circuit_breaker.is_open()
+
+    monotonic.return_value = 160
+    call(circuit_breaker)
+    call(circuit_breaker)
+    assert circuit_breaker.state == "closed"
+
+
+def test_circuit_breaker_adapter(mocker, monotonic):
+    circuit_breaker = CircuitBreaker(
+        failure_threshold=2, slow_call_secs=10, reset_timeout_secs=30
+    )
+    response = requests.Response()
+    response.status_code = 502
+    send = mocker.patch(
+        "requests.adapters.HTTPAdapter.send",
+        side_effect=[response, requests.ConnectionError("Connection refused")],
+    )
+    session = requests.Session()
+    session.mount("https://moodle", CircuitBreakerAdapter(circuit_breaker))
+
+    def post():
+        return session.post(
+            "https://moodle/webservice/rest/server.php",
+            data={"wsfunction": "core_user_get_users_by_field"},
+        )
+
+    assert post().status_code == 502
+    with pytest.raises(requests.ConnectionError):
+        post()
+    with pytest.raises(MoodleCircuitOpenError):
+        post()
+    assert send.call_count == 2
+
+
+def test_async_circuit_breaker_transport(monotonic):
+    circuit_breaker = CircuitBreaker(
+        failure_threshold=1, slow_call_secs=10, reset_timeout_secs=30
+    )
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(503)
+
+    async def post():
+        transport = AsyncCircuitBreakerTransport(
+            circuit_breaker, httpx.MockTransport(handler)
+        )
+        async with httpx.AsyncClient(transport=transport) as http_client:
+            for _ in range(2):
+                await http_client.post(
+                    "https://moodle/webservice/rest/server.php",
+                    data={"wsfunction": "enrol_manual_enrol_users"},
+                )
+
+    with pytest.raises(MoodleCircuitOpenError):
+        asyncio.run(post())
+    assert len(requests) == 1
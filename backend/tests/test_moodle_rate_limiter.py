@@ -0,0 +1,132 @@
+import asyncio
+import httpx
+import pytest
+import requests
+from sqlalchemy import delete, select
+from rope.api.moodle_rate_limiter import (
+    AsyncRateLimitedTransport,
+    LocalTokenBucketBackend,
+    MoodleRateLimiter,
+    PostgresTokenBucketBackend,
+    RateLimitedAdapter,
+    get_moodle_rate_limiter,
+    parse_rate_limits,
+)
+from rope.db.schema import MoodleRateLimitBucket
+
+
+def test_parse_rate_limits():
+    assert parse_rate_limits("") == {}
+    assert parse_rate_limits(
+        "default=20:40, core_user_get_users_by_field=5:10"
+    ) == {
+        "default": (20, 40),
+        "core_user_get_users_by_field": (5, 10),
+    }
+
+
+def test_get_moodle_rate_limiter(mocker):
+    mock_settings = mocker.patch("rope.api.moodle_rate_limiter.settings")
+    mock_settings.MOODLE_RATE_LIMITS = ""
+    assert get_moodle_rate_limiter(mocker.Mock()) is None
+
+    mock_settings.MOODLE_RATE_LIMITS = "default=20:40"
+    mock_settings.MOODLE_RATE_LIMIT_BACKEND = "postgres"
+    rate_limiter = get_moodle_rate_limiter(mocker.Mock())
+    assert isinstance(rate_limiter.backend, PostgresTokenBucketBackend)
+    assert rate_limiter.rate_limits == {"default": (20, 40)}
+
+    mock_settings.MOODLE_RATE_LIMIT_BACKEND = "local"
+    rate_limiter = get_moodle_rate_limiter(mocker.Mock())
+    assert isinstance(rate_limiter.backend, LocalTokenBucketBackend)
+
+
+def test_local_token_bucket_backend(mocker):
+    monotonic = mocker.patch(
+        "rope.api.moodle_rate_limiter.time.monotonic", return_value=100
+    )
+    backend = LocalTokenBucketBackend()
+
+    assert [backend.reserve("default", 2, 2) for _ in range(4)] == [0, 0, 0.5, 1]
+
+    # Refills at the rate from the debt left by the last reservation
+    monotonic.return_value = 101
+    assert backend.reserve("default", 2, 2) == 0.5
+    monotonic.return_value = 110
+    assert backend.reserve("default", 2, 2) == 0
+    assert backend.buckets["default"] == (1, 110)
+
+
+def test_moodle_rate_limiter_function_limits(mocker):
+    mocker.patch("rope.api.moodle_rate_limiter.time.monotonic", return_value=100)
+    rate_limiter = MoodleRateLimiter(
+        LocalTokenBucketBackend(),
+        {"default": (10, 10), "core_user_get_users_by_field": (1, 1)},
+    )
+
+    assert rate_limiter.reserve("core_user_get_users_by_field") == 0
+    assert rate_limiter.reserve("core_user_get_users_by_field") == 1
+    assert rate_limiter.reserve("enrol_manual_enrol_users") == 0
+    assert rate_limiter.backend.buckets["default"][0] == 7
+
+
+def test_rate_limited_adapter(mocker):
+    rate_limiter = mocker.Mock()
+    response = requests.Response()
+    response.status_code = 200
+    send = mocker.patch("requests.adapters.HTTPAdapter.send", return_value=response)
+
+    session = requests.Session()
+    session.mount("https://moodle", RateLimitedAdapter(rate_limiter))
+    session.post(
+        "https://moodle/webservice/rest/server.php",
+        data={"wsfunction": "core_user_get_users_by_field"},
+    )
+
+    rate_limiter.acquire.assert_called_once_with("core_user_get_users_by_field")
+    send.assert_called_once()
+
+
+def test_async_rate_limited_transport(mocker):
+    rate_limiter = mocker.Mock()
+    rate_limiter.reserve.return_value = 0
+
+    async def post():
+        transport = AsyncRateLimitedTransport(
+            rate_limiter, httpx.MockTransport(lambda request: httpx.Response(200))
+        )
+        async with httpx.AsyncClient(transport=transport) as http_client:
+            return await http_client.post(
+                "https://moodle/webservice/rest/server.php",
+                data={"wsfunction": "enrol_manual_enrol_users"},
+            )
+
+    response = asyncio.run(post())
+
+    assert response.status_code == 200
+    rate_limiter.reserve.assert_called_once_with("enrol_manual_enrol_users")
+
+
+@pytest.fixture
+def clear_rate_limit_buckets(db):
+    db.execute(delete(MoodleRateLimitBucket))
+    db.commit()
+    yield
+    db.execute(delete(MoodleRateLimitBucket))
+    db.commit()
+
+
+def test_postgres_token_bucket_backend(db, clear_rate_limit_buckets):
+    backend = PostgresTokenBucketBackend(lambda: lambda: db)
+
+    assert backend.reserve("default", 1, 2) == 0
+    assert backend.reserve("default", 1, 2) == 0
+    assert backend.reserve("default", 1, 2) == pytest.approx(1, abs=0.1)
+    assert backend.reserve("default", 1, 2) == pytest.approx(2, abs=0.1)
+
+    tokens = db.scalar(
+        select(MoodleRateLimitBucket.tokens).where(
+            MoodleRateLimitBucket.name == "default"
+        )
+    )
+    assert tokens == pytest.approx(-2, abs=0.1)
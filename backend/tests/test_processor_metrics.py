@@ -0,0 +1,70 @@
+import json
+import logging
+import pytest
+from prometheus_client import REGISTRY
+from rope.api.processors import metrics
+
+
+def get_start_latency_samples():
+    return (
+        REGISTRY.get_sample_value("rope_course_build_start_latency_seconds_sum"),
+        REGISTRY.get_sample_value("rope_course_build_start_latency_seconds_count"),
+    )
+
+
+def test_observe_start_latency(mocker):
+    mocker.patch("time.time", return_value=1700000030.0)
+    initial_sum, initial_count = get_start_latency_samples()
+
+    metrics.observe_start_latency({"Attributes": {"SentTimestamp": "1700000000000"}})
+
+    latency_sum, latency_count = get_start_latency_samples()
+    assert latency_sum - initial_sum == 30
+    assert latency_count - initial_count == 1
+
+
+def test_observe_start_latency_without_timestamp():
+    initial_samples = get_start_latency_samples()
+
+    metrics.observe_start_latency({"ReceiptHandle": "message1"})
+
+    assert get_start_latency_samples() == initial_samples
+
+
+def get_stage_samples(stage):
+    return (
+        REGISTRY.get_sample_value(
+            "rope_course_build_stage_duration_seconds_sum", {"stage": stage}
+        )
+        or 0,
+        REGISTRY.get_sample_value(
+            "rope_course_build_stage_duration_seconds_count", {"stage": stage}
+        )
+        or 0,
+    )
+
+
+def test_stage_timer(mocker, caplog):
+    mocker.patch("time.perf_counter", side_effect=[0, 1, 1, 3, 5, 9])
+    initial_sum, initial_count = get_stage_samples("moodle_role_lookup")
+
+    timer = metrics.StageTimer()
+    with timer.stage("moodle_role_lookup"):
+        pass
+    with timer.stage("moodle_role_lookup"):
+        pass
+    with pytest.raises(Exception):
+        with timer.stage("moodle_create_course"):
+            raise Exception("Moodle is down")
+    with caplog.at_level(logging.INFO):
+        timer.report("course_build_timings", course_build_id=7)
+
+    assert timer.timings == {"moodle_role_lookup": 3, "moodle_create_course": 4}
+    stage_sum, stage_count = get_stage_samples("moodle_role_lookup")
+    assert stage_sum - initial_sum == 3
+    assert stage_count - initial_count == 1
+    assert json.loads(caplog.records[-1].getMessage()) == {
+        "event": "course_build_timings",
+        "course_build_id": 7,
+        "stage_secs": {"moodle_role_lookup": 3, "moodle_create_course": 4},
+    }
@@ -36,9 +36,14 @@ const FiltersContainer = styled.div`
     }
   }
 `
+const Button = styled.button`
+  padding: 8px 16px;
+  margin-top: 10px;
+`
 
 function Page(): JSX.Element {
   const [courseBuilds, setCourseBuilds] = useState<CourseBuild[]>([])
+  const [nextAfterId, setNextAfterId] = useState<number | null>(null)
   const [filteredData, setFilteredData] = useState<CourseBuild[]>([])
   const [filters, setFilters] = useState<{ email: string, academicYear: string }>({
     email: '',
@@ -49,10 +54,12 @@ function Page(): JSX.Element {
     void fetchData()
   }, [])
 
-  const fetchData = async (): Promise<void> => {
+  // Builds are loaded a page at a time and only filtered once loaded
+  const fetchData = async (afterId: number | null = null): Promise<void> => {
     try {
-      const data = await ropeApi.getAllCourseBuilds()
-      setCourseBuilds(data)
+      const page = await ropeApi.getAllCourseBuilds(afterId)
+      setCourseBuilds(loaded => afterId === null ? page.courseBuilds : [...loaded, ...page.courseBuilds])
+      setNextAfterId(page.nextAfterId)
     } catch (error) {
       console.error('Error fetching course builds:', error)
     }
@@ -175,6 +182,9 @@ function Page(): JSX.Element {
         highlightOnHover
         striped
       />
+      {nextAfterId !== null && (
+        <Button onClick={() => { void fetchData(nextAfterId) }}>Load More</Button>
+      )}
             </Container>
 
   )
@@ -59,6 +59,7 @@ describe('Courses page', async () => {
   it('fetches and displays course builds from API', async () => {
     global.fetch = vi.fn().mockResolvedValue({
       ok: true,
+      headers: new Headers(),
       json: async () => await Promise.resolve(mockCourseBuilds)
     })
 
@@ -90,6 +91,7 @@ describe('Courses page', async () => {
   it('Filters by email and academic year', async () => {
     global.fetch = vi.fn().mockResolvedValue({
       ok: true,
+      headers: new Headers(),
       json: async () => await Promise.resolve(mockCourseBuilds)
     })
 
@@ -126,4 +128,43 @@ describe('Courses page', async () => {
     expect(screen.queryByText('enrollment_url3')).toBeInTheDocument()
     expect(screen.queryByText('key3')).toBeInTheDocument()
   })
+  it('loads the next page of course builds on request', async () => {
+    global.fetch = vi.fn()
+      .mockResolvedValueOnce({
+        ok: true,
+        headers: new Headers({ 'X-Next-After-Id': '100' }),
+        json: async () => await Promise.resolve(mockCourseBuilds.slice(0, 2))
+      })
+      .mockResolvedValueOnce({
+        ok: true,
+        headers: new Headers(),
+        json: async () => await Promise.resolve(mockCourseBuilds.slice(2))
+      })
+
+    // eslint-disable-next-line @typescript-eslint/consistent-type-assertions
+    const pageContext = {
+      urlPathname: '/courses'
+    } as PageContext
+
+    render(
+          <PageContextProvider pageContext={pageContext}>
+        <AuthContext.Provider value={{ status: AuthStatus.SignedIn, isAdmin: true, isManager: false, email: 'rice@rice.edu' }}>
+          <Page>
+          </Page>
+        </AuthContext.Provider>
+        </PageContextProvider>
+    )
+
+    await screen.findByText('Algebra 1 - Avi Drexler (AY 2040)')
+    expect(global.fetch).toHaveBeenCalledTimes(1)
+    expect(global.fetch).toHaveBeenCalledWith('/api/moodle/course/build')
+    expect(screen.queryByText('Algebra 1 - Prabhdip Gill (AY 2040)')).not.toBeInTheDocument()
+
+    fireEvent.click(screen.getByText('Load More'))
+
+    await screen.findByText('Algebra 1 - Prabhdip Gill (AY 2040)')
+    expect(screen.queryByText('Algebra 1 - Avi Drexler (AY 2040)')).toBeInTheDocument()
+    expect(global.fetch).toHaveBeenNthCalledWith(2, '/api/moodle/course/build?after_id=100')
+    expect(screen.queryByText('Load More')).not.toBeInTheDocument()
+  })
 })
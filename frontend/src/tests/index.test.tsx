@@ -8,6 +8,7 @@ import { PageContextProvider } from '../components/usePageContext'
 const createFetchResponse = (data: unknown): unknown => {
   return {
     ok: true,
+    headers: new Headers(),
     json: async () => await Promise.resolve(data)
   }
 }
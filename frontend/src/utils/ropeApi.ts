@@ -49,7 +49,7 @@ function convertApiUserToUser(apiUser: { email: string, is_admin: boolean, is_ma
   }
 }
 
-function convertApiCourseBuildToCourseBuild(apiCourseBuild: {
+interface ApiCourseBuild {
   id: number
   instructor_firstname: string
   instructor_lastname: string
@@ -64,8 +64,9 @@ function convertApiCourseBuildToCourseBuild(apiCourseBuild: {
   course_id?: number
   course_enrollment_url?: string
   course_enrollment_key?: string
+}
 
-}): CourseBuild {
+function convertApiCourseBuildToCourseBuild(apiCourseBuild: ApiCourseBuild): CourseBuild {
   return {
     buildId: apiCourseBuild.id,
     instructorFirstName: apiCourseBuild.instructor_firstname,
@@ -84,6 +85,28 @@ function convertApiCourseBuildToCourseBuild(apiCourseBuild: {
   }
 }
 
+export interface CourseBuildPage {
+  courseBuilds: CourseBuild[]
+  nextAfterId: number | null
+}
+
+// The API returns builds a page at a time and sets X-Next-After-Id to the id
+// the next page starts after until the last page
+async function fetchCourseBuildPage(url: string, errorMessage: string): Promise<CourseBuildPage> {
+  const response = await fetch(url)
+
+  if (!response.ok) {
+    throw new Error(errorMessage)
+  }
+
+  const courseBuildsFromApi: ApiCourseBuild[] = await response.json()
+  const nextAfterId = response.headers.get('X-Next-After-Id')
+  return {
+    courseBuilds: courseBuildsFromApi.map(convertApiCourseBuildToCourseBuild),
+    nextAfterId: nextAfterId === null ? null : Number(nextAfterId)
+  }
+}
+
 function convertApiMoodleUsertoMoodleUser(apiMoodleUser: { first_name: string, last_name: string, email: string }): MoodleUser | null {
   if (apiMoodleUser === null) {
     return null
@@ -245,54 +268,15 @@ export const ropeApi = {
     return updatedDistrict
   },
 
+  // An instructor has at most one build per academic year so it always fits
+  // in the first page
   getCourseBuilds: async (academicYear: string, instructorEmail: string): Promise<CourseBuild[]> => {
-    const response = await fetch(`/api/moodle/course/build?academic_year=${academicYear}&instructor_email=${instructorEmail}`)
-
-    if (!response.ok) {
-      throw new Error('Failed to get course builds')
-    }
-
-    const courseBuildsFromApi = await response.json()
-    const courseBuilds: CourseBuild[] = courseBuildsFromApi.map((courseBuild: {
-      id: number
-      instructor_firstname: string
-      instructor_lastname: string
-      instructor_email: string
-      school_district_name: string
-      academic_year: string
-      academic_year_short: string
-      course_name: string
-      course_shortname: string
-      creator_email: string
-      status: string
-    }) => convertApiCourseBuildToCourseBuild(courseBuild))
-    return courseBuilds
+    const page = await fetchCourseBuildPage(`/api/moodle/course/build?academic_year=${academicYear}&instructor_email=${instructorEmail}`, 'Failed to get course builds')
+    return page.courseBuilds
   },
-  getAllCourseBuilds: async (): Promise<CourseBuild[]> => {
-    const response = await fetch('/api/moodle/course/build')
-
-    if (!response.ok) {
-      throw new Error('Failed to get all course builds')
-    }
-
-    const courseBuildsFromApi = await response.json()
-    const courseBuilds: CourseBuild[] = courseBuildsFromApi.map((courseBuild: {
-      id: number
-      instructor_firstname: string
-      instructor_lastname: string
-      instructor_email: string
-      school_district_name: string
-      academic_year: string
-      academic_year_short: string
-      course_name: string
-      course_shortname: string
-      creator_email: string
-      status: string
-      course_id: number
-      course_enrollment_url: string
-      course_enrollment_key: string
-    }) => convertApiCourseBuildToCourseBuild(courseBuild))
-    return courseBuilds
+  getAllCourseBuilds: async (afterId: number | null = null): Promise<CourseBuildPage> => {
+    const url = afterId === null ? '/api/moodle/course/build' : `/api/moodle/course/build?after_id=${afterId}`
+    return await fetchCourseBuildPage(url, 'Failed to get all course builds')
   },
 
   createCourseBuild: async (instructorFirstName: string, instructorLastName: string, instructorEmail: string, schoolDistrictName: string): Promise<CourseBuild> => {